@@ -0,0 +1,193 @@
+"""
+Timing and peak memory benchmark of the data analysis hot paths on seeded synthetic data.
+
+The data is generated into a local SQLite file (see benchmarks/synthetic_data.py), which is reused by later runs with
+the same scale and seed. Every path is timed several times (best run is reported) and run once more under tracemalloc
+for its peak memory. Results are written as JSON, and --compare fails (exit code 1) when a path got slower than a
+previous result file by more than a threshold, e.g. to compare two versions:
+
+    python -m benchmarks.hot_paths --events 100000 --output before.json
+    python -m benchmarks.hot_paths --events 100000 --compare before.json --max-slowdown 1.2
+
+extract_root_cause_pairs() is written in T-SQL (FOR XML PATH, GETDATE) and can not run on SQLite; the in-memory signal
+set mining of data_analysis/root_cause_signal_sets.py, which computes the same pairs, is measured instead.
+"""
+import argparse
+import contextlib
+import gc
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import matplotlib
+import pandas as pd
+import sqlalchemy
+from loguru import logger
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic_data import START_DATE, SyntheticDataSpec, create_synthetic_database
+from data_analysis import dataframes, plots
+from data_analysis.defect_event_root_cause import join_defect_event_root_cause_filter_behaviour_id, \
+    stream_defect_event_root_cause_filter_behaviour_id
+from data_analysis.root_cause_signal_sets import SignalIncidence, mine_signal_sets
+from dql_scripts import select_joins
+from phillip.crud import defect_event_root_cause as crud_queries
+
+DEFECTS = ["clogging"]
+STRAND_IDS = ["1_1", "2c_1"]
+SIGNALS_TO_EXCLUDE = ("casting_length_1", "casting_length_C")
+
+
+def measure(call: Callable[[], object], repeat: int) -> dict:
+    """Returns the best wall time of several runs and the peak memory allocated by Python during one more run"""
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        call()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"best_s": round(min(timings), 6), "mean_s": round(sum(timings) / len(timings), 6),
+            "peak_mib": round(peak_bytes / 1024 ** 2, 3)}
+
+
+def hot_paths(engine, spec: SyntheticDataSpec) -> Dict[str, Callable[[], object]]:
+    """Returns the calls to measure by name, all of them read from the synthetic database of the engine"""
+    end = START_DATE + timedelta(days=spec.days)
+    session = Session(engine)
+
+    # Inputs of the DataFrame paths are prepared once, so only the path itself is measured
+    root_causes = join_defect_event_root_cause_filter_behaviour_id(session, DEFECTS, STRAND_IDS, START_DATE, end)
+    first_slab = root_causes[root_causes['slab_id'] == root_causes['slab_id'].iloc[0]]
+    core_rows, core_columns = (lambda result: (result.fetchall(), list(result.keys())))(
+        session.execute(select_joins.select_join_core_stmt1))
+    slab_signals = dataframes.df_from_group(first_slab)
+
+    def plot_first_slab():
+        import matplotlib.pyplot as plt
+
+        figure = plt.figure(figsize=(10, 8))
+        plots.plot_multi(data=slab_signals, title="S0", defect="Slivers")
+        plt.close(figure)
+
+    paths = {
+        "data_analysis.join_defect_event_root_cause_filter_behaviour_id":
+            lambda: join_defect_event_root_cause_filter_behaviour_id(session, DEFECTS, STRAND_IDS, START_DATE, end),
+        "data_analysis.stream_defect_event_root_cause_filter_behaviour_id":
+            lambda: sum(len(chunk) for chunk in stream_defect_event_root_cause_filter_behaviour_id(
+                session, DEFECTS, STRAND_IDS, START_DATE, end)),
+        "phillip.crud.join_defect_event_root_cause_filter_behaviour_id":
+            lambda: crud_queries.join_defect_event_root_cause_filter_behaviour_id(session, DEFECTS, STRAND_IDS,
+                                                                                  START_DATE, end),
+        "data_analysis.root_cause_pairs (in-memory mining)":
+            lambda: mine_signal_sets(SignalIncidence.load(session, START_DATE, signals_to_exclude=SIGNALS_TO_EXCLUDE),
+                                     max_size=2, exact_event_size=True),
+        "data_analysis.df_from_group": lambda: dataframes.df_from_group(first_slab),
+        "data_analysis.decode_signal_data_batch": lambda: dataframes.decode_signal_data_batch(root_causes),
+        "data_analysis.create_df_from_sqlrows": lambda: dataframes.create_df_from_sqlrows(core_rows, core_columns),
+        "data_analysis.create_df_from_sql_request":
+            lambda: dataframes.create_df_from_sql_request(select_joins.select_join_orm_stmt1, engine),
+        "data_analysis.plot_multi": plot_first_slab,
+    }
+    if spec.with_compact_signal_data:
+        compact_root_causes = join_defect_event_root_cause_filter_behaviour_id(
+            session, DEFECTS, STRAND_IDS, START_DATE, end, compact_signal_data=True)
+        paths["data_analysis.join_defect_event_root_cause_filter_behaviour_id (compact)"] = \
+            lambda: join_defect_event_root_cause_filter_behaviour_id(session, DEFECTS, STRAND_IDS, START_DATE, end,
+                                                                     compact_signal_data=True)
+        paths["data_analysis.decode_signal_data_batch (compact)"] = \
+            lambda: dataframes.decode_signal_data_batch(compact_root_causes)
+    return paths
+
+
+def run(spec: SyntheticDataSpec, database: Path, repeat: int = 3, only: Optional[List[str]] = None) -> dict:
+    started = time.perf_counter()
+    engine = create_synthetic_database(database, spec)
+    setup_seconds = time.perf_counter() - started
+
+    results = {}
+    # Anything printed by the measured paths would mix with the JSON results on stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        for name, call in hot_paths(engine, spec).items():
+            if only and not any(pattern in name for pattern in only):
+                continue
+            results[name] = measure(call, repeat)
+            print(f"{name}: {results[name]}", file=sys.stderr)
+    engine.dispose()
+
+    return {
+        "spec": asdict(spec),
+        "setup_s": round(setup_seconds, 3),
+        "environment": {"python": platform.python_version(), "pandas": pd.__version__,
+                        "sqlalchemy": sqlalchemy.__version__, "platform": platform.platform()},
+        "results": results,
+    }
+
+
+def compare(results: dict, baseline: dict, max_slowdown: float) -> List[str]:
+    """Returns a message per path whose best time grew by more than the factor max_slowdown against the baseline"""
+    regressions = []
+    for name, result in results["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None or previous["best_s"] <= 0:
+            continue
+        slowdown = result["best_s"] / previous["best_s"]
+        if slowdown > max_slowdown:
+            regressions.append(f"{name} took {result['best_s']} s instead of {previous['best_s']} s ({slowdown:.2f}x)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10_000, help="number of defect events, ~2.5 root causes each")
+    parser.add_argument("--points-per-signal", type=int, default=60, help="number of points per signal_data payload")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--compact", action="store_true", help="also fill and measure signal_data_compact")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed runs per path")
+    parser.add_argument("--database", type=Path, default=Path(tempfile.gettempdir()) / "benchmark_defects.db",
+                        help="SQLite file of the synthetic data, reused if its spec matches")
+    parser.add_argument("--only", nargs="*", help="only measure paths containing one of these strings")
+    parser.add_argument("--output", type=Path, help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", type=Path, help="JSON results of a previous run to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=1.25, help="allowed factor of the best time in --compare")
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    matplotlib.use("Agg")
+
+    spec = SyntheticDataSpec(events=args.events, points_per_signal=args.points_per_signal, seed=args.seed,
+                             with_compact_signal_data=args.compact)
+    results = run(spec, args.database, repeat=args.repeat, only=args.only)
+
+    regressions = []
+    if args.compare is not None:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.max_slowdown)
+        results["regressions"] = regressions
+
+    output = json.dumps(results, indent=2)
+    if args.output is not None:
+        args.output.write_text(output)
+    else:
+        print(output)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
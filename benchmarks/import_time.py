@@ -0,0 +1,111 @@
+"""
+Import time benchmark of the entry point modules.
+
+Every module is imported in a fresh interpreter with "python -X importtime". The benchmark fails (exit code 1) when a
+module takes longer than its budget or when importing it executes one of the heavy modules (pandas, numpy, matplotlib,
+pyodbc), which are supposed to be loaded lazily on first use (see phillip/lazy_imports.py).
+
+Run from the project root:
+    python -m benchmarks.import_time --budget-ms 1000 --repeat 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+MODULES = (
+    "main",
+    "db_engines.sql_server_engine",
+    "phillip.db_connection",
+    "phillip.crud.defect_event_root_cause",
+    "phillip.crud.defect_root_cause_pairs",
+    "data_analysis.dataframes",
+    "data_analysis.defect_event_root_cause",
+    "data_analysis.defect_root_cause_pairs",
+    "data_analysis.plots",
+)
+
+HEAVY_MODULES = ("pandas", "numpy", "matplotlib", "pyodbc")
+
+# Prints the heavy modules that were actually executed; lazily imported modules stay of type _LazyModule until used
+_PROBE = (
+    "import json, sys; import {module}; "
+    "print(json.dumps([name for name in {heavy!r} "
+    "if name in sys.modules and type(sys.modules[name]).__name__ != '_LazyModule']))"
+)
+
+
+def measure_import(module: str) -> Tuple[float, List[str]]:
+    """Imports a module in a new interpreter
+
+    Returns:
+        the cumulative import time of the module in milliseconds and the heavy modules executed by the import
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=PROJECT_ROOT,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(PROJECT_ROOT),
+                                                                      os.environ.get("PYTHONPATH")]))},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    cumulative_us = None
+    for line in completed.stderr.splitlines():
+        # Format: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.strip() == module:
+            cumulative_us = int(cumulative)
+    if cumulative_us is None:
+        raise RuntimeError(f"No import time reported for {module}:\n{completed.stderr}")
+    return cumulative_us / 1000, json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def run(modules=MODULES, repeat: int = 3) -> Dict[str, dict]:
+    """Measures all modules and keeps the best of several runs to reduce noise"""
+    results = {}
+    for module in modules:
+        timings = []
+        heavy_modules = []
+        for _ in range(repeat):
+            milliseconds, heavy_modules = measure_import(module)
+            timings.append(milliseconds)
+        results[module] = {"best_ms": round(min(timings), 1), "heavy_modules": heavy_modules}
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=1000.0, help="max. import time per module")
+    parser.add_argument("--repeat", type=int, default=3, help="number of imports per module")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args(argv)
+
+    results = run(args.modules, repeat=args.repeat)
+    failures = []
+    for module, result in results.items():
+        if result["best_ms"] > args.budget_ms:
+            failures.append(f"{module} took {result['best_ms']} ms (budget {args.budget_ms} ms)")
+        if result["heavy_modules"]:
+            failures.append(f"{module} eagerly imports {', '.join(result['heavy_modules'])}")
+
+    if args.json:
+        print(json.dumps({"budget_ms": args.budget_ms, "results": results, "failures": failures}, indent=2))
+    else:
+        for module, result in results.items():
+            print(f"{module:<45} {result['best_ms']:>8.1f} ms  {', '.join(result['heavy_modules'])}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
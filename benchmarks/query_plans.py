@@ -0,0 +1,173 @@
+"""
+Query plan check of the hot queries on a local SQLite stand-in.
+
+Every canonical query is executed with EXPLAIN QUERY PLAN against a SQLite database with the tables and indexes of
+phillip.db_models and seeded synthetic data (see benchmarks/synthetic_data.py, the statistics are gathered with
+ANALYZE). The check fails (exit code 1) when the plan of a query reads a table with a full scan instead of an index
+search, or sorts rows with a temporary b-tree where the order is supposed to come from an index.
+
+Run from the project root:
+    python -m benchmarks.query_plans --events 20000
+
+extract_root_cause_pairs() is written in T-SQL (FOR XML PATH, GETDATE) and can not run on SQLite, its filters are
+checked with a SQLite translation of the same WHERE clauses.
+"""
+import argparse
+import json
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from loguru import logger
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.engine import Connection, Engine
+
+from benchmarks.synthetic_data import START_DATE, SyntheticDataSpec, create_synthetic_database
+from data_analysis import defect_event_root_cause as analysis_queries
+from data_analysis.parallel_extraction import sharded_join_statement
+from data_analysis.root_cause_signal_sets import root_cause_incidence_query
+from phillip.crud import defect_event_root_cause as crud_queries
+from phillip.crud.pagination import defect_event_page_statement, root_causes_of_events_statement
+
+DEFECTS = ["clogging", "bulging"]
+STRAND_IDS = ["1_1", "2c_1"]
+CASTERS = ["1"]
+SIGNALS_TO_EXCLUDE = ["casting_length_1", "casting_length_C"]
+
+_SCAN = re.compile(r"^SCAN (\S+)")
+
+# SQLite translation of the filters of root_cause_pairs_query() in data_analysis/defect_root_cause_pairs.py
+root_cause_pairs_filter_clause = text(
+    "SELECT A.create_date, A.event_id, B.signal_id, A.behaviour_pattern_id, A.strand_id, A.slab_id, B.importance "
+    "FROM main.defect_event A INNER JOIN main.defect_root_cause B "
+    "   ON A.event_id=B.event_id "
+    "WHERE A.caster_id IN :casters AND A.event_id IN ("
+    "   SELECT event_id "
+    "   FROM main.defect_root_cause "
+    "   WHERE signal_id NOT IN :signals "
+    "       AND create_date BETWEEN :start_date AND :end_date "
+    "   GROUP BY event_id HAVING COUNT(event_id) > 1 AND COUNT(event_id) < 3)"
+).bindparams(bindparam("casters", expanding=True), bindparam("signals", expanding=True))
+
+
+class CanonicalQuery(NamedTuple):
+    """A hot query with representative bind parameters"""
+
+    statement: object
+    params: dict
+    ordered_by_index: bool = False  # if True, sorting with a temporary b-tree counts as a failure
+
+
+def canonical_queries() -> Dict[str, CanonicalQuery]:
+    start, end = START_DATE + timedelta(days=3), START_DATE + timedelta(days=4)
+    return {
+        "phillip.crud.behaviour_id_join": CanonicalQuery(
+            crud_queries.behaviour_id_join_statement,
+            crud_queries.behaviour_id_join_params(DEFECTS, STRAND_IDS, start, end)),
+        "data_analysis.behaviour_id_join": CanonicalQuery(
+            analysis_queries.get_behaviour_id_join_statement(),
+            analysis_queries.behaviour_id_join_params(DEFECTS, STRAND_IDS, start, end)),
+        "data_analysis.behaviour_id_join (compact, ordered by slab)": CanonicalQuery(
+            analysis_queries.get_behaviour_id_join_statement(ordered_by_slab=True, compact_signal_data=True),
+            analysis_queries.behaviour_id_join_params(DEFECTS, STRAND_IDS, start, end)),
+        "data_analysis.parallel_extraction time shard": CanonicalQuery(
+            sharded_join_statement(closed_end=False),
+            analysis_queries.behaviour_id_join_params(DEFECTS, STRAND_IDS, start, end)),
+        "data_analysis.parallel_extraction caster shard": CanonicalQuery(
+            sharded_join_statement(with_casters=True),
+            dict(analysis_queries.behaviour_id_join_params(DEFECTS, STRAND_IDS, start, end), casters=CASTERS)),
+        "data_analysis.root_cause_incidence": CanonicalQuery(
+            root_cause_incidence_query(start, casters=CASTERS, signals_to_exclude=SIGNALS_TO_EXCLUDE), {}),
+        "data_analysis.extract_root_cause_pairs (filters)": CanonicalQuery(
+            root_cause_pairs_filter_clause,
+            {"casters": CASTERS, "signals": SIGNALS_TO_EXCLUDE, "start_date": start, "end_date": end}),
+        "phillip.crud.pagination by event_id": CanonicalQuery(
+            defect_event_page_statement("event_id", True).limit(5_000), {"last_event_id": 1_000},
+            ordered_by_index=True),
+        "phillip.crud.pagination by create_date": CanonicalQuery(
+            defect_event_page_statement("create_date", True).limit(5_000),
+            {"last_create_date": start, "last_event_id": 1_000}, ordered_by_index=True),
+        "phillip.crud.pagination by create_date (filtered)": CanonicalQuery(
+            defect_event_page_statement("create_date", True, ("strand_ids", "start", "end")).limit(5_000),
+            {"strand_ids": STRAND_IDS, "start": start, "end": end, "last_create_date": start, "last_event_id": 1_000},
+            ordered_by_index=True),
+        "phillip.crud.pagination root causes": CanonicalQuery(
+            root_causes_of_events_statement, {"event_ids": list(range(1_000, 6_000))}),
+    }
+
+
+def explain_query_plan(connection: Connection, statement, params: dict) -> List[str]:
+    """Returns the details of the EXPLAIN QUERY PLAN rows of a statement
+
+    The statement is executed the regular way with the EXPLAIN prefix added to the final SQL text, so bind parameters
+    (including expanding IN lists) are processed exactly as for the query itself.
+    """
+    def _explain(conn, cursor, sql_text, parameters, context, executemany):
+        return "EXPLAIN QUERY PLAN " + sql_text, parameters
+
+    event.listen(connection, "before_cursor_execute", _explain, retval=True)
+    try:
+        result = connection.execute(statement, params)
+        rows = result.cursor.fetchall()
+        result.close()
+    finally:
+        event.remove(connection, "before_cursor_execute", _explain)
+    return [row[-1] for row in rows]
+
+
+def plan_violations(plan: List[str], ordered_by_index: bool = False) -> List[str]:
+    """Returns the plan steps which read a whole table or, if ordered_by_index, sort with a temporary b-tree"""
+    violations = [detail for detail in plan if _SCAN.match(detail) and not detail.startswith("SCAN CONSTANT ROW")]
+    if ordered_by_index:
+        violations += [detail for detail in plan if "USE TEMP B-TREE FOR ORDER BY" in detail]
+    return violations
+
+
+def check_query_plans(engine: Engine, only: Optional[List[str]] = None) -> Dict[str, dict]:
+    """Returns the plan and the violations per canonical query"""
+    results = {}
+    with engine.connect() as connection:
+        for name, query in canonical_queries().items():
+            if only and not any(pattern in name for pattern in only):
+                continue
+            plan = explain_query_plan(connection, query.statement, query.params)
+            results[name] = {"plan": plan, "violations": plan_violations(plan, query.ordered_by_index)}
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=20_000, help="number of synthetic defect events")
+    parser.add_argument("--database", type=Path, default=Path(tempfile.gettempdir()) / "query_plans_defects.db",
+                        help="SQLite file of the synthetic data, reused if its spec matches")
+    parser.add_argument("--only", nargs="*", help="only check queries containing one of these strings")
+    parser.add_argument("--json", action="store_true", help="print the plans as JSON")
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    engine = create_synthetic_database(args.database, SyntheticDataSpec(events=args.events))
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    results = check_query_plans(engine, only=args.only)
+    engine.dispose()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results.items():
+            print(f"{'FAIL' if result['violations'] else 'ok  '} {name}")
+            for detail in result["plan"]:
+                print(f"       {'!' if detail in result['violations'] else ' '} {detail}")
+    failed = [name for name, result in results.items() if result["violations"]]
+    if failed:
+        print(f"{len(failed)} of {len(results)} hot queries fall back to full scans or sorts: {failed}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Per-call overhead benchmark of the query builders.
+
+Compares building the select chain of a join on every call (as the query builders did before) with executing the
+module-level parameterised statements of phillip/crud/defect_event_root_cause.py and
+data_analysis/defect_event_root_cause.py. The statements are executed against an empty in-memory SQLite database, so the
+timings are dominated by the Python side: statement construction, cache key generation, compilation and result setup.
+
+Run from the project root:
+    python -m benchmarks.statement_construction --calls 2000
+"""
+import argparse
+import json
+import sys
+import timeit
+from datetime import datetime
+from typing import Callable, Dict
+
+from sqlalchemy import create_engine, select
+
+from ddl_scripts.creating_tables import DefectEvent as AnalysisDefectEvent
+from ddl_scripts.creating_tables import DefectRootCause as AnalysisDefectRootCause
+from data_analysis import defect_event_root_cause as analysis_queries
+from phillip.crud import defect_event_root_cause as crud_queries
+from phillip.db_models.base import Base
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.db_models.signal_meta import SignalMeta  # noqa: F401, registers the table referenced by DefectRootCause
+
+DEFECTS = ["clogging", "bulging"]
+STRAND_IDS = ["1_1", "1_2"]
+START = datetime(2023, 1, 16)
+END = datetime(2023, 1, 19)
+
+
+def build_event_id_join(event_id: int):
+    return select(DefectEvent.event_type,
+                  DefectEvent.event_id,
+                  DefectEvent.caster_id,
+                  DefectEvent.strand_id,
+                  DefectEvent.grade_id,
+                  DefectEvent.behaviour_pattern_id,
+                  DefectEvent.detection_probability,
+                  DefectRootCause.signal_id,
+                  DefectRootCause.importance
+                  ).join(DefectEvent, DefectRootCause.event_id == DefectEvent.event_id)\
+        .filter(DefectEvent.event_id == event_id)
+
+
+def build_behaviour_id_join(defects, strand_ids, start, end):
+    return select(AnalysisDefectEvent.create_date,
+                  AnalysisDefectEvent.event_type,
+                  AnalysisDefectEvent.event_id,
+                  AnalysisDefectEvent.caster_id,
+                  AnalysisDefectEvent.slab_id,
+                  AnalysisDefectEvent.strand_id,
+                  AnalysisDefectEvent.grade_id,
+                  AnalysisDefectEvent.behaviour_pattern_id,
+                  AnalysisDefectEvent.detection_probability,
+                  AnalysisDefectRootCause.signal_id,
+                  AnalysisDefectRootCause.importance,
+                  AnalysisDefectRootCause.signal_data
+                  ).join(AnalysisDefectEvent, AnalysisDefectRootCause.event_id == AnalysisDefectEvent.event_id)\
+        .filter(AnalysisDefectEvent.behaviour_pattern_id.in_(defects))\
+        .filter(AnalysisDefectEvent.strand_id.in_(strand_ids))\
+        .filter(AnalysisDefectEvent.create_date.between(start, end))
+
+
+def cases(connection) -> Dict[str, Dict[str, Callable[[], object]]]:
+    """Returns the calls to time per query, each with a "rebuilt" and a "cached" variant"""
+    analysis_statement = analysis_queries.get_behaviour_id_join_statement()
+    analysis_params = analysis_queries.behaviour_id_join_params(DEFECTS, STRAND_IDS, START, END)
+    return {
+        "crud.event_id_join": {
+            "rebuilt": lambda: connection.execute(build_event_id_join(19826)).fetchall(),
+            "cached": lambda: connection.execute(crud_queries.event_id_join_statement,
+                                                 {"event_id": 19826}).fetchall(),
+        },
+        "data_analysis.behaviour_id_join": {
+            "rebuilt": lambda: connection.execute(build_behaviour_id_join(DEFECTS, STRAND_IDS, START, END)).fetchall(),
+            "cached": lambda: connection.execute(analysis_statement, analysis_params).fetchall(),
+        },
+    }
+
+
+def run(calls: int = 2000, repeat: int = 3) -> Dict[str, dict]:
+    """Times every case and keeps the best of several runs to reduce noise
+
+    Returns:
+        the per-call time in microseconds of both variants and the speedup per query
+    """
+    engine = create_engine("sqlite://", future=False)
+    # SQLite names its default schema "main", so the schema-qualified data_analysis models find these tables as well
+    Base.metadata.create_all(engine)
+    results = {}
+    with engine.connect() as connection:
+        for name, variants in cases(connection).items():
+            timings = {}
+            for variant, call in variants.items():
+                call()  # warm up the compiled cache
+                best = min(timeit.repeat(call, number=calls, repeat=repeat))
+                timings[f"{variant}_us"] = round(best / calls * 1e6, 1)
+            timings["speedup"] = round(timings["rebuilt_us"] / timings["cached_us"], 2)
+            results[name] = timings
+    engine.dispose()
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000, help="number of calls per timing run")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timing runs per variant")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args(argv)
+
+    results = run(calls=args.calls, repeat=args.repeat)
+    if args.json:
+        print(json.dumps({"calls": args.calls, "results": results}, indent=2))
+    else:
+        for name, result in results.items():
+            print(f"{name:<35} rebuilt {result['rebuilt_us']:>8.1f} us  cached {result['cached_us']:>8.1f} us  "
+                  f"x{result['speedup']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Seeded synthetic defect data for benchmarks on a local SQLite stand-in of the SQL Server database.
+
+The same seed and scale always produce the same rows, so timings of different versions are comparable. Rows are
+generated batch by batch and written with the bulk insert path, so even the largest scales run with flat memory.
+"""
+import json
+import random
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from sqlalchemy.engine import Engine, make_url
+
+from phillip.crud.bulk_insert import bulk_insert, bulk_insert_defect_events, bulk_insert_defect_root_causes
+from phillip.db_connection import get_engine
+from phillip.db_models.base import Base
+from phillip.db_models.defect_event import BehaviourPattern, DefectEventType, ModelType
+from phillip.db_models.signal_codec import encode_signal_data
+from phillip.db_models.signal_meta import SignalMeta
+
+START_DATE = datetime(2023, 1, 1)
+CASTERS = {"1": ["1_1", "1_2"], "2c": ["2c_1", "2c_2"]}
+SIGNALS = (
+    "superheat_C", "tundish_weight_C", "cast_speed_C", "mold_taper_C_N", "argon_pressure_shroud_C",
+    "stopper_rod_C1_C", "mold_level_C_C1", "casting_length_1", "casting_length_C", "mold_water_flow_C",
+    "secondary_cooling_C", "slab_width_C", "segment_force_C", "oscillation_frequency_C", "tundish_temperature_C",
+)
+BEHAVIOURS = [BehaviourPattern.BULGING, BehaviourPattern.CLOGGING, BehaviourPattern.TUNDISH_VORTEX]
+
+
+@dataclass(frozen=True)
+class SyntheticDataSpec:
+    """Scale and seed of a synthetic data set"""
+
+    events: int = 10_000
+    max_root_causes_per_event: int = 4
+    points_per_signal: int = 60
+    events_per_slab: int = 4
+    days: int = 30
+    seed: int = 42
+    with_compact_signal_data: bool = False
+
+
+def _iter_events(spec: SyntheticDataSpec, rng: random.Random) -> Iterator[dict]:
+    seconds = spec.days * 24 * 3600
+    for event_id in range(1, spec.events + 1):
+        caster_id = rng.choice(list(CASTERS))
+        create_date = START_DATE + timedelta(seconds=seconds * (event_id - 1) / spec.events)
+        yield {
+            "event_id": event_id,
+            "event_type": DefectEventType.SLAB_BASED,
+            "created_at": create_date,
+            "create_date": create_date,
+            "update_date": create_date,
+            "caster_id": caster_id,
+            "strand_id": rng.choice(CASTERS[caster_id]),
+            "slab_id": f"S{(event_id - 1) // spec.events_per_slab:08d}",
+            "heat_id": f"H{(event_id - 1) // (spec.events_per_slab * 8):07d}",
+            "grade_id": rng.choice(["G100", "G200", "G300"]),
+            "model_name": "synthetic",
+            "model_number": 1,
+            "model_type": ModelType.RULE_BASED,
+            "data_start_time": create_date - timedelta(seconds=spec.points_per_signal),
+            "data_end_time": create_date,
+            "behaviour_pattern_id": rng.choice(BEHAVIOURS),
+            "detection_probability": round(rng.random(), 4),
+        }
+
+
+def _iter_root_causes(spec: SyntheticDataSpec, rng: random.Random) -> Iterator[dict]:
+    seconds = spec.days * 24 * 3600
+    for event_id in range(1, spec.events + 1):
+        create_date = START_DATE + timedelta(seconds=seconds * (event_id - 1) / spec.events)
+        data_start_time = create_date - timedelta(seconds=spec.points_per_signal)
+        times = [(data_start_time + timedelta(seconds=point)).isoformat() for point in range(spec.points_per_signal)]
+        for signal_id in rng.sample(SIGNALS, rng.randint(1, spec.max_root_causes_per_event)):
+            level = rng.uniform(10, 1000)
+            payload = {"signal_id": signal_id,
+                       "data": [[time, round(level + rng.gauss(0, level / 50), 3)] for time in times]}
+            row = {
+                "event_id": event_id,
+                "signal_id": signal_id,
+                "create_date": create_date,
+                "update_date": create_date,
+                "importance": round(rng.random(), 4),
+                "data_start_time": data_start_time,
+                "data_end_time": create_date,
+                "signal_data": payload,
+            }
+            if spec.with_compact_signal_data:
+                row["signal_data_compact"] = encode_signal_data(payload)
+            yield row
+
+
+def generate_synthetic_data(engine: Engine, spec: SyntheticDataSpec, batch_size: int = 5_000) -> dict:
+    """Creates the tables and fills them with the rows of a spec
+
+    Returns:
+        the number of rows per table
+    """
+    Base.metadata.create_all(engine)
+    signal_rows = [{"id": signal_id, "name": signal_id, "caster_id": "1", "category": "caster",
+                    "external_id": f"PI.{signal_id}", "units": "-"} for signal_id in SIGNALS]
+    counts = {"signal_meta": bulk_insert(engine, SignalMeta, signal_rows).rows}
+    # separate generators with their own seeds keep events and root causes independent of the batch size
+    counts["defect_event"] = bulk_insert_defect_events(
+        engine, _iter_events(spec, random.Random(spec.seed)), batch_size=batch_size).rows
+    counts["defect_root_cause"] = bulk_insert_defect_root_causes(
+        engine, _iter_root_causes(spec, random.Random(spec.seed + 1)), batch_size=batch_size).rows
+    return counts
+
+
+def create_synthetic_database(path, spec: SyntheticDataSpec) -> Engine:
+    """Returns the engine of a SQLite file with the data of a spec, generating the file if it does not exist yet
+
+    A JSON file next to the database records the spec, a file of another spec is regenerated.
+    """
+    path = Path(path)
+    spec_path = path.with_suffix(".spec.json")
+    if path.exists() and (not spec_path.exists() or json.loads(spec_path.read_text()) != asdict(spec)):
+        path.unlink()
+    engine = get_engine(make_url(f"sqlite:///{path}"), timeout=30)
+    if not spec_path.exists() or not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        generate_synthetic_data(engine, spec)
+        spec_path.write_text(json.dumps(asdict(spec)))
+    return engine
+
+
+def slab_ids(engine: Engine, limit: Optional[int] = None) -> List[str]:
+    """Returns the slab ids of a synthetic database in order"""
+    with engine.connect() as connection:
+        query = "SELECT DISTINCT slab_id FROM defect_event ORDER BY slab_id"
+        if limit is not None:
+            query += f" LIMIT {int(limit)}"
+        return [row[0] for row in connection.exec_driver_sql(query)]
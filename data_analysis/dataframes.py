@@ -2,19 +2,44 @@
 This script contains methods for creating pandas DataFrames from relations of a database using sql-statements
 """
 from __future__ import annotations
+import io
 import json
+from itertools import chain
 
-import pandas as pd
 import sqlalchemy
 from sqlalchemy.engine.row import Row, LegacyRow
 from loguru import logger
 
+from phillip.db_models.signal_codec import CompactSignal, decode_signal_data, is_compact_blob
+from phillip.frame_dtypes import apply_model_dtypes
+from phillip.lazy_imports import lazy_import
+
 from phillip.db_connection import create_session_from_url
 import dql_scripts.select_joins
 from db_engines.db_sources_data.sql_server_test_localhost import SQLServerTestDBs
 from db_engines.sql_server_engine import url_SQLServerTestDBMS
 from dql_scripts import select_joins as jnt_sel
-from db_engines.sql_server_engine import engine_sqlservertest_main as sqlserver_engine
+from db_engines.sql_server_engine import get_sqlservertest_engine
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Timestamps of the JSON payloads are ISO 8601 strings. Before pandas 2.0 an ISO format string selects the ISO 8601
+# parser, which also accepts fractional seconds and UTC offsets, pandas 2.0 has a dedicated "ISO8601" format for it
+ISO_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def frame_info(data: pd.DataFrame) -> str:
+    """
+    Returns the summary of DataFrame.info() as string instead of printing it to stdout
+    Use it with logger.opt(lazy=True), so the summary is only built if the log level is enabled:
+    logger.opt(lazy=True).debug("...: \n{}", lambda: frame_info(data))
+    :param data: the DataFrame to describe
+    :return: the summary with columns, non-null counts, dtypes and memory usage
+    """
+    buffer = io.StringIO()
+    data.info(buf=buffer)
+    return buffer.getvalue()
 
 
 def create_df_from_sqlrows(rows_data_list: list[Row | LegacyRow], columns_list: list) -> pd.DataFrame:
@@ -25,10 +50,12 @@ def create_df_from_sqlrows(rows_data_list: list[Row | LegacyRow], columns_list:
     with the new Union Type Operator T1 | T2 (introduced in Python 3.10 as alternative to the old Union[T1, T2] syntax.
     See https://docs.python.org/3.10/whatsnew/3.10.html#pep-604-new-type-union-operator
     :param columns_list: an iterable with the strings of attributes names of the select result
-    :return: a pandas dataframe with the data of the list with the selection result
+    :return: a pandas dataframe with the data of the list with the selection result, columns of the defect tables have
+    the compact dtypes of phillip/frame_dtypes.py
     """
-    result_df = pd.DataFrame(rows_data_list, columns=columns_list)
-    logger.debug("A DataFrame with following parameters was created from the list: \n", result_df.info())
+    result_df = apply_model_dtypes(pd.DataFrame(rows_data_list, columns=columns_list))
+    logger.opt(lazy=True).debug("A DataFrame with following parameters was created from the list: \n{}",
+                                lambda: frame_info(result_df))
 
     return result_df
 
@@ -39,10 +66,11 @@ def create_df_from_sql_request(select_statement, engine: sqlalchemy.engine, dtyp
     :param select_statement: SQL query to be executed on a DB
     :param engine: connection instance to a Database of the query, like SQLAlchemy engine
     :param dtype_dict: an optional dictionary of column names that are to be be parsed as strings instead of as objs
-    :return: a pandas dataframe with the data of the query result
+    :return: a pandas dataframe with the data of the query result, columns of the defect tables which are not in
+    dtype_dict have the compact dtypes of phillip/frame_dtypes.py
     """
 
-    return pd.read_sql_query(
+    result_df = pd.read_sql_query(
         # See https://pandas.pydata.org/docs/reference/api/pandas.read_sql_query.html#pandas.read_sql_query
         sql=select_statement,
         con=engine,
@@ -50,6 +78,103 @@ def create_df_from_sql_request(select_statement, engine: sqlalchemy.engine, dtyp
         # parse_dates={"update_date": "%c"},
         # parse_dates={"update_date": {"utc": True, "format": "%c"}}
     )
+    return apply_model_dtypes(result_df, exclude=dtype_dict)
+
+
+def _load_signal_payload(signal_data) -> dict | CompactSignal:
+    """ Returns the decoded signal_data payload of a root cause. Depending on the driver the JSON column is either
+    returned as a serialized string or already deserialized by SQLAlchemy
+    See https://docs.sqlalchemy.org/en/14/dialects/mssql.html#sqlalchemy.dialects.mssql.JSON
+    Blobs of the compact signal_data_compact column are decoded to a CompactSignal of NumPy arrays.
+    """
+    if is_compact_blob(signal_data):
+        return decode_signal_data(signal_data)
+    if isinstance(signal_data, (str, bytes, bytearray)):
+        # https://arctype.com/blog/json-database-when-use/
+        return json.loads(signal_data)
+    return signal_data
+
+
+def _flatten_json_payloads(payloads: list) -> tuple:
+    lengths = np.fromiter((len(payload['data']) for payload in payloads), dtype=np.int64, count=len(payloads))
+    signal_ids = np.array([payload['signal_id'] for payload in payloads], dtype=object)
+
+    points = np.array(list(chain.from_iterable(payload['data'] for payload in payloads)), dtype=object).reshape(-1, 2)
+    # Parsed with utc=True so naive and offset timestamps of several payloads end up in one datetime64 column instead of
+    # an object column, naive timestamps are taken as UTC like the naive timestamps of the compact payloads
+    iso_format = "ISO8601" if int(pd.__version__.split(".")[0]) >= 2 else ISO_TIME_FORMAT
+    times = pd.to_datetime(points[:, 0], format=iso_format, utc=True).tz_localize(None)
+    # Non-numeric values raise instead of silently turning into NaN
+    values = pd.to_numeric(points[:, 1], errors='raise').astype(np.float64)
+    return lengths, signal_ids, times, values
+
+
+def _flatten_compact_payloads(payloads: list) -> tuple:
+    # The arrays are concatenated as they are, no timestamp parsing or per point Python objects are needed
+    lengths = np.fromiter((len(payload) for payload in payloads), dtype=np.int64, count=len(payloads))
+    signal_ids = np.array([payload.signal_id for payload in payloads], dtype=object)
+    # datetimes() of timezone aware signals are already in UTC, so all timestamps are naive UTC like the JSON ones
+    times = pd.DatetimeIndex(np.concatenate([payload.datetimes() for payload in payloads]) if payloads
+                             else np.empty(0, dtype='datetime64[ns]'))
+    values = np.concatenate([payload.values for payload in payloads]).astype(np.float64, copy=False) if payloads \
+        else np.empty(0, dtype=np.float64)
+    return lengths, signal_ids, times, values
+
+
+def decode_signal_data_batch(root_causes: pd.DataFrame, key: str = 'slab_id') -> pd.DataFrame:
+    """ Decodes the signal_data payloads of a whole result set in one pass
+    All payloads are flattened into contiguous NumPy arrays of timestamps and values, so the timestamps are parsed with
+    a single pd.to_datetime() call and the wide frame is built with a single unstack() instead of one DataFrame and one
+    concat per root cause row. Payloads of the compact signal_data_compact column are already NumPy arrays and are
+    concatenated without parsing.
+    :param root_causes: a DataFrame of events and root cause data with a signal_data column, f.e. the result of
+    join_defect_event_root_cause_filter_behaviour_id()
+    Unlike one concat per payload, a timestamp occurs once per key and signal: if a signal has several points with the
+    same timestamp (or the same signal_id occurs in several root causes of a key), the last point is kept.
+    :param key: name of the column the signals are grouped by
+    :return: a DataFrame with a MultiIndex of (key, time) and one column of values per signal_id, the columns are in
+    the order in which the signals first occur in root_causes. The times are naive UTC timestamps, timezone aware
+    timestamps are converted to UTC and naive ones are taken as UTC
+    :raises ValueError: if a JSON payload contains a value which is not numeric or a timestamp which is not ISO 8601
+    """
+    payloads = [_load_signal_payload(signal_data) for signal_data in root_causes['signal_data'].to_numpy()]
+    is_compact = np.fromiter((isinstance(payload, CompactSignal) for payload in payloads), dtype=bool,
+                             count=len(payloads))
+    keys = root_causes[key].to_numpy()
+    signal_order = pd.unique(np.array([payload.signal_id if isinstance(payload, CompactSignal) else payload['signal_id']
+                                       for payload in payloads], dtype=object))
+
+    parts = []
+    if not is_compact.all() or not is_compact.any():
+        parts.append((keys[~is_compact],
+                      _flatten_json_payloads([payload for payload, compact in zip(payloads, is_compact)
+                                              if not compact])))
+    if is_compact.any():
+        parts.append((keys[is_compact],
+                      _flatten_compact_payloads([payload for payload, compact in zip(payloads, is_compact)
+                                                 if compact])))
+
+    signals_df = pd.concat([pd.DataFrame({key: np.repeat(part_keys, lengths),
+                                          'time': times,
+                                          'signal_id': np.repeat(signal_ids, lengths),
+                                          'value': values})
+                            for part_keys, (lengths, signal_ids, times, values) in parts], ignore_index=True)
+    signals_df = signals_df.drop_duplicates(subset=[key, 'time', 'signal_id'], keep='last')
+
+    wide_df = signals_df.set_index([key, 'time', 'signal_id'])['value'].unstack('signal_id')
+    # unstack() sorts the signal columns, the order of the root causes is restored
+    wide_df = wide_df.reindex(columns=[signal_id for signal_id in signal_order if signal_id in wide_df.columns])
+    wide_df.columns.name = None
+    return wide_df
+
+
+def split_signal_df(signals_df: pd.DataFrame) -> dict:
+    """ Splits a frame created by decode_signal_data_batch() into one DataFrame per key (f.e. per slab)
+    :param signals_df: a DataFrame with a MultiIndex of (key, time) and one column per signal_id
+    :return: a dictionary of keys with values of DataFrames indexed by time containing only the signals of this key
+    """
+    return {name: group.droplevel(0).dropna(axis='columns', how='all')
+            for name, group in signals_df.groupby(level=0, sort=False)}
 
 
 # TODO: Write a unit test with pytest!
@@ -61,18 +186,8 @@ def df_from_group(group: pd.DataFrame):
     :param group: A DataFrame of events and root cause data
     :return: a formatted DataFrame of signals data for a single event
     """
-    df_list = []
-    for index, row in group.iterrows():
-        signal_data = row['signal_data']
-        # https://arctype.com/blog/json-database-when-use/
-        signal_data_json = json.loads(signal_data)
-        print(signal_data_json)
-        signal_data_df = pd.DataFrame(signal_data_json['data'], columns=['time', signal_data_json['signal_id']])
-        signal_data_df['time'] = pd.to_datetime(signal_data_df['time'])
-        signal_data_df = signal_data_df.set_index('time')
-        df_list.append(signal_data_df)
-    df_concate = pd.concat(df_list, axis=1)
-    return df_concate
+    group = group.assign(_group=0)
+    return decode_signal_data_batch(group, key='_group').droplevel('_group')
 
 
 # For direct script execution without calling its methods in main.py:
@@ -81,6 +196,7 @@ if __name__ == "__main__":
     app_odbc_driver = "ODBC Driver 17 for SQL Server"
     URL = url_SQLServerTestDBMS + SQLServerTestDBs.MASTER_DB.value
     session = create_session_from_url(url=URL, odbc_driver=app_odbc_driver)
+    sqlserver_engine = get_sqlservertest_engine(SQLServerTestDBs.MASTER_DB)
 
     joins_scalar, cols1 = jnt_sel.get_select_join_orm_result(session,
                                                              jnt_sel.select_join_orm_stmt1)
@@ -92,13 +208,15 @@ if __name__ == "__main__":
     # Create a DataFrame from the list of the query result Rows created with ORM API
     scalars_df = create_df_from_sqlrows(joins_scalar, cols1)
     scalars_df.rename_axis("ORM_DF", axis="columns")
-    logger.info("A DataFrame with following parameters was created from the scalars list: \n", scalars_df.info())
+    logger.opt(lazy=True).info("A DataFrame with following parameters was created from the scalars list: \n{}",
+                               lambda: frame_info(scalars_df))
     logger.info(scalars_df.head(5))
 
     # Create a DataFrame from the list of the query result Rows created with Core API
     rows_df = create_df_from_sqlrows(joins_rows, cols2)
     rows_df.rename_axis("CORE_DF", axis="columns")
-    logger.info("A DataFrame with following parameters was created from the rows list: \n", rows_df.info())
+    logger.opt(lazy=True).info("A DataFrame with following parameters was created from the rows list: \n{}",
+                               lambda: frame_info(rows_df))
     logger.info(rows_df.head(5))
 
     # Create a DataFrame with pandas sql_query() + display infos of the DF
@@ -109,7 +227,8 @@ if __name__ == "__main__":
     )
     pa_query_df.rename_axis("SQL Query DF", axis="columns")
 
-    logger.info("A DataFrame with following parameters was created from the SQL query: \n", pa_query_df.info())
+    logger.opt(lazy=True).info("A DataFrame with following parameters was created from the SQL query: \n{}",
+                               lambda: frame_info(pa_query_df))
 
     logger.info("Showing first 5 rows of the DF: \n{0}"
                 .format(pa_query_df[:5])
@@ -1,18 +1,30 @@
 """ This script contains methods to analyse the defect root cause based on defect event """
+from __future__ import annotations
+
 from enum import Enum
-from typing import List
+from functools import lru_cache
+from itertools import product
+from typing import Iterator, List, Optional, Tuple
 from datetime import datetime
 
-from sqlalchemy import select
+from sqlalchemy import and_, bindparam, or_, select
 from sqlalchemy.types import DateTime
 from sqlalchemy.orm import Session
-import pandas as pd
 from loguru import logger
 
 from db_engines.db_sources_data.sql_server_test_localhost import SQLServerTestDBs
 from db_engines.sql_server_engine import url_SQLServerTestDBMS
+from data_analysis.signal_data_cache import SignalDataCache
 from ddl_scripts.creating_tables import DefectEvent, DefectRootCause
+from phillip.crud.partitioning import partitioned_select, partitions_for_window
+from phillip.crud.query_cache import QueryResultCache
+from phillip.crud.streaming import DEFAULT_CHUNK_ROWS, iter_result_frames, stream_execution_options
+from phillip.frame_dtypes import apply_model_dtypes, concat_frames
 from phillip.db_connection import create_session_from_url
+from phillip.db_models.signal_codec import compact_signal_data_enabled
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
 
 
 class BehaviourPattern(str, Enum):
@@ -23,8 +35,9 @@ class BehaviourPattern(str, Enum):
     TUNDISH_VORTEX = "tundish_vortex"
 
 
-def join_defect_event_root_cause() -> pd.DataFrame:
-    join_query = select(DefectEvent.event_type,
+# The statements are built once at import time and only the values of their bind parameters change per call, so
+# SQLAlchemy finds them in the compiled cache of the engine without constructing the select chains again
+join_statement = select(DefectEvent.event_type,
                         DefectEvent.event_id,
                         DefectEvent.caster_id,
                         DefectEvent.strand_id,
@@ -35,59 +48,299 @@ def join_defect_event_root_cause() -> pd.DataFrame:
                         DefectRootCause.signal_id,
                         DefectRootCause.importance
                         )\
-        .join(DefectEvent, DefectRootCause.event_id == DefectEvent.event_id)
+    .join(DefectEvent, DefectRootCause.event_id == DefectEvent.event_id)
 
-    result = session.execute(join_query).fetchall()
-    column_names = join_query.columns.keys()
-    return pd.DataFrame(data=result, columns=column_names)
+event_id_join_statement = select(DefectEvent.event_type,
+                                 DefectEvent.event_id,
+                                 DefectEvent.caster_id,
+                                 DefectEvent.strand_id,
+                                 DefectEvent.grade_id,
+                                 DefectEvent.behaviour_pattern_id,
+                                 DefectEvent.detection_probability,
+                                 DefectRootCause.signal_id,
+                                 DefectRootCause.importance
+                                 )\
+    .join(DefectEvent, DefectRootCause.event_id == DefectEvent.event_id)\
+    .filter(DefectEvent.event_id.in_(bindparam('event_ids', expanding=True)))
+
+
+def join_defect_event_root_cause() -> pd.DataFrame:
+    # Reads the archived partitions as well, see phillip/crud/partitioning.py
+    result = session.execute(partitioned_select(session.get_bind(), join_statement, None, None)).fetchall()
+    column_names = join_statement.columns.keys()
+    return apply_model_dtypes(pd.DataFrame(data=result, columns=column_names))
 
 
 def join_defect_event_root_cause_filter_event_id(*event_id_to_filter) -> pd.DataFrame:
     # *event_id_to_filter is a Python splat operator. See @ https://realpython.com/python-kwargs-and-args/
-    join_query = select(DefectEvent.event_type,
-                        DefectEvent.event_id,
-                        DefectEvent.caster_id,
-                        DefectEvent.strand_id,
-                        DefectEvent.grade_id,
-                        DefectEvent.behaviour_pattern_id,
-                        DefectEvent.detection_probability,
-                        DefectRootCause.signal_id,
-                        DefectRootCause.importance
-                        )\
-        .join(DefectEvent, DefectRootCause.event_id == DefectEvent.event_id)\
-        .filter(DefectEvent.event_id.in_(event_id_to_filter))
+    # The events may have been archived into any partition, see phillip/crud/partitioning.py
+    statement = partitioned_select(session.get_bind(), event_id_join_statement, None, None)
+    result = session.execute(statement, {'event_ids': list(event_id_to_filter)}).fetchall()
+    column_names = event_id_join_statement.columns.keys()
+    return apply_model_dtypes(pd.DataFrame(data=result, columns=column_names))
+
+
+# Max. number of bind parameters per statement when fetching signal data of cache misses (SQL Server allows 2100)
+SIGNAL_DATA_FETCH_BATCH = 1000
+
+
+@lru_cache(maxsize=None)
+def signal_data_fetch_statement(pairs: int):
+    """ Returns the statement fetching the signal_data of root causes by (event_id, signal_id) pairs
+    SQL Server knows no row value IN, so the pairs are combined with OR. Only the exact cache misses are fetched, not
+    the other root causes of their events. The statement is built once per number of pairs, callers pad their batches
+    to a power of two (see fill_signal_data_from_cache()), so only a handful of statements are compiled.
+    :param pairs: number of pairs, bound as event_id_<i> and signal_id_<i>
+    :return: a SQLAlchemy select statement
+    """
+    return select(DefectRootCause.event_id,
+                  DefectRootCause.signal_id,
+                  DefectRootCause.update_date,
+                  DefectRootCause.signal_data
+                  )\
+        .filter(or_(*(and_(DefectRootCause.event_id == bindparam(f'event_id_{index}'),
+                           DefectRootCause.signal_id == bindparam(f'signal_id_{index}'))
+                      for index in range(pairs))))
+
+
+def _build_behaviour_id_join_statement(with_signal_data: bool, ordered_by_slab: bool, compact_signal_data: bool):
+    if not with_signal_data:
+        signal_data_column = DefectRootCause.update_date.label('root_cause_update_date')
+    elif compact_signal_data:
+        signal_data_column = DefectRootCause.signal_data_compact.label('signal_data')
+    else:
+        signal_data_column = DefectRootCause.signal_data
+    statement = select(DefectEvent.create_date,
+                       DefectEvent.event_type,
+                       DefectEvent.event_id,
+                       DefectEvent.caster_id,
+                       DefectEvent.slab_id,
+                       DefectEvent.strand_id,
+                       DefectEvent.grade_id,
+                       DefectEvent.behaviour_pattern_id,
+                       DefectEvent.detection_probability,
+                       DefectRootCause.signal_id,
+                       DefectRootCause.importance,
+                       signal_data_column
+                       )\
+        .join(DefectEvent, DefectRootCause.event_id == DefectEvent.event_id) \
+        .filter(DefectEvent.behaviour_pattern_id.in_(bindparam('defects', expanding=True))) \
+        .filter(DefectEvent.strand_id.in_(bindparam('strand_ids', expanding=True))) \
+        .filter(DefectEvent.create_date.between(bindparam('start'), bindparam('end')))
+    if ordered_by_slab:
+        statement = statement.order_by(DefectEvent.slab_id, DefectEvent.event_id)
+    return statement
+
+
+_behaviour_id_join_statements = {flags: _build_behaviour_id_join_statement(*flags)
+                                 for flags in product((True, False), repeat=3)}
+
+
+def get_behaviour_id_join_statement(with_signal_data: bool = True, ordered_by_slab: bool = False,
+                                    compact_signal_data: Optional[bool] = None):
+    """ Returns the parameterised select statement of events with root causes filtered by behaviour, strand and time
+    The statement has to be executed with the parameters of behaviour_id_join_params().
+    :param with_signal_data: if False, the root cause update_date is selected as "root_cause_update_date" instead of
+    the signal_data payload, so the payloads can be looked up in a SignalDataCache
+    :param ordered_by_slab: if True, the rows are ordered by slab_id and event_id
+    :param compact_signal_data: if True, the signal_data column contains the decoded signal_data_compact column (see
+    phillip/db_models/signal_codec.py) instead of the JSON payload, None follows set_compact_signal_data()
+    :return: a SQLAlchemy select statement shared by all calls
+    """
+    return _behaviour_id_join_statements[(with_signal_data, ordered_by_slab,
+                                          compact_signal_data_enabled(compact_signal_data))]
+
 
-    result = session.execute(join_query).fetchall()
-    column_names = join_query.columns.keys()
-    return pd.DataFrame(data=result, columns=column_names)
+def behaviour_id_join_params(defects: List[BehaviourPattern],
+                             strand_ids: List[str],
+                             start: DateTime(),
+                             end: DateTime()) -> dict:
+    """ Creates the bind parameters of get_behaviour_id_join_statement()
+    :param defects: a list of behaviour patterns to filter
+    :param strand_ids: a list of strand ids to filter
+    :param start: start of the time window of the event creation date
+    :param end: end of the time window of the event creation date
+    :return: a dictionary of parameter values
+    """
+    return {'defects': list(defects), 'strand_ids': list(strand_ids), 'start': start, 'end': end}
+
+
+def behaviour_id_join_query(defects: List[BehaviourPattern],
+                            strand_ids: List[str],
+                            start: DateTime(),
+                            end: DateTime(),
+                            with_signal_data: bool = True):
+    """ Creates the select statement of events with root causes and signal data filtered by behaviour, strand and time
+    The parameter values are bound to a copy of get_behaviour_id_join_statement(), which is convenient for printing or
+    further refining the statement. Executing get_behaviour_id_join_statement() with behaviour_id_join_params() is
+    cheaper.
+    :param defects: a list of behaviour patterns to filter
+    :param strand_ids: a list of strand ids to filter
+    :param start: start of the time window of the event creation date
+    :param end: end of the time window of the event creation date
+    :param with_signal_data: if False, the root cause update_date is selected as "root_cause_update_date" instead of
+    the signal_data payload, so the payloads can be looked up in a SignalDataCache
+    :return: a SQLAlchemy select statement
+    """
+    return get_behaviour_id_join_statement(with_signal_data)\
+        .params(behaviour_id_join_params(defects, strand_ids, start, end))
 
 
 def join_defect_event_root_cause_filter_behaviour_id(session: Session,
                                                      defects: List[BehaviourPattern],
                                                      strand_ids: List[str],
                                                      start: DateTime(),
-                                                     end: DateTime()) -> pd.DataFrame:
-    join_query = select(DefectEvent.create_date,
-                        DefectEvent.event_type,
-                        DefectEvent.event_id,
-                        DefectEvent.caster_id,
-                        DefectEvent.slab_id,
-                        DefectEvent.strand_id,
-                        DefectEvent.grade_id,
-                        DefectEvent.behaviour_pattern_id,
-                        DefectEvent.detection_probability,
-                        DefectRootCause.signal_id,
-                        DefectRootCause.importance,
-                        DefectRootCause.signal_data
-                        )\
-        .join(DefectEvent, DefectRootCause.event_id == DefectEvent.event_id) \
-        .filter(DefectEvent.behaviour_pattern_id.in_(defects)) \
-        .filter(DefectEvent.strand_id.in_(strand_ids)) \
-        .filter(DefectEvent.create_date.between(start, end))
+                                                     end: DateTime(),
+                                                     signal_data_cache: Optional[SignalDataCache] = None,
+                                                     result_cache: Optional[QueryResultCache] = None,
+                                                     cache_ttl: Optional[float] = None,
+                                                     compact_signal_data: Optional[bool] = None
+                                                     ) -> pd.DataFrame:
+    join_statement = get_behaviour_id_join_statement(with_signal_data=signal_data_cache is None,
+                                                     compact_signal_data=compact_signal_data)
+    params = behaviour_id_join_params(defects, strand_ids, start, end)
+    # Reads the archived partitions of the window as well, see phillip/crud/partitioning.py
+    statement = partitioned_select(session.get_bind(), join_statement, start, end)
+
+    def query_data() -> pd.DataFrame:
+        result = session.execute(statement, params).fetchall()
+        column_names = join_statement.columns.keys()
+        data = apply_model_dtypes(pd.DataFrame(data=result, columns=column_names))
+        if signal_data_cache is not None:
+            data = fill_signal_data_from_cache(session, data, signal_data_cache)
+        return data
+
+    if result_cache is None:
+        return query_data()
+    # Repeated requests of the same behaviours, strands and time window are answered from the result cache
+    return result_cache.get_or_compute(key=result_cache.make_key(statement, session.get_bind().dialect, params),
+                                       compute=query_data,
+                                       ttl=cache_ttl,
+                                       tables=result_cache.statement_tables(statement))
+
+
+def stream_defect_event_root_cause_filter_behaviour_id(session: Session,
+                                                       defects: List[BehaviourPattern],
+                                                       strand_ids: List[str],
+                                                       start: DateTime(),
+                                                       end: DateTime(),
+                                                       chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                                                       max_chunk_bytes: Optional[int] = None,
+                                                       signal_data_cache: Optional[SignalDataCache] = None,
+                                                       compact_signal_data: Optional[bool] = None
+                                                       ) -> Iterator[pd.DataFrame]:
+    """ Streaming variant of join_defect_event_root_cause_filter_behaviour_id() for large time windows
+    Rows are fetched with a server-side cursor (where the driver supports it) and handed out as DataFrame chunks, so the
+    whole result with its signal_data never has to be held in memory at once. Rows are ordered by slab_id, so the chunks
+    can be regrouped slab by slab with iter_slab_groups().
+    :param session: a session to execute the query with
+    :param defects: a list of behaviour patterns to filter
+    :param strand_ids: a list of strand ids to filter
+    :param start: start of the time window of the event creation date
+    :param end: end of the time window of the event creation date
+    :param chunk_rows: maximum number of rows per DataFrame chunk
+    :param max_chunk_bytes: optional memory budget of a single DataFrame chunk in bytes
+    :param signal_data_cache: optional cache, signal_data is then only fetched for root causes missing in the cache
+    :param compact_signal_data: if True, signal_data is read from the compact binary column and contains CompactSignal
+    tuples of NumPy arrays instead of JSON payloads, None follows set_compact_signal_data() of
+    phillip/db_models/signal_codec.py. Ignored if a signal_data_cache is given
+    :return: an iterator of DataFrames with the same columns as join_defect_event_root_cause_filter_behaviour_id()
+    """
+    join_statement = get_behaviour_id_join_statement(with_signal_data=signal_data_cache is None,
+                                                     ordered_by_slab=True,
+                                                     compact_signal_data=compact_signal_data)
+
+    statement = partitioned_select(session.get_bind(), join_statement, start, end, order_by=('slab_id', 'event_id'))
+    result = session.execute(statement, behaviour_id_join_params(defects, strand_ids, start, end),
+                             execution_options=stream_execution_options(chunk_rows))
+    column_names = join_statement.columns.keys()
+    chunks = iter_result_frames(result, column_names, chunk_rows=chunk_rows, max_chunk_bytes=max_chunk_bytes)
+    if signal_data_cache is None:
+        return chunks
+    return _iter_chunks_filled_from_cache(session, chunks, signal_data_cache)
+
+
+def _iter_chunks_filled_from_cache(session: Session,
+                                   chunks: Iterator[pd.DataFrame],
+                                   cache: SignalDataCache) -> Iterator[pd.DataFrame]:
+    # The stream keeps the session's connection busy, so the cache misses are fetched on a separate session
+    with Session(bind=session.get_bind()) as misses_session:
+        for chunk in chunks:
+            yield fill_signal_data_from_cache(misses_session, chunk, cache)
+
+
+def fill_signal_data_from_cache(session: Session, data: pd.DataFrame, cache: SignalDataCache) -> pd.DataFrame:
+    """ Adds the signal_data column to a result of get_behaviour_id_join_statement(with_signal_data=False)
+    The payloads are looked up in the cache by (event_id, signal_id, root_cause_update_date); only the missing ones are
+    fetched from the DB and added to the cache.
+    :param session: a session to fetch the cache misses with
+    :param data: a DataFrame with event_id, signal_id and root_cause_update_date columns
+    :param cache: the cache of signal_data payloads
+    :return: the DataFrame with a signal_data column instead of the root_cause_update_date column
+    """
+    keys = [SignalDataCache.make_key(event_id, signal_id, update_date) for event_id, signal_id, update_date
+            in zip(data['event_id'], data['signal_id'], data['root_cause_update_date'])]
+    found, missing = cache.get_many(keys)
+    payloads = {(event_id, signal_id): payload for (event_id, signal_id, _), payload in found.items()}
+
+    missing_pairs = sorted({(event_id, signal_id) for event_id, signal_id, _ in missing})
+    # The rows may come from any archived partition, the pairs carry no creation date to prune them
+    partitions = partitions_for_window(session.get_bind(), None, None, schema=DefectRootCause.__table__.schema) \
+        if missing_pairs else []
+    pairs_per_batch = SIGNAL_DATA_FETCH_BATCH // 2
+    for batch_start in range(0, len(missing_pairs), pairs_per_batch):
+        batch = missing_pairs[batch_start:batch_start + pairs_per_batch]
+        # Padded with the last pair to the next power of two, the duplicates do not change the result
+        padded_size = 1 << (len(batch) - 1).bit_length()
+        batch = batch + [batch[-1]] * (padded_size - len(batch))
+        params = {}
+        for index, (event_id, signal_id) in enumerate(batch):
+            params[f'event_id_{index}'], params[f'signal_id_{index}'] = event_id, signal_id
+        statement = partitioned_select(session.get_bind(), signal_data_fetch_statement(padded_size), None, None,
+                                       partitions=partitions)
+        for event_id, signal_id, update_date, signal_data in session.execute(statement, params):
+            key = SignalDataCache.make_key(event_id, signal_id, update_date)
+            payloads[(event_id, signal_id)] = cache.put(key, signal_data) if signal_data is not None else None
+    logger.debug("signal_data cache: {} hits, {} fetched from the DB", len(found), len(missing))
+
+    data = data.drop(columns='root_cause_update_date')
+    data['signal_data'] = [payloads.get((int(event_id), str(signal_id)))
+                           for event_id, signal_id in zip(data['event_id'], data['signal_id'])]
+    return data
+
+
+def iter_complete_slab_chunks(chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """ Re-cuts DataFrame chunks ordered by slab_id so that no slab is split between two chunks
+    The rows of the last slab of a chunk are held back until the next chunk shows that the slab is complete. Rows without
+    a slab_id are skipped the same way DataFrame.groupby() skips them.
+    :param chunks: DataFrame chunks ordered by slab_id, f.e. from stream_defect_event_root_cause_filter_behaviour_id()
+    :return: an iterator of DataFrames each containing all rows of one or more complete slabs
+    """
+    pending = None
+    for chunk in chunks:
+        chunk = chunk[chunk['slab_id'].notna()]
+        if pending is not None:
+            chunk = concat_frames([pending, chunk])
+        if chunk.empty:
+            continue
+
+        last_slab_id = chunk['slab_id'].iloc[-1]
+        is_last_slab = chunk['slab_id'] == last_slab_id
+        pending = chunk[is_last_slab]
+        if not is_last_slab.all():
+            yield chunk[~is_last_slab]
+
+    if pending is not None and not pending.empty:
+        yield pending
+
 
-    result = session.execute(join_query).fetchall()
-    column_names = join_query.columns.keys()
-    return pd.DataFrame(data=result, columns=column_names)
+def iter_slab_groups(chunks: Iterator[pd.DataFrame]) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """ Regroups DataFrame chunks ordered by slab_id into one DataFrame per slab
+    :param chunks: DataFrame chunks ordered by slab_id, f.e. from stream_defect_event_root_cause_filter_behaviour_id()
+    :return: an iterator of tuples of a slab_id and a DataFrame with all rows of this slab
+    """
+    for chunk in iter_complete_slab_chunks(chunks):
+        yield from chunk.groupby('slab_id', sort=False)
 
 
 # For direct script execution without calling its methods in main.py:
@@ -3,14 +3,22 @@ from __future__ import annotations
 
 from enum import Enum
 
-from sqlalchemy import text, bindparam
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-import pandas as pd
 from loguru import logger
 
+from data_analysis.dataframes import frame_info
 from db_engines.db_sources_data.sql_server_test_localhost import SQLServerTestDBs
 from db_engines.sql_server_engine import url_SQLServerTestDBMS
+from ddl_scripts.creating_tables import DefectEvent, DefectRootCause
+from phillip.crud.defect_root_cause_pairs import root_cause_pairs_frame, root_cause_pairs_params, \
+    root_cause_pairs_select
+from phillip.crud.partitioning import partitioned_select
+from phillip.crud.query_cache import QueryResultCache
 from phillip.db_connection import create_session_from_url
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
 
 
 class Casters(str, Enum):
@@ -81,39 +89,34 @@ def root_cause_pairs_query(date: str, casters: tuple[str, ...] | str, signals: t
     return root_cause_groups
 
 
+# Portable counterpart of root_cause_pairs_query() with bind parameters, see phillip/crud/defect_root_cause_pairs.py.
+# Unlike the T-SQL query it reads the archived partitions as well and runs on every backend
+root_cause_pairs_statement = root_cause_pairs_select(DefectEvent.__table__, DefectRootCause.__table__,
+                                                     with_casters=True)
+
+
 def extract_root_cause_pairs(
         session: Session,
         date: str,
         casters_to_filter: tuple[Casters, ...] | Casters,
-        signals_to_filter: tuple[str, ...] | str
+        signals_to_filter: tuple[str, ...] | str,
+        result_cache: QueryResultCache | None = None,
+        cache_ttl: float | None = None
 ) -> pd.DataFrame:
     # tuple[str] vs tuple[str, ...] see: https://stackoverflow.com/questions/72001132/python-typing-tuplestr-vs-tuplestr
 
-    # Option 1:
     # Solution for binding non-scalar vars as param of string queries: https://stackoverflow.com/a/56382828
-    # text_statement = create_root_cause_groups_text_clause.bindparams(
-    #     bindparam('casters', expanding=True),
-    #     bindparam('signals', expanding=True)
-    # )
-
-    # Option 2:
-    if isinstance(casters_to_filter, tuple):
-        query = root_cause_pairs_query(
-            date=date, signals=signals_to_filter,
-            casters=tuple(map(lambda x: x.value, casters_to_filter))  # https://realpython.com/python-lambda/#classic-functional-constructs
-        )
-    elif isinstance(casters_to_filter, str):  # TODO: for f-String statements there has to be another statement with no "with in"!
-        query = root_cause_pairs_query(date=date, signals=signals_to_filter, casters=tuple(casters_to_filter))
-    with session as s:
-        # result = s.execute(text_statement, params={
-        #     'start_date': date,
-        #     'casters': casters_to_filter,
-        #     'signals': signals_to_filter
-        # })
-        result = s.execute(query)
-
-        column_names = list(result.keys())
-        return pd.DataFrame(data=result, columns=column_names)
+    # The window filters the root cause creation date, not the event month of the partitions, so all are read
+    statement = partitioned_select(session.get_bind(), root_cause_pairs_statement, None, None,
+                                   order_by=('event_id', 'signal_id'))
+    casters = [casters_to_filter] if isinstance(casters_to_filter, str) else casters_to_filter
+    signals = [signals_to_filter] if isinstance(signals_to_filter, str) else signals_to_filter
+    params = root_cause_pairs_params(date, signals, casters=casters)
+    if result_cache is not None:
+        return root_cause_pairs_frame(result_cache.read_frame(session=session, statement=statement, params=params,
+                                                              ttl=cache_ttl))
+    rows = session.execute(statement, params).fetchall()
+    return root_cause_pairs_frame(pd.DataFrame(data=rows, columns=root_cause_pairs_statement.columns.keys()))
 
 
 # For direct script execution without calling its methods in main.py:
@@ -125,8 +128,8 @@ if __name__ == "__main__":
     data = extract_root_cause_pairs(
         session=session,
         date='2022-12-23',
-        casters_to_filter=(Casters.CASTER_1, Casters.CASTER_1),  # TODO: for f-String statements there needs to be another implementation for single values
-        signals_to_filter=("casting_length_1", "casting_length_C")  # TODO: for f-String statements there needs to be another implementation for single values
+        casters_to_filter=Casters.CASTER_1,
+        signals_to_filter=("casting_length_1", "casting_length_C")
     )
-    logger.info(data.info())
+    logger.opt(lazy=True).info("{}", lambda: frame_info(data))
     logger.info(data)
@@ -0,0 +1,127 @@
+""" This script contains methods for reducing the number of points of signals before plotting them
+
+A figure can not show more points than it has pixels, so signals with hundreds of thousands of samples per slab are
+reduced to a target number of points per axis which preserves their visual shape:
+- "minmax" keeps the smallest and the largest value of every pixel-wide time bucket, so peaks and dips stay visible
+- "lttb" (Largest-Triangle-Three-Buckets) keeps the point per bucket spanning the largest triangle with its neighbours
+See https://skemman.is/bitstream/1946/15343/3/SS_MSthesis.pdf for both methods
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, Optional
+
+from phillip.lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# A figure of 10 inches width at 100 dpi has 1000 pixel columns, min/max keeps two points per column
+DEFAULT_TARGET_POINTS = 2000
+DOWNSAMPLING_METHODS = ("minmax", "lttb")
+
+
+def _x_values(index: pd.Index) -> np.ndarray:
+    if isinstance(index, pd.DatetimeIndex):
+        return index.asi8.astype(np.float64)
+    return index.to_numpy(dtype=np.float64)
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, target_points: int) -> np.ndarray:
+    """ Returns the positions of the min and max value of each of target_points // 2 equally wide buckets of x
+    :param x: sorted x values
+    :param y: y values without NaN
+    :param target_points: max. number of positions to return, at least 2
+    :return: sorted positions into x and y, including the first and the last point
+    """
+    n_buckets = max(1, (target_points - 2) // 2)
+    span = x[-1] - x[0]
+    if span <= 0:
+        bucket_ids = np.zeros(len(x), dtype=np.int64)
+    else:
+        bucket_ids = np.minimum(((x - x[0]) / span * n_buckets).astype(np.int64), n_buckets - 1)
+    # x is sorted, so every bucket is a contiguous run; only non-empty buckets have a start
+    starts = np.flatnonzero(np.diff(bucket_ids, prepend=-1))
+    sizes = np.diff(np.append(starts, len(y)))
+    run_ids = np.repeat(np.arange(len(starts)), sizes)
+
+    positions = [np.array([0, len(y) - 1])]
+    for bucket_extreme in (np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)):
+        # first position of each run at which the value equals the extreme of the run
+        hits = np.flatnonzero(y == np.repeat(bucket_extreme, sizes))
+        _, first_hits = np.unique(run_ids[hits], return_index=True)
+        positions.append(hits[first_hits])
+    return np.unique(np.concatenate(positions))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, target_points: int) -> np.ndarray:
+    """ Returns the positions of the points selected by Largest-Triangle-Three-Buckets
+    The triangle areas of all candidates of a bucket are computed at once, only the loop over the buckets is in Python.
+    :param x: sorted x values
+    :param y: y values without NaN
+    :param target_points: number of positions to return, at least 3
+    :return: sorted positions into x and y, including the first and the last point
+    """
+    n = len(x)
+    n_buckets = target_points - 2
+    # bucket edges of the points between the first and the last one
+    edges = np.linspace(1, n - 1, n_buckets + 1).astype(np.int64)
+    bucket_mean_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / np.diff(edges)
+    bucket_mean_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / np.diff(edges)
+
+    selected = np.empty(target_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(n_buckets):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 1 < n_buckets:
+            next_x, next_y = bucket_mean_x[bucket + 1], bucket_mean_y[bucket + 1]
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        # twice the area of the triangles (previous, candidate, next bucket mean), the factor does not change the argmax
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def downsample_series(series: pd.Series, target_points: Optional[int] = DEFAULT_TARGET_POINTS,
+                      method: str = "minmax") -> pd.Series:
+    """ Reduces a signal to about target_points points which preserve its visual shape
+    NaN values are dropped and the points are sorted by the index, whether the signal is downsampled or already has no
+    more valid points than target_points, so the result is a continuous line either way.
+    :param series: a signal indexed by time (or any other sortable numeric index)
+    :param target_points: max. number of points to keep, None to keep all points
+    :param method: "minmax" or "lttb", see the module docstring
+    :return: the downsampled signal
+    """
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError(f"method must be one of {DOWNSAMPLING_METHODS}, got {method=}")
+    if target_points is None:
+        return series
+    if target_points < 3:
+        raise ValueError(f"target_points must be at least 3, got {target_points=}")
+
+    valid = series.dropna()
+    if not valid.index.is_monotonic_increasing:
+        valid = valid.sort_index()
+    if len(valid) <= target_points:
+        return valid
+
+    x = _x_values(valid.index)
+    y = valid.to_numpy(dtype=np.float64)
+    positions = minmax_indices(x, y, target_points) if method == "minmax" else lttb_indices(x, y, target_points)
+    return valid.iloc[positions]
+
+
+def downsample_frame(data: pd.DataFrame, target_points: Optional[int] = DEFAULT_TARGET_POINTS,
+                     method: str = "minmax", cols: Optional[Iterable[str]] = None) -> Dict[str, pd.Series]:
+    """ Downsamples every signal of a wide DataFrame on its own, see downsample_series()
+    :param data: a DataFrame with one column per signal
+    :param target_points: max. number of points to keep per signal, None to keep all points
+    :param method: "minmax" or "lttb"
+    :param cols: optional list of columns to downsample, defaults to all columns
+    :return: a dictionary of column names with values of the downsampled signals
+    """
+    cols = data.columns if cols is None else cols
+    return {col: downsample_series(data.loc[:, col], target_points=target_points, method=method) for col in cols}
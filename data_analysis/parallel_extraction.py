@@ -0,0 +1,203 @@
+""" This script contains a parallel variant of join_defect_event_root_cause_filter_behaviour_id()
+
+A query over a long time window runs as one serial statement on one connection, while the database and the analysis
+machine have many idle cores. The window is therefore split into shards, which are queried concurrently from a thread
+pool, every shard on its own pooled connection, and merged again in (create_date, event_id) order:
+- "time": the window is cut into half-open sub-windows [start_i, start_i+1) of equal length, the last one includes end
+- "strand": the strand ids are distributed round-robin over the shards, every shard reads the whole window
+- "caster": one shard per caster id (requires casters), every shard reads the whole window
+
+The engine should allow at least as many connections as shards run concurrently (pool_size + max_overflow of
+make_engine()), otherwise the threads wait for connections of the pool.
+"""
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import bindparam, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.types import DateTime
+
+from data_analysis.defect_event_root_cause import BehaviourPattern, get_behaviour_id_join_statement
+from ddl_scripts.creating_tables import DefectEvent, DefectRootCause
+from phillip.crud.partitioning import partitioned_select
+from phillip.db_connection import pool_capacity
+from phillip.db_models.signal_codec import compact_signal_data_enabled
+from phillip.frame_dtypes import apply_model_dtypes
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+SHARD_KEYS = ("time", "strand", "caster")
+DEFAULT_SHARDS = 8
+
+
+@dataclass
+class ShardTiming:
+    """ Time window, filters, result size and wall time of one shard """
+    index: int
+    start: datetime
+    end: datetime
+    strand_ids: List[str]
+    casters: Optional[List[str]]
+    rows: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class ParallelExtractionReport:
+    """ Summary of a parallel extraction """
+    shard_by: str
+    shards: List[ShardTiming]
+    rows: int
+    seconds: float  # wall time of the whole extraction including the merge
+
+    @property
+    def shard_seconds(self) -> float:
+        """ Sum of the wall times of the shards, i.e. roughly the time of a serial extraction """
+        return sum(shard.seconds for shard in self.shards)
+
+    @property
+    def speedup(self) -> float:
+        return self.shard_seconds / self.seconds if self.seconds > 0 else 0.0
+
+
+@lru_cache(maxsize=None)
+def sharded_join_statement(compact_signal_data: bool = False, with_casters: bool = False, closed_end: bool = True):
+    """ Returns the statement of get_behaviour_id_join_statement() with a shard time window and an optional caster
+    filter
+    :param compact_signal_data: see get_behaviour_id_join_statement()
+    :param with_casters: if True, the events are also filtered by the bind parameter casters
+    :param closed_end: if True the window is start <= create_date <= end, otherwise start <= create_date < end
+    :return: a SQLAlchemy select statement ordered by create_date and event_id, built once per combination of flags
+    """
+    columns = get_behaviour_id_join_statement(compact_signal_data=compact_signal_data).selected_columns
+    statement = select(*columns)\
+        .join(DefectEvent, DefectRootCause.event_id == DefectEvent.event_id)\
+        .filter(DefectEvent.behaviour_pattern_id.in_(bindparam('defects', expanding=True)))\
+        .filter(DefectEvent.strand_id.in_(bindparam('strand_ids', expanding=True)))\
+        .filter(DefectEvent.create_date >= bindparam('start'))
+    if closed_end:
+        statement = statement.filter(DefectEvent.create_date <= bindparam('end'))
+    else:
+        statement = statement.filter(DefectEvent.create_date < bindparam('end'))
+    if with_casters:
+        statement = statement.filter(DefectEvent.caster_id.in_(bindparam('casters', expanding=True)))
+    return statement.order_by(DefectEvent.create_date, DefectEvent.event_id, DefectRootCause.signal_id)
+
+
+def plan_shards(start: datetime, end: datetime, strand_ids: List[str], shards: int = DEFAULT_SHARDS,
+                shard_by: str = "time", casters: Optional[List[str]] = None) -> List[ShardTiming]:
+    """ Splits a query window into shards
+    :param start: start of the time window of the event creation date
+    :param end: end of the time window of the event creation date (inclusive)
+    :param strand_ids: a list of strand ids to filter
+    :param shards: max. number of shards, fewer shards are planned if there are fewer strands or casters
+    :param shard_by: "time", "strand" or "caster"
+    :param casters: optional list of caster ids to filter, required for shard_by="caster"
+    :return: the shards without timings
+    """
+    if shard_by not in SHARD_KEYS:
+        raise ValueError(f"shard_by must be one of {SHARD_KEYS}, got {shard_by=}")
+    if shards < 1:
+        raise ValueError(f"shards must be a positive number, got {shards=}")
+    casters = list(casters) if casters is not None else None
+
+    if shard_by == "time":
+        step = (end - start) / shards
+        bounds = [start + step * index for index in range(shards)] + [end]
+        return [ShardTiming(index, bounds[index], bounds[index + 1], list(strand_ids), casters)
+                for index in range(shards) if index == shards - 1 or bounds[index] < bounds[index + 1]]
+    if shard_by == "strand":
+        groups = [list(strand_ids)[index::shards] for index in range(min(shards, len(strand_ids)))]
+        return [ShardTiming(index, start, end, group, casters) for index, group in enumerate(groups)]
+    if not casters:
+        raise ValueError("shard_by='caster' requires a list of casters")
+    return [ShardTiming(index, start, end, list(strand_ids), [caster]) for index, caster in enumerate(casters)]
+
+
+def _query_shard(engine: Engine, shard: ShardTiming, defects: List[BehaviourPattern], closed_end: bool,
+                 compact_signal_data: bool) -> pd.DataFrame:
+    statement = sharded_join_statement(compact_signal_data, shard.casters is not None, closed_end)
+    columns = statement.columns.keys()
+    statement = partitioned_select(engine, statement, shard.start, shard.end,
+                                   order_by=('create_date', 'event_id', 'signal_id'))
+    params = {'defects': list(defects), 'strand_ids': shard.strand_ids, 'start': shard.start, 'end': shard.end}
+    if shard.casters is not None:
+        params['casters'] = shard.casters
+    started = time.perf_counter()
+    with Session(engine) as session:
+        result = session.execute(statement, params).fetchall()
+    data = pd.DataFrame(data=result, columns=columns)
+    shard.rows, shard.seconds = len(data), time.perf_counter() - started
+    logger.debug("Shard {} ({} - {}, strands {}, casters {}) returned {} rows in {:.3f} s", shard.index, shard.start,
+                 shard.end, shard.strand_ids, shard.casters, shard.rows, shard.seconds)
+    return data
+
+
+def join_defect_event_root_cause_filter_behaviour_id_parallel(engine: Engine,
+                                                              defects: List[BehaviourPattern],
+                                                              strand_ids: List[str],
+                                                              start: DateTime(),
+                                                              end: DateTime(),
+                                                              shards: int = DEFAULT_SHARDS,
+                                                              shard_by: str = "time",
+                                                              casters: Optional[List[str]] = None,
+                                                              max_workers: Optional[int] = None,
+                                                              compact_signal_data: Optional[bool] = None
+                                                              ) -> Tuple[pd.DataFrame, ParallelExtractionReport]:
+    """ Queries the events with root causes of join_defect_event_root_cause_filter_behaviour_id() in parallel shards
+    :param engine: an engine with a connection pool, every shard checks out its own connection
+    :param defects: a list of behaviour patterns to filter
+    :param strand_ids: a list of strand ids to filter
+    :param start: start of the time window of the event creation date
+    :param end: end of the time window of the event creation date (inclusive)
+    :param shards: max. number of shards
+    :param shard_by: "time", "strand" or "caster", see the module docstring
+    :param casters: optional list of caster ids to filter, required for shard_by="caster"
+    :param max_workers: number of concurrently queried shards, defaults to the number of shards
+    :param compact_signal_data: see join_defect_event_root_cause_filter_behaviour_id()
+    :return: a DataFrame with the rows of all shards ordered by create_date, event_id and signal_id, and a report with
+    the timings per shard
+    """
+    start, end = pd.Timestamp(start).to_pydatetime(), pd.Timestamp(end).to_pydatetime()
+    compact_signal_data = compact_signal_data_enabled(compact_signal_data)
+    planned = plan_shards(start, end, strand_ids, shards=shards, shard_by=shard_by, casters=casters)
+    if not planned:
+        # No strands to shard by, the result is empty but keeps the columns and dtypes of a queried one
+        columns = sharded_join_statement(compact_signal_data, casters is not None).columns.keys()
+        logger.info("Extracted 0 rows, no {} shards to query", shard_by)
+        return apply_model_dtypes(pd.DataFrame(columns=columns)), \
+            ParallelExtractionReport(shard_by=shard_by, shards=[], rows=0, seconds=0.0)
+    max_workers = min(max_workers or len(planned), len(planned))
+    capacity = pool_capacity(engine)
+    if capacity is not None and capacity < max_workers:
+        logger.warning("{} shards run concurrently but the connection pool only allows {} connections",
+                       max_workers, capacity)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="extraction-shard") as executor:
+        # Time shards are half-open except the last one, so rows on a shard boundary are read exactly once
+        futures = [executor.submit(_query_shard, engine, shard, defects,
+                                   shard_by != "time" or shard is planned[-1], compact_signal_data)
+                   for shard in planned]
+        frames = [future.result() for future in futures]
+
+    data = pd.concat(frames, ignore_index=True)
+    if shard_by != "time" and len(frames) > 1:
+        # Every shard is sorted, the stable sort merges them into the order of a single query
+        data = data.sort_values(['create_date', 'event_id', 'signal_id'], kind='mergesort', ignore_index=True)
+    # Converted after the merge, categoricals of shards with different categories would concatenate to object dtype
+    data = apply_model_dtypes(data)
+    report = ParallelExtractionReport(shard_by=shard_by, shards=planned, rows=len(data),
+                                      seconds=time.perf_counter() - started)
+    logger.info("Extracted {} rows in {} {} shards in {:.2f} s (sum of shard times {:.2f} s, speedup {:.1f}x)",
+                report.rows, len(planned), shard_by, report.seconds, report.shard_seconds, report.speedup)
+    return data, report
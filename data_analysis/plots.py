@@ -1,18 +1,29 @@
 """ This Script contains methods for creating Matplotlib plots from the results of data analysis """
+from __future__ import annotations
+
+import hashlib
+import multiprocessing
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-import pandas as pd
-# Get default color style from pandas - can be changed to any other color list
-from pandas.plotting._matplotlib.style import get_standard_colors
-import matplotlib as mpl
-import matplotlib.pyplot as plt
 from loguru import logger
 
-from data_analysis.dataframes import df_from_group
-from data_analysis.defect_event_root_cause import join_defect_event_root_cause_filter_behaviour_id, BehaviourPattern
+from data_analysis.dataframes import decode_signal_data_batch, split_signal_df
+from data_analysis.downsampling import DEFAULT_TARGET_POINTS, downsample_frame
+from data_analysis.defect_event_root_cause import stream_defect_event_root_cause_filter_behaviour_id, \
+    iter_complete_slab_chunks, BehaviourPattern
 from db_engines.db_sources_data.sql_server_test_localhost import SQLServerTestDBs
 from db_engines.sql_server_engine import url_SQLServerTestDBMS
 from phillip.db_connection import create_session_from_url
+from phillip.lazy_imports import lazy_import
+
+# pandas and matplotlib are loaded on first use, matplotlib.pyplot is imported inside of the plotting functions
+pd = lazy_import("pandas")
+mpl = lazy_import("matplotlib")
 
 
 # TODO: Create a script of caster data (also for caster filtering in data analysis scripts!)
@@ -26,7 +37,8 @@ from phillip.db_connection import create_session_from_url
 #                        'mold_level_C_C1': {'min_value': 2.0, 'max_value': 10.0, 'color': 'k', 'unit': 'mold level [inches]'}}
 
 
-def plot_multi(data: pd.DataFrame, title: str, defect: str, dict_lim=None, cols=None, spacing=.1, **kwargs):
+def plot_multi(data: pd.DataFrame, title: str, defect: str, dict_lim=None, cols=None, spacing=.1,
+               target_points: Optional[int] = DEFAULT_TARGET_POINTS, downsampling: str = "minmax", ax=None, **kwargs):
     """ Creates Matplotlib figures based on config params and fills it with data
     :param data: a DataFrame of signals for analysis of a specified behaviour grouped by slab_id attribute
     :param title: a behaviour name to display in created plots
@@ -34,80 +46,206 @@ def plot_multi(data: pd.DataFrame, title: str, defect: str, dict_lim=None, cols=
     :param dict_lim: a dictionary of statistic and formatting params for signals of a caster
     :param cols: optional list of columns names for the DataFrame
     :param spacing: optional value for setting a distance between spines of the axes of plots
+    :param target_points: max. number of points plotted per axis, signals with more points are downsampled. None plots
+    all raw points
+    :param downsampling: the downsampling method, "minmax" or "lttb" (see downsampling.py)
+    :param ax: optional Matplotlib axes to plot into, defaults to the current axes of pyplot
     :param kwargs: Splat-Operator for any other dictionary with key-values pairs to be used for plotting
     :return: a Matplotlib Axe-Object with the created plot
     """
+    # Get default color style from pandas - can be changed to any other color list
+    from pandas.plotting._matplotlib.style import get_standard_colors
+
     label_size = 14
-    mpl.rcParams['xtick.labelsize'] = label_size
-    if cols is None: cols = data.columns
-    if len(cols) == 0: return  # TODO: Should this rather raise an Exception or fetch cols from a DataFrame?
-    colors = get_standard_colors(num_colors=len(cols))
-
-    # First axis
-    if dict_lim is not None:
-        ax = data.loc[:, cols[0]].plot(label=cols[0], color=dict_lim[cols[0]]['color'], **kwargs)
-        # ax.set_ylim(30, 65)
-        ax.set_ylabel(ylabel=dict_lim[cols[0]]['unit'], size=14)
-        ax.yaxis.label.set_color(dict_lim[cols[0]]['color'])
-        min_value = dict_lim[cols[0]]['min_value']
-        max_value = dict_lim[cols[0]]['max_value']
-        ax.set_ylim(min_value, max_value)
-    else:
-        ax = data.loc[:, cols[0]].plot(label=cols[0], color='blue', **kwargs)
-        min_value = 0
-        max_value = 1000  # TODO: Should this be calculated from averages of the DataFrame?
-        ax.set_ylim(min_value, max_value)
-    ax.set_xlabel(xlabel='time [s]', size=12)
-    ax.tick_params(axis='both', which='major', labelsize=12)
-    lines, labels = ax.get_legend_handles_labels()
-
-    for n in range(1, len(cols)):
-        # Multiple y-axes
-        ax_new = ax.twinx()
-        ax_new.spines['right'].set_position(('axes', 1 + spacing * (n - 1)))
+    # rc_context() limits the label size to the figures created here instead of changing the global rcParams
+    with mpl.rc_context({'xtick.labelsize': label_size}):
+        if cols is None: cols = data.columns
+        if len(cols) == 0: return  # TODO: Should this rather raise an Exception or fetch cols from a DataFrame?
+        colors = get_standard_colors(num_colors=len(cols))
+        signals = downsample_frame(data, target_points=target_points, method=downsampling, cols=cols)
+
+        # First axis
         if dict_lim is not None:
-            data.loc[:, cols[n]].plot(ax=ax_new, label=cols[n], color=dict_lim[cols[n]]['color'], **kwargs)
-            ax_new.set_ylabel(ylabel=dict_lim[cols[n]]['unit'], size=14)
-            ax_new.yaxis.label.set_color(dict_lim[cols[n]]['color'])
-            min_value = dict_lim[cols[n]]['min_value']
-            max_value = dict_lim[cols[n]]['max_value']
+            ax = signals[cols[0]].plot(ax=ax, label=cols[0], color=dict_lim[cols[0]]['color'], **kwargs)
+            # ax.set_ylim(30, 65)
+            ax.set_ylabel(ylabel=dict_lim[cols[0]]['unit'], size=14)
+            ax.yaxis.label.set_color(dict_lim[cols[0]]['color'])
+            min_value = dict_lim[cols[0]]['min_value']
+            max_value = dict_lim[cols[0]]['max_value']
+            ax.set_ylim(min_value, max_value)
         else:
-            data.loc[:, cols[n]].plot(ax=ax_new, label=cols[n], color='red', **kwargs)
-            ax_new.set_ylabel(ylabel='test1', size=14)
-            ax_new.yaxis.label.set_color('red')
+            ax = signals[cols[0]].plot(ax=ax, label=cols[0], color='blue', **kwargs)
             min_value = 0
             max_value = 1000  # TODO: Should this be calculated from averages of the DataFrame?
+            ax.set_ylim(min_value, max_value)
+        ax.set_xlabel(xlabel='time [s]', size=12)
+        ax.tick_params(axis='both', which='major', labelsize=12)
+        lines, labels = ax.get_legend_handles_labels()
+        # The axes pyplot would treat as current, i.e. the last created twin axes
+        last_ax = ax
+
+        for n in range(1, len(cols)):
+            # Multiple y-axes
+            ax_new = ax.twinx()
+            last_ax = ax_new
+            ax_new.spines['right'].set_position(('axes', 1 + spacing * (n - 1)))
+            if dict_lim is not None:
+                signals[cols[n]].plot(ax=ax_new, label=cols[n], color=dict_lim[cols[n]]['color'], **kwargs)
+                ax_new.set_ylabel(ylabel=dict_lim[cols[n]]['unit'], size=14)
+                ax_new.yaxis.label.set_color(dict_lim[cols[n]]['color'])
+                min_value = dict_lim[cols[n]]['min_value']
+                max_value = dict_lim[cols[n]]['max_value']
+            else:
+                signals[cols[n]].plot(ax=ax_new, label=cols[n], color='red', **kwargs)
+                ax_new.set_ylabel(ylabel='test1', size=14)
+                ax_new.yaxis.label.set_color('red')
+                min_value = 0
+                max_value = 1000  # TODO: Should this be calculated from averages of the DataFrame?
+
+            ax_new.set_ylim(min_value, max_value)
+            ax_new.tick_params(axis='both', which='major', labelsize=12)
+
+            # Proper legend position
+            line, label = ax_new.get_legend_handles_labels()
+            lines += line
+            labels += label
 
-        ax_new.set_ylim(min_value, max_value)
-        ax_new.tick_params(axis='both', which='major', labelsize=12)
+        ax.legend(lines, labels, loc='best', fontsize=12)
+        # The axes methods instead of plt.title() etc., so figures which are not managed by pyplot work as well
+        last_ax.set_title(label="Defect: {defect};  Slab: {slab}".format(defect=defect, slab=title),
+                          fontsize=12)
+        last_ax.tick_params(axis='x', which='major', labelsize=12)
+        last_ax.grid()
 
-        # Proper legend position
-        line, label = ax_new.get_legend_handles_labels()
-        lines += line
-        labels += label
+        return ax
 
-    ax.legend(lines, labels, loc='best', fontsize=12)
-    plt.title(label="Defect: {defect};  Slab: {slab}".format(defect=defect, slab=title),
-              fontsize=12)
-    plt.tick_params(axis='x', which='major', labelsize=12)
-    plt.grid()
 
-    return ax
+def new_slab_figure(data: pd.DataFrame, title: str, defect: str, dict_lim=None,
+                    target_points: Optional[int] = DEFAULT_TARGET_POINTS, downsampling: str = "minmax",
+                    headless: bool = False):
+    """ Creates a new Matplotlib figure with the plot of the signals of a single slab
+    Used by both the interactive plot_multi_from_dict() and the batch render_slab_figures(), so both produce the same
+    figures.
+    :param data: a DataFrame of signals of a slab
+    :param title: a slab name to display in the plot
+    :param defect: a detected defect name
+    :param dict_lim: a dictionary of statistic and formatting params for signals of a caster
+    :param target_points: max. number of points plotted per axis, see plot_multi()
+    :param downsampling: the downsampling method, "minmax" or "lttb"
+    :param headless: if True, the figure is rendered with the Agg canvas without pyplot, so neither the backend nor
+    the figures of pyplot in the calling process are touched. Such a figure can only be saved, not shown
+    :return: the created Matplotlib figure
+    """
+    if headless:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        figure = Figure(figsize=(10, 8))
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot()
+    else:
+        import matplotlib.pyplot as plt
+
+        figure = plt.figure(figsize=(10, 8))
+        ax = None
+    plot_multi(data=data, title=title, defect=defect, dict_lim=dict_lim, target_points=target_points,
+               downsampling=downsampling, ax=ax)
+    return figure
 
 
-def plot_multi_from_dict(data: dict, defect: str, dict_lim=None):
+def plot_multi_from_dict(data: dict, defect: str, dict_lim=None, target_points: Optional[int] = DEFAULT_TARGET_POINTS,
+                         downsampling: str = "minmax"):
     """ Groups each DataFrame from a dictionary of slab_ids and created plots for the analysed behaviour
     :param data: a dictionary of slab_id keys with values of DataFrames of signals of a specified behaviour
     :param defect: a detected defect name
     :param dict_lim: a dictionary of statistic and formatting params for signals of a caster
+    :param target_points: max. number of points plotted per axis, see plot_multi()
+    :param downsampling: the downsampling method, "minmax" or "lttb"
     :return: nothing is returned
     """
+    import matplotlib.pyplot as plt
+
     for key, value in data.items():
-        plt.figure(figsize=(10, 8))
-        plot_multi(data=value, title=key, defect=defect, dict_lim=dict_lim)
+        new_slab_figure(data=value, title=key, defect=defect, dict_lim=dict_lim, target_points=target_points,
+                        downsampling=downsampling)
         plt.show()
 
 
+def _init_headless_worker():
+    # Only called in the worker processes: pandas imports pyplot, which must not pick a GUI backend there
+    mpl.use("Agg")
+
+
+def slab_file_name(slab_id) -> str:
+    """ Returns a file system safe file name (without suffix) for the figure of a slab
+    Ids with other characters get a short hash of the original id appended, so f.e. "A/1" and "A_1" do not share a file
+    """
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", str(slab_id))
+    if name == str(slab_id):
+        return name
+    return f"{name}_{hashlib.sha1(str(slab_id).encode('utf-8')).hexdigest()[:8]}"
+
+
+def _render_slab_figure(slab_id, data: pd.DataFrame, defect: str, dict_lim, output_dir: Path,
+                        formats: Tuple[str, ...], savefig_kwargs: dict,
+                        target_points: Optional[int] = DEFAULT_TARGET_POINTS,
+                        downsampling: str = "minmax") -> Tuple[object, List[Path], float]:
+    started = time.perf_counter()
+    figure = new_slab_figure(data=data, title=slab_id, defect=defect, dict_lim=dict_lim, target_points=target_points,
+                             downsampling=downsampling, headless=True)
+    paths = []
+    for file_format in formats:
+        path = output_dir / f"{slab_file_name(slab_id)}.{file_format}"
+        figure.savefig(path, format=file_format, **savefig_kwargs)
+        paths.append(path)
+    return slab_id, paths, time.perf_counter() - started
+
+
+def render_slab_figures(data: dict, defect: str, output_dir, dict_lim=None, formats: Tuple[str, ...] = ("png",),
+                        max_workers: Optional[int] = None, target_points: Optional[int] = DEFAULT_TARGET_POINTS,
+                        downsampling: str = "minmax", **savefig_kwargs) -> Dict[object, dict]:
+    """ Renders the figures of plot_multi_from_dict() headless in parallel and writes them to files
+    Every slab is rendered in a worker process with the Agg backend, so the figures of many slabs are created on all CPU
+    cores instead of one after another. Workers are started with "spawn" to not inherit a GUI backend or open
+    connections from the calling process. With max_workers=1 the figures are rendered in the calling process on Agg
+    canvases without pyplot, its backend and open figures stay as they are.
+    :param data: a dictionary of slab_id keys with values of DataFrames of signals of a specified behaviour
+    :param defect: a detected defect name
+    :param output_dir: a directory for the figure files, created if missing. Files are named after the slab_ids
+    :param dict_lim: a dictionary of statistic and formatting params for signals of a caster
+    :param formats: file formats to write per slab, f.e. ("png", "svg")
+    :param max_workers: number of worker processes, defaults to the number of CPUs. 1 renders in the calling process
+    :param target_points: max. number of points plotted per axis, see plot_multi()
+    :param downsampling: the downsampling method, "minmax" or "lttb"
+    :param savefig_kwargs: further keyword arguments of Figure.savefig(), f.e. dpi
+    :return: a dictionary of slab_id keys with the written file paths and the render time in seconds per slab
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    results = {}
+
+    def collect(slab_id, paths, seconds):
+        results[slab_id] = {"paths": paths, "seconds": seconds}
+        logger.info("Rendered figure of slab {} in {:.3f} s", slab_id, seconds)
+
+    if max_workers == 1:
+        for slab_id, slab_data in data.items():
+            collect(*_render_slab_figure(slab_id, slab_data, defect, dict_lim, output_dir, formats, savefig_kwargs,
+                                         target_points, downsampling))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_headless_worker) as executor:
+            futures = [executor.submit(_render_slab_figure, slab_id, slab_data, defect, dict_lim, output_dir, formats,
+                                       savefig_kwargs, target_points, downsampling)
+                       for slab_id, slab_data in data.items()]
+            for future in as_completed(futures):
+                collect(*future.result())
+
+    logger.info("Rendered {} figures to {} in {:.2f} s", len(results), output_dir, time.perf_counter() - started)
+    return results
+
+
 # For direct script execution without calling its methods in main.py:
 if __name__ == "__main__":
     # More to dunder name variable __name__: https://www.pythontutorial.net/python-basics/python-__name__/
@@ -116,23 +254,22 @@ if __name__ == "__main__":
     URL = url_SQLServerTestDBMS + SQLServerTestDBs.MASTER_DB.value
     session = create_session_from_url(url=URL, odbc_driver=app_odbc_driver)
 
-    root_causes_strand_1_1_sliver = join_defect_event_root_cause_filter_behaviour_id(session=session,
-                                                                                     defects=[
-                                                                                         BehaviourPattern.CLOGGING],
-                                                                                     strand_ids=['1_1'],
-                                                                                     start=datetime.strptime(
-                                                                                         '2023-01-16 00:00:00',
-                                                                                         '%Y-%m-%d %H:%M:%S'),
-                                                                                     end=datetime.strptime(
-                                                                                         '2023-01-19 00:00:00',
-                                                                                         '%Y-%m-%d %H:%M:%S'))
-    groups = root_causes_strand_1_1_sliver.groupby(['slab_id'])
-    # https://pandas.pydata.org/pandas-docs/stable/user_guide/groupby.html
+    # The root causes are streamed in chunks and regrouped slab by slab to keep memory usage flat over long time windows
+    root_causes_strand_1_1_sliver = stream_defect_event_root_cause_filter_behaviour_id(session=session,
+                                                                                       defects=[
+                                                                                           BehaviourPattern.CLOGGING],
+                                                                                       strand_ids=['1_1'],
+                                                                                       start=datetime.strptime(
+                                                                                           '2023-01-16 00:00:00',
+                                                                                           '%Y-%m-%d %H:%M:%S'),
+                                                                                       end=datetime.strptime(
+                                                                                           '2023-01-19 00:00:00',
+                                                                                           '%Y-%m-%d %H:%M:%S'))
 
+    # The signal data of all slabs of a chunk is decoded in one pass and split by slab_id afterwards
     root_causes_strand_1_1_sliver_dict = {}
-    for name, group in groups:
-        group_df = df_from_group(group=group)
-        root_causes_strand_1_1_sliver_dict[name] = group_df
+    for slabs_chunk in iter_complete_slab_chunks(root_causes_strand_1_1_sliver):
+        root_causes_strand_1_1_sliver_dict.update(split_signal_df(decode_signal_data_batch(slabs_chunk)))
     logger.info(root_causes_strand_1_1_sliver_dict)
 
     plot_multi_from_dict(root_causes_strand_1_1_sliver_dict, "Slivers")
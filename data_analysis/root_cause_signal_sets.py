@@ -0,0 +1,334 @@
+""" This script contains an in-memory engine for mining sets of root cause signals that occur together in defect events
+
+Instead of aggregating signal ids to strings on the DB side for every analysis (see defect_root_cause_pairs.py), the
+(event_id, signal_id, importance) rows are loaded once into a sparse event x signal incidence matrix. Co-occurrence
+counts, support and lift of signal pairs and larger sets are then computed from it with NumPy, optionally per caster,
+strand and behaviour pattern.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from collections import Counter
+from itertools import combinations
+from typing import Iterable, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from loguru import logger
+
+from data_analysis.defect_root_cause_pairs import Casters
+from ddl_scripts.creating_tables import DefectEvent, DefectRootCause
+from phillip.crud.partitioning import partitioned_select
+from phillip.lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+EVENT_ATTRIBUTES = ['caster_id', 'strand_id', 'behaviour_pattern_id']
+
+# Max. number of cells of a dense block of the incidence matrix materialised at once while counting
+DENSE_BLOCK_CELLS = 2 ** 24
+
+
+def root_cause_incidence_query(start: datetime,
+                               casters: Optional[Iterable[Casters | str]] = None,
+                               signals_to_exclude: Iterable[str] = ()):
+    """ Creates the select statement of the root cause signals of events with a slab created since the start date
+    :param start: earliest event creation date
+    :param casters: optional caster ids to filter
+    :param signals_to_exclude: signal ids to leave out, f.e. casting lengths which are part of every event
+    :return: a SQLAlchemy select statement
+    """
+    query = select(DefectEvent.event_id,
+                   DefectEvent.caster_id,
+                   DefectEvent.strand_id,
+                   DefectEvent.behaviour_pattern_id,
+                   DefectRootCause.signal_id,
+                   DefectRootCause.importance
+                   )\
+        .join(DefectEvent, DefectRootCause.event_id == DefectEvent.event_id) \
+        .filter(DefectEvent.slab_id.isnot(None)) \
+        .filter(DefectEvent.create_date >= start)
+    if casters is not None:
+        query = query.filter(DefectEvent.caster_id.in_([getattr(caster, 'value', caster) for caster in casters]))
+    signals_to_exclude = list(signals_to_exclude)
+    if signals_to_exclude:
+        query = query.filter(DefectRootCause.signal_id.notin_(signals_to_exclude))
+    return query
+
+
+class SignalIncidence:
+    """ Sparse event x signal incidence matrix of root causes in CSR layout
+
+    Row i belongs to the event events.iloc[i], the signal codes of its root causes are
+    signal_codes[indptr[i]:indptr[i + 1]] and index into signal_ids.
+    """
+
+    def __init__(self, events: pd.DataFrame, signal_ids: np.ndarray, indptr: np.ndarray, signal_codes: np.ndarray,
+                 importance: np.ndarray):
+        self.events = events
+        self.signal_ids = signal_ids
+        self.indptr = indptr
+        self.signal_codes = signal_codes
+        self.importance = importance
+
+    @property
+    def n_events(self) -> int:
+        return len(self.events)
+
+    @property
+    def n_signals(self) -> int:
+        return len(self.signal_ids)
+
+    @property
+    def event_sizes(self) -> np.ndarray:
+        """ Number of root cause signals per event """
+        return np.diff(self.indptr)
+
+    @classmethod
+    def from_frame(cls, root_causes: pd.DataFrame) -> SignalIncidence:
+        """ Builds the matrix from a DataFrame with event_id, signal_id, importance and the EVENT_ATTRIBUTES columns
+        :param root_causes: one row per root cause, f.e. the result of root_cause_incidence_query()
+        :return: the incidence matrix
+        """
+        root_causes = root_causes.drop_duplicates(subset=['event_id', 'signal_id'])
+        event_codes, event_ids = pd.factorize(root_causes['event_id'], sort=True)
+        signal_codes, signal_ids = pd.factorize(root_causes['signal_id'], sort=True)
+
+        order = np.lexsort((signal_codes, event_codes))
+        event_codes = event_codes[order]
+        indptr = np.zeros(len(event_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(event_codes, minlength=len(event_ids)), out=indptr[1:])
+
+        first_rows = root_causes.iloc[order].drop_duplicates(subset='event_id')
+        events = first_rows.loc[:, ['event_id'] + EVENT_ATTRIBUTES].reset_index(drop=True)
+
+        return cls(events=events,
+                   signal_ids=np.asarray(signal_ids, dtype=object),
+                   indptr=indptr,
+                   signal_codes=signal_codes[order].astype(np.int64),
+                   importance=root_causes['importance'].to_numpy(dtype=np.float64, na_value=np.nan)[order])
+
+    @classmethod
+    def load(cls, session: Session, start: datetime, casters: Optional[Iterable[Casters | str]] = None,
+             signals_to_exclude: Iterable[str] = ()) -> SignalIncidence:
+        """ Loads the root causes with a single query, see root_cause_incidence_query() """
+        query = root_cause_incidence_query(start, casters=casters, signals_to_exclude=signals_to_exclude)
+        # Reads the archived partitions since the start date as well, see phillip/crud/partitioning.py
+        result = session.execute(partitioned_select(session.get_bind(), query, start, None)).fetchall()
+        incidence = cls.from_frame(pd.DataFrame(data=result, columns=query.columns.keys()))
+        logger.info("Loaded incidence matrix of {} events x {} signals with {} root causes",
+                    incidence.n_events, incidence.n_signals, len(incidence.signal_codes))
+        return incidence
+
+    def dense_rows(self, rows: np.ndarray) -> np.ndarray:
+        """ Materialises the given rows of the matrix as a dense boolean array of shape (len(rows), n_signals) """
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        # positions of all non-zero entries of the selected rows in signal_codes
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + offsets
+
+        dense = np.zeros((len(rows), self.n_signals), dtype=bool)
+        dense[np.repeat(np.arange(len(rows)), lengths), self.signal_codes[positions]] = True
+        return dense
+
+
+def _count_signals(incidence: SignalIncidence, rows: np.ndarray) -> np.ndarray:
+    lengths = incidence.event_sizes[rows]
+    if lengths.sum() == 0:
+        return np.zeros(incidence.n_signals, dtype=np.int64)
+    return incidence.dense_rows(rows).sum(axis=0, dtype=np.int64)
+
+
+def _count_pairs(incidence: SignalIncidence, rows: np.ndarray) -> np.ndarray:
+    """ Returns the symmetric signal x signal co-occurrence matrix of the given rows as X^T X, computed block-wise """
+    n_signals = incidence.n_signals
+    counts = np.zeros((n_signals, n_signals), dtype=np.int64)
+    block_rows = max(1, DENSE_BLOCK_CELLS // max(1, n_signals))
+    for block_start in range(0, len(rows), block_rows):
+        block = incidence.dense_rows(rows[block_start:block_start + block_rows]).astype(np.float32)
+        counts += np.rint(block.T @ block).astype(np.int64)
+    return counts
+
+
+def _count_sets(incidence: SignalIncidence, rows: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """ Counts the rows containing all signals of each candidate set (array of shape (n_candidates, k)) """
+    counts = np.zeros(len(candidates), dtype=np.int64)
+    if len(candidates) == 0:
+        return counts
+    block_rows = max(1, DENSE_BLOCK_CELLS // candidates.size)
+    for block_start in range(0, len(rows), block_rows):
+        block = incidence.dense_rows(rows[block_start:block_start + block_rows])
+        counts += block[:, candidates].all(axis=2).sum(axis=0)
+    return counts
+
+
+def _next_candidates(frequent_sets: np.ndarray) -> np.ndarray:
+    """ Apriori candidate generation: joins frequent sorted (k-1)-sets sharing their first k-2 signals and keeps the
+    k-sets whose (k-1)-subsets are all frequent """
+    if len(frequent_sets) == 0:
+        return np.empty((0, frequent_sets.shape[1] + 1), dtype=np.int64)
+    frequent = set(map(tuple, frequent_sets))
+    prefixes = {}
+    for signal_set in frequent_sets:
+        prefixes.setdefault(tuple(signal_set[:-1]), []).append(signal_set[-1])
+
+    candidates = []
+    for prefix, last_signals in prefixes.items():
+        for first, second in combinations(sorted(last_signals), 2):
+            candidate = prefix + (first, second)
+            if all(subset in frequent for subset in combinations(candidate, len(candidate) - 1)):
+                candidates.append(candidate)
+    return np.array(candidates, dtype=np.int64).reshape(-1, frequent_sets.shape[1] + 1)
+
+
+def _mine_rows(incidence: SignalIncidence, rows: np.ndarray, max_size: int, min_count: int,
+               exact_event_size: bool) -> pd.DataFrame:
+    n_events = len(rows)
+    signal_counts = _count_signals(incidence, rows)
+    signal_support = signal_counts / n_events
+
+    frames = []
+    frequent_sets = np.flatnonzero(signal_counts >= min_count).reshape(-1, 1)
+    for size in range(1, max_size + 1):
+        if size == 1:
+            candidates, counts = frequent_sets, signal_counts[frequent_sets[:, 0]]
+        else:
+            if size == 2:
+                pair_counts = _count_pairs(incidence, rows)
+                first, second = np.triu_indices(incidence.n_signals, k=1)
+                candidates = np.column_stack([first, second])
+                counts = pair_counts[first, second]
+            else:
+                candidates = _next_candidates(frequent_sets)
+                counts = _count_sets(incidence, rows, candidates)
+            is_frequent = counts >= min_count
+            candidates, counts = candidates[is_frequent], counts[is_frequent]
+            frequent_sets = candidates
+
+        size_events, size_signal_support = n_events, signal_support
+        if exact_event_size and len(candidates):
+            # only events with exactly `size` root cause signals contribute, like HAVING COUNT(event_id) = size. Support
+            # and lift refer to these events, too, otherwise the lift of larger sets is deflated by all smaller events
+            exact_rows = rows[incidence.event_sizes[rows] == size]
+            counts = _count_sets(incidence, exact_rows, candidates)
+            candidates, counts = candidates[counts >= min_count], counts[counts >= min_count]
+            size_events = len(exact_rows)
+            if size_events:
+                size_signal_support = _count_signals(incidence, exact_rows) / size_events
+
+        if len(candidates) == 0:
+            if size > 1 and not exact_event_size:
+                break
+            continue
+        support = counts / size_events
+        expected_support = np.prod(size_signal_support[candidates], axis=1)
+        signal_sets = [tuple(incidence.signal_ids[candidate]) for candidate in candidates]
+        frames.append(pd.DataFrame({
+            'size': size,
+            'signals': signal_sets,
+            'signal_pattern': [','.join(signal_set) for signal_set in signal_sets],
+            'count': counts,
+            'support': support,
+            'lift': support / expected_support,
+            'n_events': size_events,
+        }))
+
+    if not frames:
+        return pd.DataFrame(columns=['size', 'signals', 'signal_pattern', 'count', 'support', 'lift', 'n_events'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def brute_force_signal_sets(incidence: SignalIncidence, max_size: int = 2, min_count: int = 1,
+                            exact_event_size: bool = False) -> pd.DataFrame:
+    """ Counts the signal sets of mine_signal_sets() (without groups) by enumerating the subsets of every event
+    Slow, but simple enough to check the vectorised mining against on small data.
+    :return: a DataFrame with the columns and order of mine_signal_sets()
+    """
+    event_signals = [tuple(incidence.signal_codes[incidence.indptr[row]:incidence.indptr[row + 1]])
+                     for row in range(incidence.n_events)]
+    records = []
+    for size in range(1, max_size + 1):
+        events = [signals for signals in event_signals if not exact_event_size or len(signals) == size]
+        signal_counts = Counter(signal for signals in events for signal in signals)
+        set_counts = Counter(subset for signals in events for subset in combinations(sorted(signals), size))
+        for subset, count in set_counts.items():
+            if count < min_count:
+                continue
+            signal_set = tuple(incidence.signal_ids[list(subset)])
+            support = count / len(events)
+            expected_support = np.prod([signal_counts[signal] / len(events) for signal in subset])
+            records.append({'size': size, 'signals': signal_set, 'signal_pattern': ','.join(signal_set),
+                            'count': count, 'support': support, 'lift': support / expected_support,
+                            'n_events': len(events)})
+    result = pd.DataFrame(records, columns=['size', 'signals', 'signal_pattern', 'count', 'support', 'lift',
+                                            'n_events'])
+    return result.sort_values(['size', 'count', 'signal_pattern'], ascending=[True, False, True], ignore_index=True)
+
+
+def mine_signal_sets(incidence: SignalIncidence,
+                     max_size: int = 2,
+                     min_count: int = 1,
+                     group_by: Optional[Sequence[str]] = None,
+                     exact_event_size: bool = False) -> pd.DataFrame:
+    """ Computes co-occurrence counts, support and lift of root cause signal sets
+    support is the share of events of a group containing all signals of a set, lift is the support divided by the
+    product of the supports of the single signals (1.0 means the signals occur together by chance).
+    :param incidence: the incidence matrix of root causes
+    :param max_size: the largest signal set size to mine, 2 for pairs
+    :param min_count: minimal number of events a set has to occur in; also prunes the candidates of larger sets
+    :param group_by: optional event attributes to compute the sets per group, any of EVENT_ATTRIBUTES
+    :param exact_event_size: if True, a set of size k is only counted in events with exactly k root cause signals, which
+    reproduces extract_root_cause_pairs() for k = 2. Support, lift and n_events of size k then refer to these events
+    :return: a DataFrame with the group columns, size, signals, signal_pattern, count, support, lift and n_events,
+    sorted by group and descending count
+    """
+    if max_size < 1:
+        raise ValueError(f"max_size must be at least 1, got {max_size=}")
+    group_by = list(group_by or [])
+    unknown_attributes = set(group_by) - set(EVENT_ATTRIBUTES)
+    if unknown_attributes:
+        raise ValueError(f"Can not group by {sorted(unknown_attributes)}, allowed: {EVENT_ATTRIBUTES}")
+
+    if not group_by:
+        result = _mine_rows(incidence, np.arange(incidence.n_events), max_size, min_count, exact_event_size)
+        return result.sort_values(['size', 'count'], ascending=[True, False], ignore_index=True)
+
+    frames = []
+    for group_key, group in incidence.events.groupby(group_by, dropna=False, sort=True):
+        group_result = _mine_rows(incidence, group.index.to_numpy(), max_size, min_count, exact_event_size)
+        group_key = group_key if isinstance(group_key, tuple) else (group_key,)
+        for position, (attribute, value) in enumerate(zip(group_by, group_key)):
+            group_result.insert(position, attribute, value)
+        frames.append(group_result)
+    result = pd.concat(frames, ignore_index=True)
+    return result.sort_values(group_by + ['size', 'count'], ascending=[True] * (len(group_by) + 1) + [False],
+                              ignore_index=True)
+
+
+# For direct script execution without calling its methods in main.py:
+if __name__ == "__main__":
+    # More to dunder name variable __name__: https://www.pythontutorial.net/python-basics/python-__name__/
+    from db_engines.db_sources_data.sql_server_test_localhost import SQLServerTestDBs
+    from db_engines.sql_server_engine import url_SQLServerTestDBMS
+    from phillip.db_connection import create_session_from_url
+
+    app_odbc_driver = "ODBC Driver 17 for SQL Server"
+    URL = url_SQLServerTestDBMS + SQLServerTestDBs.MASTER_DB.value
+    session = create_session_from_url(url=URL, odbc_driver=app_odbc_driver)
+    root_cause_incidence = SignalIncidence.load(session=session,
+                                                start=datetime.strptime('2022-12-23', '%Y-%m-%d'),
+                                                casters=(Casters.CASTER_1, Casters.CASTER_2),
+                                                signals_to_exclude=("casting_length_1", "casting_length_C"))
+    signal_sets = mine_signal_sets(root_cause_incidence, max_size=3, min_count=2,
+                                   group_by=['caster_id', 'behaviour_pattern_id'])
+    logger.info(signal_sets.head(20))
+
+    # The vectorised counts of the pairs have to match the enumeration of the root cause pairs of every event
+    mined_pairs = mine_signal_sets(root_cause_incidence, max_size=2, exact_event_size=True)
+    reference_pairs = brute_force_signal_sets(root_cause_incidence, max_size=2, exact_event_size=True)
+    columns = ['size', 'signal_pattern', 'count', 'n_events']
+    if not mined_pairs[columns].sort_values(columns, ignore_index=True).astype(str)\
+            .equals(reference_pairs[columns].sort_values(columns, ignore_index=True).astype(str)):
+        logger.error("The mined signal sets differ from the brute force counts")
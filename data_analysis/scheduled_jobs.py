@@ -0,0 +1,321 @@
+""" This script contains scheduled jobs which precompute and persist the expensive analysis artifacts
+
+The jobs run periodically with APScheduler and write their results to an artifacts directory, so interactive requests
+only have to look the results up with the load_* functions:
+- root cause pairs of extract_root_cause_pairs() per caster: <artifacts>/root_cause_pairs/caster_<id>.pkl
+- signal frames of df_from_group() per defect and slab: <artifacts>/slab_frames/<defect>/<slab>.pkl
+- figures of plot_multi() per defect and slab, rendered from the persisted frames: <artifacts>/figures/<defect>/<slab>.png
+
+Slab frames are rewritten by every run while their events are within the time window. Frames which were not rewritten
+for slab_retention_days are deleted by the slab_frames job, figures whose frame was deleted by the slab_figures job.
+
+Every job runs at most once at a time: APScheduler does not start a run while the previous one is still running
+(max_instances=1) and merges missed runs into one (coalesce=True), and a lock file per job keeps other scheduler
+processes (f.e. on a second worker) from running the same job at the same time.
+
+Run the scheduler from the project root:
+    python -m data_analysis.scheduled_jobs
+or run a single job once:
+    python -m data_analysis.scheduled_jobs --run-now root_cause_pairs
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from data_analysis.dataframes import df_from_group
+from data_analysis.defect_event_root_cause import BehaviourPattern, iter_slab_groups, \
+    stream_defect_event_root_cause_filter_behaviour_id
+from data_analysis.defect_root_cause_pairs import Casters, extract_root_cause_pairs
+from data_analysis.plots import render_slab_figures, slab_file_name
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+DEFAULT_ARTIFACTS_DIR = Path("artifacts")
+
+
+@dataclass
+class PrecomputeConfig:
+    """ Configuration of the precompute jobs, cadences are crontab expressions (minute hour day month day_of_week) """
+    artifacts_dir: Path = DEFAULT_ARTIFACTS_DIR
+    casters: Tuple[Casters, ...] = tuple(Casters)
+    signals_to_exclude: Tuple[str, ...] = ("casting_length_1", "casting_length_C")
+    root_cause_pairs_days: int = 30  # time window of the root cause pairs, ending now
+    defects: Tuple[BehaviourPattern, ...] = tuple(BehaviourPattern)
+    strand_ids: Tuple[str, ...] = ("1_1", "1_2", "2c_1", "2c_2")
+    slab_frames_days: int = 1  # time window of the slab frames, ending now
+    figure_workers: Optional[int] = None  # worker processes of render_slab_figures(), defaults to the number of CPUs
+    figure_batch_slabs: int = 200  # number of slab frames held in memory per render_slab_figures() call
+    slab_retention_days: Optional[int] = 7  # days slab frames are kept after they left the window, None keeps them
+    cadences: Dict[str, str] = field(default_factory=lambda: {
+        "root_cause_pairs": "0 5 * * *",  # every morning before the analysts start
+        "slab_frames": "*/30 * * * *",
+        "slab_figures": "10,40 * * * *",  # after the slab frames
+    })
+    misfire_grace_seconds: int = 15 * 60  # a run missed by less than this (f.e. during a restart) is still started
+
+
+class SingleInstanceLock:
+    """ Non-blocking inter-process lock on a file, released when the process ends even if it crashes
+    Usage:
+        with SingleInstanceLock(path) as acquired:
+            if acquired:
+                ...
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._fd = None
+
+    def acquire(self) -> bool:
+        """ Returns True if the lock was acquired, False if another process holds it """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if os.name == "nt":
+            import msvcrt
+
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def _write_pickle(data, path: Path):
+    # Written to a temporary file first and renamed, so readers never see a half-written artifact
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(path.name + ".tmp")
+    pd.to_pickle(data, temporary_path)
+    os.replace(temporary_path, path)
+
+
+def _enum_value(member) -> str:
+    # Casters and BehaviourPattern members as well as their plain string values
+    return getattr(member, 'value', member)
+
+
+def root_cause_pairs_path(caster: Casters | str, config: PrecomputeConfig) -> Path:
+    return Path(config.artifacts_dir) / "root_cause_pairs" / f"caster_{_enum_value(caster)}.pkl"
+
+
+def slab_frame_path(slab_id: str, defect: BehaviourPattern | str, config: PrecomputeConfig) -> Path:
+    return Path(config.artifacts_dir) / "slab_frames" / _enum_value(defect) / f"{slab_file_name(slab_id)}.pkl"
+
+
+def slab_figure_path(slab_id: str, defect: BehaviourPattern | str, config: PrecomputeConfig) -> Path:
+    return Path(config.artifacts_dir) / "figures" / _enum_value(defect) / f"{slab_file_name(slab_id)}.png"
+
+
+def load_root_cause_pairs(caster: Casters | str, config: PrecomputeConfig = PrecomputeConfig()) -> \
+        Optional[pd.DataFrame]:
+    """ Returns the precomputed root cause pairs of a caster, None if they were not computed yet """
+    path = root_cause_pairs_path(caster, config)
+    return pd.read_pickle(path) if path.exists() else None
+
+
+def load_slab_frame(slab_id: str, defect: BehaviourPattern | str,
+                    config: PrecomputeConfig = PrecomputeConfig()) -> Optional[pd.DataFrame]:
+    """ Returns the precomputed df_from_group() signals of a slab, None if they were not computed yet """
+    path = slab_frame_path(slab_id, defect, config)
+    return pd.read_pickle(path) if path.exists() else None
+
+
+def precompute_root_cause_pairs(engine: Engine, config: PrecomputeConfig, now: Optional[datetime] = None) -> int:
+    """ Persists the result of extract_root_cause_pairs() per caster
+    :param engine: engine of the defect database
+    :param config: configuration of the jobs
+    :param now: end of the time window, defaults to now
+    :return: the number of persisted casters
+    """
+    date = ((now or datetime.now()) - timedelta(days=config.root_cause_pairs_days)).strftime("%Y-%m-%d")
+    for caster in config.casters:
+        with Session(engine) as session:
+            pairs = extract_root_cause_pairs(session=session, date=date, casters_to_filter=caster,
+                                             signals_to_filter=tuple(config.signals_to_exclude))
+        _write_pickle(pairs, root_cause_pairs_path(caster, config))
+        logger.info("Precomputed {} root cause pairs of caster {} since {}", len(pairs), _enum_value(caster), date)
+    return len(config.casters)
+
+
+def precompute_slab_frames(engine: Engine, config: PrecomputeConfig, now: Optional[datetime] = None) -> int:
+    """ Persists the df_from_group() signals of every slab with events of the configured defects and strands
+    :param engine: engine of the defect database
+    :param config: configuration of the jobs
+    :param now: end of the time window, defaults to now
+    :return: the number of persisted slab frames
+    """
+    end = now or datetime.now()
+    start = end - timedelta(days=config.slab_frames_days)
+    persisted = 0
+    for defect in config.defects:
+        with Session(engine) as session:
+            chunks = stream_defect_event_root_cause_filter_behaviour_id(session, [defect], list(config.strand_ids),
+                                                                        start, end)
+            for slab_id, group in iter_slab_groups(chunks):
+                _write_pickle(df_from_group(group), slab_frame_path(slab_id, defect, config))
+                persisted += 1
+    logger.info("Precomputed {} slab frames of events between {} and {}", persisted, start, end)
+    if config.slab_retention_days is not None:
+        prune_slab_frames(config, end - timedelta(days=config.slab_frames_days + config.slab_retention_days))
+    return persisted
+
+
+def prune_slab_frames(config: PrecomputeConfig, before: datetime) -> int:
+    """ Deletes the slab frames which were last written before a point in time, i.e. of slabs that left the window
+    :param config: configuration of the jobs
+    :param before: frames with an older modification time are deleted
+    :return: the number of deleted frames
+    """
+    deleted = 0
+    for defect in config.defects:
+        frames_dir = Path(config.artifacts_dir) / "slab_frames" / _enum_value(defect)
+        for path in frames_dir.glob("*.pkl") if frames_dir.exists() else ():
+            if datetime.fromtimestamp(path.stat().st_mtime) < before:
+                path.unlink(missing_ok=True)
+                deleted += 1
+    logger.info("Deleted {} slab frames last written before {}", deleted, before)
+    return deleted
+
+
+def prune_slab_figures(config: PrecomputeConfig) -> int:
+    """ Deletes the figures whose slab frame no longer exists, see prune_slab_frames()
+    :param config: configuration of the jobs
+    :return: the number of deleted figures
+    """
+    deleted = 0
+    for defect in config.defects:
+        frames_dir = Path(config.artifacts_dir) / "slab_frames" / _enum_value(defect)
+        figures_dir = Path(config.artifacts_dir) / "figures" / _enum_value(defect)
+        for path in figures_dir.glob("*.png") if figures_dir.exists() else ():
+            if not (frames_dir / f"{path.stem}.pkl").exists():
+                path.unlink(missing_ok=True)
+                deleted += 1
+    logger.info("Deleted {} slab figures without slab frame", deleted)
+    return deleted
+
+
+def precompute_slab_figures(engine: Engine, config: PrecomputeConfig, now: Optional[datetime] = None) -> int:
+    """ Renders the persisted slab frames which have no figure yet or a figure older than the frame, and deletes the
+    figures of deleted frames
+    :param engine: unused, the figures are rendered from the persisted slab frames
+    :param config: configuration of the jobs
+    :param now: unused
+    :return: the number of rendered figures
+    """
+    rendered = 0
+    for defect in config.defects:
+        frames_dir = Path(config.artifacts_dir) / "slab_frames" / _enum_value(defect)
+        if not frames_dir.exists():
+            continue
+        figures_dir = Path(config.artifacts_dir) / "figures" / _enum_value(defect)
+        outdated = [path for path in sorted(frames_dir.glob("*.pkl"))
+                    if not (figures_dir / f"{path.stem}.png").exists()
+                    or (figures_dir / f"{path.stem}.png").stat().st_mtime < path.stat().st_mtime]
+        for batch_start in range(0, len(outdated), config.figure_batch_slabs):
+            batch = {path.stem: pd.read_pickle(path)
+                     for path in outdated[batch_start:batch_start + config.figure_batch_slabs]}
+            rendered += len(render_slab_figures(batch, defect=_enum_value(defect), output_dir=figures_dir,
+                                                max_workers=config.figure_workers))
+    logger.info("Rendered {} slab figures", rendered)
+    prune_slab_figures(config)
+    return rendered
+
+
+JOBS: Dict[str, Callable[[Engine, PrecomputeConfig], int]] = {
+    "root_cause_pairs": precompute_root_cause_pairs,
+    "slab_frames": precompute_slab_frames,
+    "slab_figures": precompute_slab_figures,
+}
+
+
+def run_job(name: str, engine: Engine, config: PrecomputeConfig) -> Optional[int]:
+    """ Runs a job unless another process is running it right now
+    :return: the result of the job, None if it was skipped
+    """
+    with SingleInstanceLock(Path(config.artifacts_dir) / "locks" / f"{name}.lock") as acquired:
+        if not acquired:
+            logger.warning("Skipping job {}, another process is running it", name)
+            return None
+        started = time.perf_counter()
+        result = JOBS[name](engine, config)
+        logger.info("Job {} finished in {:.1f} s", name, time.perf_counter() - started)
+        return result
+
+
+def create_scheduler(engine: Engine, config: PrecomputeConfig = PrecomputeConfig(), blocking: bool = False):
+    """ Creates an APScheduler scheduler with one job per configured cadence
+    :param engine: engine of the defect database
+    :param config: configuration of the jobs, jobs without a cadence are not scheduled
+    :param blocking: if True a BlockingScheduler (start() runs the jobs in the calling thread until shutdown),
+    otherwise a BackgroundScheduler, which runs them in a background thread of an application
+    :return: the scheduler, call start() to run it
+    """
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    from apscheduler.triggers.cron import CronTrigger
+
+    scheduler = BlockingScheduler() if blocking else BackgroundScheduler()
+    for name, cadence in config.cadences.items():
+        if name not in JOBS:
+            raise ValueError(f"Unknown job {name!r}, known jobs: {list(JOBS)}")
+        scheduler.add_job(run_job, trigger=CronTrigger.from_crontab(cadence), args=(name, engine, config), id=name,
+                          name=name, max_instances=1, coalesce=True,
+                          misfire_grace_time=config.misfire_grace_seconds, replace_existing=True)
+        logger.info("Scheduled job {} at '{}'", name, cadence)
+    return scheduler
+
+
+# For direct script execution without calling its methods in main.py:
+if __name__ == "__main__":
+    from db_engines.sql_server_engine import get_sqlservertest_engine
+
+    parser = argparse.ArgumentParser(description="Runs the precompute jobs on their schedule")
+    parser.add_argument("--artifacts-dir", type=Path, default=DEFAULT_ARTIFACTS_DIR)
+    parser.add_argument("--run-now", choices=list(JOBS), nargs="*", help="run these jobs once and exit")
+    args = parser.parse_args()
+
+    precompute_config = PrecomputeConfig(artifacts_dir=args.artifacts_dir)
+    sqlserver_engine = get_sqlservertest_engine()
+    if args.run_now:
+        for job_name in args.run_now:
+            run_job(job_name, sqlserver_engine, precompute_config)
+        sys.exit(0)
+    create_scheduler(sqlserver_engine, precompute_config, blocking=True).start()
@@ -0,0 +1,224 @@
+""" This script contains a two-tier read-through cache for the signal_data payloads of defect root causes """
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+# A payload never changes for a given root cause and update date, so these three values identify it. Root causes without
+# an update date are not cached, a changed payload could not be told apart from the cached one
+SignalDataKey = Tuple[int, str, Optional[datetime]]
+
+
+class SignalDataCache:
+    """ LRU cache of serialized signal_data payloads with an in-memory tier and an optional on-disk tier
+
+    Lookups check the memory tier first and fall back to the disk tier; disk hits are promoted to memory. Both tiers
+    evict their least recently used payloads once their size limit in bytes is exceeded. Hit and miss counters are
+    available with stats() to size the tiers. The lock only guards the indexes of the tiers, payload files are read and
+    written outside of it, so threads do not wait for each other's disk I/O.
+    """
+
+    def __init__(self,
+                 cache_dir: Optional[str | os.PathLike] = None,
+                 max_memory_bytes: int = 256 * 1024 ** 2,
+                 max_disk_bytes: int = 2 * 1024 ** 3):
+        """
+        :param cache_dir: a directory for the disk tier, no disk tier is used if it is None
+        :param max_memory_bytes: size limit of the payloads held in memory
+        :param max_disk_bytes: size limit of the payload files in cache_dir
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+
+        self._memory: OrderedDict[Hashable, Tuple[str, int]] = OrderedDict()  # key -> (payload, utf-8 size)
+        self._memory_bytes = 0
+
+        self._cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._disk: OrderedDict[str, int] = OrderedDict()  # file name -> file size, oldest first
+        self._disk_bytes = 0
+        if self._cache_dir is not None:
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(event_id: int, signal_id: str, update_date: Optional[datetime]) -> SignalDataKey:
+        """ Creates a cache key of a root cause """
+        return int(event_id), str(signal_id), update_date
+
+    @staticmethod
+    def is_cacheable(key: SignalDataKey) -> bool:
+        """ Returns False for keys of root causes without update date, these are always fetched from the DB """
+        return key[2] is not None
+
+    def get(self, key: SignalDataKey) -> Optional[str]:
+        """ Returns the serialized payload of a key or None if it is in neither of the tiers """
+        with self._lock:
+            entry = self._memory.get(key) if self.is_cacheable(key) else None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[0]
+            name = self._file_name(key) if self._cache_dir is not None and self.is_cacheable(key) else None
+            if name not in self._disk:
+                self.misses += 1
+                return None
+
+        payload = self._read_disk(name)
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            if name in self._disk:
+                self._disk.move_to_end(name)
+            self._put_memory(key, payload)
+        return payload
+
+    def get_many(self, keys: Iterable[SignalDataKey]) -> Tuple[Dict[SignalDataKey, str], List[SignalDataKey]]:
+        """ Looks up several keys at once
+        :return: a dictionary of the found payloads and a list of the keys that have to be fetched from the DB
+        """
+        found, missing = {}, []
+        for key in dict.fromkeys(keys):
+            payload = self.get(key)
+            if payload is None:
+                missing.append(key)
+            else:
+                found[key] = payload
+        return found, missing
+
+    def put(self, key: SignalDataKey, payload) -> str:
+        """ Adds a payload to both tiers
+        :param key: a key created with make_key()
+        :param payload: the signal_data either as JSON string or as deserialized JSON object
+        :return: the serialized payload as it is stored in the cache
+        """
+        if not isinstance(payload, str):
+            payload = json.dumps(payload)
+        if not self.is_cacheable(key):
+            return payload
+        with self._lock:
+            self._put_memory(key, payload)
+        self._write_disk(key, payload)
+        return payload
+
+    def clear(self):
+        """ Removes all payloads from both tiers, the counters are kept """
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            evicted = list(self._disk)
+            self._disk.clear()
+            self._disk_bytes = 0
+        self._remove_files(evicted)
+
+    def stats(self) -> dict:
+        """ Returns the hit and miss counters and the current sizes of the tiers """
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    # Memory tier
+
+    def _put_memory(self, key: SignalDataKey, payload: str):
+        # The limit is in bytes, a str length counts characters (payloads may contain non-ASCII signal ids)
+        size = len(payload.encode("utf-8"))
+        if size > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= previous[1]
+        self._memory[key] = (payload, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, (_, evicted_size) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    # Disk tier
+
+    @staticmethod
+    def _file_name(key: SignalDataKey) -> str:
+        event_id, signal_id, update_date = key
+        digest = hashlib.sha1(f"{event_id}|{signal_id}|{update_date.isoformat()}".encode("utf-8")).hexdigest()
+        return f"{digest}.json"
+
+    def _load_disk_index(self):
+        files = sorted((entry.stat().st_mtime, entry.name, entry.stat().st_size)
+                       for entry in os.scandir(self._cache_dir) if entry.name.endswith(".json"))
+        for _, name, size in files:
+            self._disk[name] = size
+            self._disk_bytes += size
+        self._remove_files(self._evict_disk_entries())
+        logger.debug("Loaded {} cached signal_data payloads ({} bytes) from {}",
+                     len(self._disk), self._disk_bytes, self._cache_dir)
+
+    def _read_disk(self, name: str) -> Optional[str]:
+        # Called without the lock, the file may have been evicted in the meantime
+        path = self._cache_dir / name
+        try:
+            payload = path.read_text(encoding="utf-8")
+            os.utime(path)  # the modification time keeps the LRU order across restarts
+        except OSError:
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(name, 0)
+            return None
+        return payload
+
+    def _write_disk(self, key: SignalDataKey, payload: str):
+        if self._cache_dir is None:
+            return
+        data = payload.encode("utf-8")
+        if len(data) > self.max_disk_bytes:
+            return
+        name = self._file_name(key)
+        # Written to a temporary file first, so a crash or a concurrent reader never sees a truncated payload
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, self._cache_dir / name)
+
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(name, 0)
+            self._disk[name] = len(data)
+            self._disk_bytes += len(data)
+            evicted = self._evict_disk_entries()
+        self._remove_files(evicted)
+
+    def _evict_disk_entries(self) -> List[str]:
+        # Called with the lock held, the files are removed afterwards with _remove_files()
+        evicted = []
+        while self._disk_bytes > self.max_disk_bytes:
+            name, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(name)
+        return evicted
+
+    def _remove_files(self, names: Iterable[str]):
+        for name in names:
+            try:
+                (self._cache_dir / name).unlink()
+            except FileNotFoundError:
+                pass
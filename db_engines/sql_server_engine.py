@@ -1,7 +1,11 @@
+import threading
+from typing import Dict, Tuple
+
 from loguru import logger
+from sqlalchemy.engine import Engine
 
 from db_engines.db_sources_data.sql_server_test_localhost import dbdriver, dbpath, username, password, SQLServerTestDBs
-from phillip.db_connection import make_engine, build_full_url
+from phillip.db_connection import get_engine, build_full_url
 
 # For establishing connections see https://docs.sqlalchemy.org/en/14/tutorial/engine.html#tutorial-engine
 # For configuring the engine see https://docs.sqlalchemy.org/en/14/core/engines.html#microsoft-sql-server
@@ -10,10 +14,39 @@ from phillip.db_connection import make_engine, build_full_url
 # See https://docs.sqlalchemy.org/en/14/dialects/mssql.html#dialect-mssql-pyodbc-connect
 url_SQLServerTestDBMS = f"{dbdriver}://{username}:{password}@{dbpath}/"
 
-url_hostname = build_full_url(
-    url=url_SQLServerTestDBMS + SQLServerTestDBs.MASTER_DB.value,
-    odbc_driver="ODBC Driver 17 for SQL Server"
-)
+odbc_driver_SQLServerTestDBMS = "ODBC Driver 17 for SQL Server"
+
+# Engines are created on first use only: building the URL probes the installed ODBC drivers, which would otherwise slow
+# down every import of this module
+_engines_SQLServerTestDBMS: Dict[Tuple[SQLServerTestDBs, bool], Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_sqlservertest_engine(database: SQLServerTestDBs = SQLServerTestDBs.MASTER_DB, verbose: bool = False) -> Engine:
+    """Returns the engine of a database of sql_server_test@localhost, creating it on first use
+
+    Args:
+        database: the database to connect to
+        verbose: if set to True, the engine logs all statements and pool events, see make_engine()
+    """
+    with _engines_lock:
+        engine = _engines_SQLServerTestDBMS.get((database, verbose))
+        if engine is None:
+            url_hostname = build_full_url(
+                url=url_SQLServerTestDBMS + database.value,
+                odbc_driver=odbc_driver_SQLServerTestDBMS
+            )
+            engine = get_engine(url_hostname, timeout=100, verbose=verbose)
+            _engines_SQLServerTestDBMS[(database, verbose)] = engine
+            logger.debug("Initialised engine of database {}", database.value)
+        return engine
 
-engine_sqlservertest_main = make_engine(url_hostname, timeout=100, verbose=True)
 
+def __getattr__(name: str):
+    # Module level __getattr__ (PEP 562) keeps "from db_engines.sql_server_engine import engine_sqlservertest_main"
+    # working while creating the engine only when it is imported this way
+    if name == "engine_sqlservertest_main":
+        return get_sqlservertest_engine(SQLServerTestDBs.MASTER_DB)
+    if name == "url_hostname":
+        return get_sqlservertest_engine(SQLServerTestDBs.MASTER_DB).url
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
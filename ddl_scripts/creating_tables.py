@@ -1,5 +1,7 @@
-from sqlalchemy import Table, MetaData, Column, ForeignKey, Integer, String, DateTime, Float, JSON
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import Table, MetaData, Column, ForeignKey, Index, Integer, String, DateTime, Float, JSON
+from sqlalchemy.orm import declarative_base, deferred, relationship
+
+from phillip.db_models.signal_codec import CompactSignalData
 
 """
 While the SQL looks the same whether we invoke select(signal_meta) or select(SignalMeta(Base)) (See select1_stmts in 
@@ -56,6 +58,12 @@ defect_event = Table(
     Column("event_type", String(10), nullable=False),
     Column("model_type", String(10), nullable=False),
     Column("strand_id", String(256), nullable=False),
+    # Composite indexes of the hot queries, see phillip/db_models/defect_event.py
+    Index("ix_defect_event_behaviour_strand_create_date", "behaviour_pattern_id", "strand_id", "create_date", "event_id",
+          mssql_include=["event_type", "caster_id", "slab_id", "grade_id", "detection_probability"]),
+    Index("ix_defect_event_caster_create_date", "caster_id", "create_date", "event_id",
+          mssql_include=["behaviour_pattern_id", "strand_id", "slab_id"]),
+    Index("ix_defect_event_create_date_event_id", "create_date", "event_id"),
     schema="main"
 )
 
@@ -70,6 +78,7 @@ defect_root_cause = Table(
     Column("importance", Float, nullable=True),
     Column("data_start_time", DateTime, nullable=True),
     Column("data_end_time", DateTime, nullable=True),
+    Index("ix_defect_root_cause_create_date_event_id", "create_date", "event_id", "signal_id"),
     schema="main"
 )
 
@@ -118,7 +127,15 @@ class SignalMeta(Base):  # ORM class
 
 class DefectEvent(Base):
     __tablename__ = "defect_event"
-    __table_args__ = {"schema": "main"}
+    __table_args__ = (
+        # Composite indexes of the hot queries, see phillip/db_models/defect_event.py
+        Index("ix_defect_event_behaviour_strand_create_date", "behaviour_pattern_id", "strand_id", "create_date",
+              "event_id", mssql_include=["event_type", "caster_id", "slab_id", "grade_id", "detection_probability"]),
+        Index("ix_defect_event_caster_create_date", "caster_id", "create_date", "event_id",
+              mssql_include=["behaviour_pattern_id", "strand_id", "slab_id"]),
+        Index("ix_defect_event_create_date_event_id", "create_date", "event_id"),
+        {"schema": "main"}
+    )
 
     create_date = Column(DateTime, nullable=False)
     update_date = Column(DateTime, nullable=False)
@@ -148,7 +165,10 @@ class DefectEvent(Base):
 
 class DefectRootCause(Base):
     __tablename__ = "defect_root_cause"
-    __table_args__ = {"schema": "main"}
+    __table_args__ = (
+        Index("ix_defect_root_cause_create_date_event_id", "create_date", "event_id", "signal_id"),
+        {"schema": "main"}
+    )
 
     create_date = Column(DateTime, nullable=False)
     update_date = Column(DateTime, nullable=False)
@@ -159,6 +179,8 @@ class DefectRootCause(Base):
     data_start_time = Column(DateTime, nullable=True)
     data_end_time = Column(DateTime, nullable=True)
     signal_data = Column(JSON)
+    # see phillip/db_models/signal_codec.py, deferred so entities also load from tables without the column
+    signal_data_compact = deferred(Column(CompactSignalData(), nullable=True))
 
     # def __repr__(self):
     #     # method is not required but is useful for debugging
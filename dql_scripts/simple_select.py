@@ -7,7 +7,7 @@ from db_engines.db_sources_data.sql_server_test_localhost import SQLServerTestDB
 from db_engines.sql_server_engine import url_SQLServerTestDBMS
 from ddl_scripts.creating_tables import signal_meta, SignalMeta
 from phillip.db_connection import create_session_from_url
-from db_engines.sql_server_engine import engine_sqlservertest_main as sqlserver_engine
+from db_engines.sql_server_engine import get_sqlservertest_engine
 
 select1_core_stmt = select(signal_meta)  # uses Core API Table instance with MetaData. See creating_tables.py
 select1_orm_stmt = select(SignalMeta)  # uses class mapped from the ORM API's Base Class. See creating_tables.py
@@ -125,6 +125,7 @@ if __name__ == "__main__":
     app_odbc_driver = "ODBC Driver 17 for SQL Server"
     URL = url_SQLServerTestDBMS + SQLServerTestDBs.MASTER_DB.value
     session = create_session_from_url(url=URL, odbc_driver=app_odbc_driver)
+    sqlserver_engine = get_sqlservertest_engine(SQLServerTestDBs.MASTER_DB)
 
     select_core_signalmeta_all(sqlserver_engine)  # Selection from the table using Core API
     select_orm_signalmeta_all(session)  # Selection from the table using ORM API
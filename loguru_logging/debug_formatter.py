@@ -1,17 +1,59 @@
+import threading
+from collections import defaultdict
+
 from loguru import logger
 
+# Size based rotation keeps a few large files instead of rotating on every other message of a busy worker
+DEBUG_LOG_ROTATION = "50 MB"
+DEBUG_LOG_RETENTION = 10  # number of rotated files to keep
+DEBUG_LOG_BUFFER_BYTES = 64 * 1024  # records are written to the file in batches of this size
+
+
+class SampledDebugFilter:
+    """Filter of a sink, which passes only every n-th DEBUG record of each logging call site
+
+    The first record of every call site (module + line) always passes, so rare messages are never lost while a debug
+    message in a loop over a million rows is only written every n-th time.
+    """
 
-def debug_format():
+    def __init__(self, sample_every: int = 1):
+        if sample_every < 1:
+            raise ValueError(f"sample_every must be a positive number, got {sample_every=}")
+        self.sample_every = sample_every
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def __call__(self, record) -> bool:
+        if record["level"].name != "DEBUG":  # Found @ https://github.com/Delgan/loguru/issues/46
+            return False
+        if self.sample_every == 1:
+            return True
+        call_site = (record["name"], record["line"])
+        with self._lock:
+            count = self._counts[call_site]
+            self._counts[call_site] = count + 1
+        return count % self.sample_every == 0
+
+
+def debug_format(sample_every: int = 1,
+                 rotation=DEBUG_LOG_ROTATION,
+                 retention=DEBUG_LOG_RETENTION,
+                 buffering: int = DEBUG_LOG_BUFFER_BYTES) -> int:
     # Custom debug level formatter, saves debug mssgs to a log file
-    logger.add(
+    # enqueue=True hands records to a background thread over a queue, so the logging call returns without waiting for
+    # the file (and the sink is safe to use from several threads and processes). Call logger.complete() before exit to
+    # wait for the queue to be written.
+    return logger.add(
         # See: https://loguru.readthedocs.io/en/stable/api/logger.html#file
         "_logs/debug_{time:YY-MM-DD-HH-mm-ss}.log",  # A sink in form of a path to a file: https://loguru.readthedocs.io/en/stable/api/logger.html#sink
         level="DEBUG",  # for severity levels rankings see the link above (trace -> debug -> info -> etc)
-        filter=lambda record: record["level"].name == "DEBUG",  # Found @ https://github.com/Delgan/loguru/issues/46
+        filter=SampledDebugFilter(sample_every),
         format="Custom log: {level} | {time:HH:mm:ss!UTC} | {module}.{function} | {message}",
-        rotation="1 KB",
-        retention="10 seconds",
-        colorize=True
+        rotation=rotation,
+        retention=retention,
+        enqueue=True,
+        buffering=buffering,  # passed on to open(), the file is written once the buffer is full instead of per record
+        colorize=False  # no ANSI escape codes in files
     )
 
 
@@ -19,4 +61,3 @@ def debug_format():
 if __name__ == '__main__':
     # More to dunder name variable __name__: https://www.pythontutorial.net/python-basics/python-__name__/
     debug_format()
-
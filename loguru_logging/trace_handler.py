@@ -11,5 +11,6 @@ def trace_format():
         # for loguru severity levels rankings see the link above (trace -> debug -> info -> etc),
         # for Python's logging severity levels see https://docs.python.org/3/howto/logging.html#when-to-use-logging
         format="{level} | {time:HH:mm:ss!UTC} | {module}.{function} | {message}",
+        enqueue=True,  # the handler is called by a background thread, logging calls do not wait for the stream
         colorize=True
     )
@@ -1,9 +1,17 @@
 from phillip.db_connection import get_session
-from db_engines.sql_server_engine import engine_sqlservertest_main as sqlserver_engine
+from db_engines.sql_server_engine import get_sqlservertest_engine
 
 from loguru import logger
 from loguru_logging.debug_formatter import debug_format
 
 debug_format()  # adds a custom format for debug-level of loguru (saving local .log-files)
-global_session = get_session(sqlserver_engine)
 
+
+def __getattr__(name: str):
+    # The global session is created on first access ("from main import global_session") instead of at import time, so
+    # importing main does not build an engine (see db_engines/sql_server_engine.py)
+    if name == "global_session":
+        session = get_session(get_sqlservertest_engine())
+        globals()["global_session"] = session
+        return session
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
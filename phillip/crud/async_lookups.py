@@ -0,0 +1,42 @@
+"""
+Provides helpers for running many small asyncio queries concurrently.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Iterable, List, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+T = TypeVar("T")
+
+DEFAULT_MAX_CONCURRENCY = 10
+
+
+async def gather_lookups(
+    session_factory: sessionmaker,
+    lookup: Callable[..., Awaitable[T]],
+    arguments: Iterable[Any],
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+) -> List[T]:
+    """Runs a lookup coroutine for every argument concurrently and returns the results in the order of the arguments.
+
+    Every lookup gets its own AsyncSession, because a session must not be used by concurrent tasks. The number of
+    lookups in flight is limited by max_concurrency, which should not exceed the pool size plus overflow of the engine.
+
+    Args:
+        session_factory: AsyncSession factory, e.g. from get_async_session_factory()
+        lookup: coroutine function called as lookup(session, argument)
+        arguments: one argument per lookup
+        max_concurrency: maximum number of lookups running at the same time
+    """
+    if max_concurrency < 1:
+        raise ValueError(f"max_concurrency must be a positive number, got {max_concurrency=}")
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_lookup(argument) -> T:
+        async with semaphore:
+            session: AsyncSession
+            async with session_factory() as session:
+                return await lookup(session, argument)
+
+    return await asyncio.gather(*(run_lookup(argument) for argument in arguments))
@@ -0,0 +1,138 @@
+"""
+Provides a high-throughput bulk insert path for defect events and their root causes.
+"""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterable, Iterator, List, Union
+
+from loguru import logger
+from sqlalchemy import insert
+from sqlalchemy.engine import Engine
+
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+DEFAULT_BATCH_SIZE = 5_000
+
+RowsSource = Union["pd.DataFrame", Iterable[dict]]
+
+
+@dataclass
+class BulkInsertReport:
+    """Summary of a bulk insert run"""
+
+    table: str
+    rows: int
+    batches: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float("inf")
+
+
+def iter_row_batches(rows: RowsSource, columns: List[str], batch_size: int) -> Iterator[List[dict]]:
+    """Cuts dicts or DataFrame rows into lists of parameter dicts for executemany.
+
+    DataFrame values are converted to Python objects and missing values (NaN/NaT) to None, so the DBAPI receives NULLs.
+    Dicts are passed on as they are and may have different keys, see split_by_keys().
+
+    Args:
+        rows: DataFrame or iterable of dicts keyed by column names
+        columns: names of the columns of the target table
+        batch_size: number of rows per batch
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be a positive number, got {batch_size=}")
+
+    if isinstance(rows, pd.DataFrame):
+        unknown_columns = set(rows.columns) - set(columns)
+        if unknown_columns:
+            raise ValueError(f"DataFrame contains columns which are not part of the table: {sorted(unknown_columns)}")
+        for start in range(0, len(rows), batch_size):
+            batch_df = rows.iloc[start:start + batch_size]
+            yield batch_df.astype(object).where(batch_df.notna(), None).to_dict("records")
+    else:
+        rows_iterator = iter(rows)
+        while True:
+            batch = list(islice(rows_iterator, batch_size))
+            if not batch:
+                return
+            unknown_columns = set().union(*batch) - set(columns)
+            if unknown_columns:
+                raise ValueError(f"Rows contain keys which are not columns of the table: {sorted(unknown_columns)}")
+            yield batch
+
+
+def split_by_keys(batch: List[dict]) -> List[List[dict]]:
+    """Splits a batch into runs of consecutive rows with the same keys.
+
+    executemany compiles the INSERT from the keys of the first row and silently drops keys which only later rows have.
+    Every run is executed on its own, so each row gets its own values and the column defaults for its missing keys.
+    """
+    runs: List[List[dict]] = []
+    run_keys = None
+    for row in batch:
+        keys = row.keys()
+        if keys != run_keys:
+            runs.append([])
+            run_keys = keys
+        runs[-1].append(row)
+    return runs
+
+
+def bulk_insert(engine: Engine, model, rows: RowsSource, batch_size: int = DEFAULT_BATCH_SIZE) -> BulkInsertReport:
+    """Inserts rows into the table of an ORM model with Core executemany, committing once per batch.
+
+    Unlike Session.add_all() no ORM objects are constructed and no identity map is maintained. Python side column
+    defaults (e.g. create_date, update_date) are still applied. On mssql+pyodbc the engine should be created with
+    fast_executemany enabled (see make_engine()), which sends each batch to the server as a single parameter array.
+
+    Args:
+        engine: engine of the target database
+        model: ORM class of the target table, e.g. DefectEvent or DefectRootCause
+        rows: DataFrame or iterable of dicts keyed by column names
+        batch_size: number of rows per executemany call and transaction
+
+    Returns:
+        a report with the number of inserted rows and the throughput
+    """
+    table = model.__table__
+    if engine.dialect.name == "mssql" and not getattr(engine.dialect, "fast_executemany", False):
+        logger.warning("Engine {} was created without fast_executemany, bulk inserts will be slow", engine.url)
+
+    statement = insert(table)
+    inserted_rows = 0
+    batches = 0
+    started = time.perf_counter()
+    for batch in iter_row_batches(rows, table.columns.keys(), batch_size):
+        with engine.begin() as connection:
+            for run in split_by_keys(batch):
+                connection.execute(statement, run)
+        inserted_rows += len(batch)
+        batches += 1
+        logger.debug("Inserted batch {} with {} rows into {}", batches, len(batch), table.name)
+
+    report = BulkInsertReport(table=table.name, rows=inserted_rows, batches=batches,
+                              seconds=time.perf_counter() - started)
+    logger.info("Inserted {} rows into {} in {:.2f} s ({:.0f} rows/s)",
+                report.rows, report.table, report.seconds, report.rows_per_second)
+    return report
+
+
+def bulk_insert_defect_events(engine: Engine, rows: RowsSource,
+                              batch_size: int = DEFAULT_BATCH_SIZE) -> BulkInsertReport:
+    """Bulk inserts defect events, see bulk_insert()"""
+    return bulk_insert(engine, DefectEvent, rows, batch_size=batch_size)
+
+
+def bulk_insert_defect_root_causes(engine: Engine, rows: RowsSource,
+                                   batch_size: int = DEFAULT_BATCH_SIZE) -> BulkInsertReport:
+    """Bulk inserts defect root causes, see bulk_insert(). Insert the referenced defect events first."""
+    return bulk_insert(engine, DefectRootCause, rows, batch_size=batch_size)
@@ -1,12 +1,24 @@
 """
 file provides queries to extract data
 """
-from typing import Set
-from sqlalchemy import text
-from sqlalchemy.orm import Session
-import pandas as pd
+from __future__ import annotations
 
+from datetime import datetime
+from typing import Iterable, List, Optional, Set
+from sqlalchemy import Table, bindparam, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql import Select
+
+from phillip.crud.async_lookups import DEFAULT_MAX_CONCURRENCY, gather_lookups
+from phillip.crud.partitioning import partitioned_select
+from phillip.crud.query_cache import QueryResultCache
 from phillip.db_connection import create_session_from_url
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
 
 create_root_cause_groups = text(
     "WITH A AS (SELECT A.create_date, A.event_id, B.signal_id, A.behaviour_pattern_id, A.strand_id, A.slab_id, B.importance "
@@ -39,13 +51,126 @@ def root_cause_pairs_query(date: str, signals_to_filter: Set[str]) -> str:
     return root_cause_groups
 
 
-def extract_root_cause_pairs(session: Session, date: str, signals_to_filter: Set[str]) -> pd.DataFrame:
-    query = root_cause_pairs_query(date=date, signals_to_filter=signals_to_filter)
-    with session as sess:
-        result = sess.execute(query)
-        column_names = list(result.keys())
-        data = pd.DataFrame(data=result, columns=column_names)
-    return data
+def extract_root_cause_pairs(session: Session, date: str, signals_to_filter: Set[str],
+                             result_cache: Optional[QueryResultCache] = None,
+                             cache_ttl: Optional[float] = None) -> pd.DataFrame:
+    # Runs the portable root_cause_pairs_statement instead of the T-SQL query of root_cause_pairs_query(), so the
+    # archived partitions are read as well. The window filters the root cause creation date, not the event month of
+    # the partitions, so all of them are read
+    statement = partitioned_select(session.get_bind(), root_cause_pairs_statement, None, None,
+                                   order_by=("event_id", "signal_id"))
+    params = root_cause_pairs_params(date, signals_to_filter)
+    if result_cache is not None:
+        return root_cause_pairs_frame(result_cache.read_frame(session=session, statement=statement, params=params,
+                                                              ttl=cache_ttl))
+    rows = session.execute(statement, params).fetchall()
+    return root_cause_pairs_frame(pd.DataFrame(data=rows, columns=root_cause_pairs_statement.columns.keys()))
+
+
+def root_cause_pairs_select(events: Table, root_causes: Table, with_casters: bool = False) -> Select:
+    """Builds the portable counterpart of root_cause_pairs_query() with bind parameters
+
+    Selects the events with exactly two root causes outside of the filtered signals in the time window, with all their
+    root causes. The signal patterns, which the T-SQL query builds with FOR XML PATH, are aggregated by
+    root_cause_pairs_frame(). The bind parameters are created by root_cause_pairs_params().
+
+    Args:
+        events: the defect event table, e.g. of phillip.db_models or of ddl_scripts/creating_tables.py
+        root_causes: the defect root cause table of the same models
+        with_casters: if True, the events are also filtered by the caster ids bound as casters
+    """
+    pair_event_ids = select(root_causes.c.event_id)\
+        .join(events, root_causes.c.event_id == events.c.event_id)\
+        .filter(root_causes.c.signal_id.not_in(bindparam("signals_to_filter", expanding=True)))\
+        .filter(events.c.slab_id.isnot(None))\
+        .filter(root_causes.c.create_date.between(bindparam("start"), bindparam("end")))\
+        .group_by(root_causes.c.event_id)\
+        .having(func.count(root_causes.c.event_id) == 2)
+
+    statement = select(events.c.create_date,
+                       events.c.event_id,
+                       root_causes.c.signal_id,
+                       events.c.behaviour_pattern_id,
+                       events.c.strand_id,
+                       events.c.slab_id,
+                       root_causes.c.importance
+                       ).join(events, root_causes.c.event_id == events.c.event_id)
+    if with_casters:
+        statement = statement.filter(events.c.caster_id.in_(bindparam("casters", expanding=True)))
+    return statement.filter(events.c.event_id.in_(pair_event_ids.scalar_subquery()))\
+        .order_by(events.c.event_id, root_causes.c.signal_id)
+
+
+root_cause_pairs_statement = root_cause_pairs_select(DefectEvent.__table__, DefectRootCause.__table__)
+
+
+def root_cause_pairs_params(date: str, signals_to_filter: Iterable[str], end: Optional[datetime] = None,
+                            casters: Optional[Iterable[str]] = None) -> dict:
+    """Creates the bind parameters of root_cause_pairs_select()
+
+    The window ends with the current day (GETDATE() in the T-SQL queries) unless end is given. It ends at the next
+    midnight instead of now, so the cache key of the query stays the same during the day.
+
+    Args:
+        date: start of the time window of the root cause creation date, e.g. "2022-12-23"
+        signals_to_filter: signal ids which are not counted as root causes
+        end: end of the time window, defaults to the start of the next day
+        casters: caster ids (or Enum members of them) of a statement built with_casters
+    """
+    params = {"signals_to_filter": list(signals_to_filter), "start": pd.Timestamp(date).to_pydatetime(),
+              "end": end or (pd.Timestamp.now().normalize() + pd.Timedelta(days=1)).to_pydatetime()}
+    if casters is not None:
+        params["casters"] = [getattr(caster, "value", caster) for caster in casters]
+    return params
+
+
+def root_cause_pairs_frame(rows: pd.DataFrame) -> pd.DataFrame:
+    """Aggregates the rows of root_cause_pairs_statement into the columns of extract_root_cause_pairs()
+
+    Args:
+        rows: the root causes of the pair events ordered by event_id and signal_id
+
+    Returns:
+        one row per event and importance with the comma separated signal ids of the event as signal_pattern
+    """
+    columns = ["create_date", "event_id", "behaviour_pattern_id", "strand_id", "slab_id", "importance"]
+    if rows.empty:
+        return pd.DataFrame(columns=columns + ["signal_pattern"])
+    patterns = rows.groupby("event_id", sort=False)["signal_id"].agg(",".join).rename("signal_pattern")
+    pairs = rows[columns].drop_duplicates(ignore_index=True)
+    return pairs.join(patterns, on="event_id")
+
+
+async def extract_root_cause_pairs_async(session: AsyncSession, date: str, signals_to_filter: Set[str],
+                                         end: Optional[datetime] = None) -> pd.DataFrame:
+    """Asyncio counterpart of extract_root_cause_pairs()
+
+    Runs the portable root_cause_pairs_statement instead of the T-SQL query, so it works with every driver of
+    ASYNC_DRIVERS (e.g. aiosqlite). The signal ids of a pattern are sorted. Archived partitions are read as well.
+
+    Args:
+        session: session to execute the query with
+        date: start of the time window of the root cause creation date, e.g. "2022-12-23"
+        signals_to_filter: signal ids which are not counted as root causes
+        end: end of the time window, defaults to the start of the next day
+    """
+    statement = await session.run_sync(lambda sync_session: partitioned_select(
+        sync_session.connection(), root_cause_pairs_statement, None, None, order_by=("event_id", "signal_id")))
+    result = await session.execute(statement, root_cause_pairs_params(date, signals_to_filter, end))
+    rows = pd.DataFrame(data=result.fetchall(), columns=root_cause_pairs_statement.columns.keys())
+    return root_cause_pairs_frame(rows)
+
+
+async def gather_root_cause_pairs(session_factory: sessionmaker,
+                                  dates: Iterable[str],
+                                  signals_to_filter: Set[str],
+                                  max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> List[pd.DataFrame]:
+    """Extracts the root cause pairs of several start dates concurrently, one DataFrame per date in the given order"""
+
+    async def lookup(session: AsyncSession, date: str) -> pd.DataFrame:
+        return await extract_root_cause_pairs_async(session, date=date, signals_to_filter=signals_to_filter)
+
+    return await gather_lookups(session_factory, lookup, dates, max_concurrency=max_concurrency)
 
 
 if __name__ == "__main__":
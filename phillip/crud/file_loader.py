@@ -0,0 +1,339 @@
+"""
+Provides a chunked loader of CSV and Parquet files into the defect tables.
+
+Files are read chunk by chunk, the columns are mapped and validated against the column definitions of the
+phillip.db_models tables with vectorized pandas operations and every chunk is written with the Core bulk insert path
+(see bulk_insert.py), so memory stays flat for files of any size and no ORM objects are constructed.
+"""
+from __future__ import annotations
+
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+from loguru import logger
+from sqlalchemy import JSON, Boolean, DateTime, Enum, Float, Integer, MetaData, String, Table, inspect, text
+from sqlalchemy.engine import Engine
+
+from phillip.crud.bulk_insert import DEFAULT_BATCH_SIZE, bulk_insert
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.db_models.signal_meta import SignalMeta
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+DEFAULT_CHUNK_SIZE = 200_000
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+PathLike = Union[str, Path]
+
+
+@dataclass
+class FileLoadReport:
+    """Summary of a file load"""
+
+    table: str
+    path: str
+    rows: int
+    invalid_rows: int
+    chunks: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float("inf")
+
+
+def _is_parquet(path: Path) -> bool:
+    return path.suffix.lower() in PARQUET_SUFFIXES
+
+
+def iter_file_chunks(path: PathLike, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     string_columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Reads a CSV (optionally compressed, e.g. .csv.gz) or Parquet file as DataFrames of at most chunk_size rows
+
+    Reading Parquet files requires pyarrow, which is imported only then.
+
+    Args:
+        path: path of the file, files ending with .parquet or .pq are read as Parquet, all others as CSV
+        chunk_size: max. number of rows per DataFrame
+        string_columns: CSV columns to read as text instead of inferring their type, e.g. ids with leading zeros
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be a positive number, got {chunk_size=}")
+    path = Path(path)
+
+    if _is_parquet(path):
+        try:
+            import pyarrow.parquet as pq
+        except ModuleNotFoundError as error:
+            raise ModuleNotFoundError("Reading Parquet files requires pyarrow, install it with "
+                                      "'poetry install -E parquet'", name=error.name) from error
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        header = pd.read_csv(path, nrows=0).columns
+        dtype = {column: str for column in header if column in set(string_columns or ())}
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=dtype)
+
+
+def _map_columns(chunk: pd.DataFrame, table: Table, column_map: Dict[str, str],
+                 ignore_unknown_columns: bool) -> pd.DataFrame:
+    chunk = chunk.rename(columns=column_map)
+    unknown_columns = [column for column in chunk.columns if column not in table.c]
+    if unknown_columns:
+        if not ignore_unknown_columns:
+            raise ValueError(f"File contains columns which are not part of {table.name}: {unknown_columns}")
+        chunk = chunk.drop(columns=unknown_columns)
+
+    missing_columns = [column.name for column in table.columns
+                       if column.name not in chunk.columns and not column.nullable and column.default is None
+                       and column.server_default is None and column.autoincrement is not True]
+    if missing_columns:
+        raise ValueError(f"File misses the required columns of {table.name}: {missing_columns}")
+    return chunk
+
+
+def _parse_json(value):
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+def _coerce_column(values: pd.Series, column) -> tuple:
+    """Converts the values of a file column to the type of a table column
+
+    Returns:
+        the converted values and a boolean Series which is True for values that can not be stored in the column
+    """
+    present = values.notna()
+    column_type = column.type
+    if isinstance(column_type, Enum):
+        converted = values
+        invalid = present & ~values.isin(column_type.enums)
+    elif isinstance(column_type, String):
+        converted = values.where(~present, values.astype(str))
+        invalid = pd.Series(False, index=values.index)
+        if column_type.length is not None:
+            invalid = present & (converted.str.len() > column_type.length)
+    elif isinstance(column_type, Boolean):
+        converted = values.map({True: True, False: False, 1: True, 0: False, "1": True, "0": False,
+                                "true": True, "false": False, "True": True, "False": False})
+        invalid = present & converted.isna()
+    elif isinstance(column_type, Integer):
+        numbers = pd.to_numeric(values, errors="coerce")
+        invalid = present & (numbers.isna() | (numbers % 1 != 0))
+        converted = numbers.where(~invalid).astype("Int64")
+    elif isinstance(column_type, Float):
+        converted = pd.to_numeric(values, errors="coerce")
+        invalid = present & converted.isna()
+    elif isinstance(column_type, DateTime):
+        converted = pd.to_datetime(values, errors="coerce")
+        if converted.dt.tz is not None:
+            converted = converted.dt.tz_convert("UTC").dt.tz_localize(None)
+        invalid = present & converted.isna()
+    elif isinstance(column_type, JSON):
+        invalid = pd.Series(False, index=values.index)
+        parsed = []
+        for position, value in enumerate(values.where(present, None)):
+            try:
+                parsed.append(_parse_json(value))
+            except ValueError:
+                parsed.append(None)
+                invalid.iat[position] = True
+        converted = pd.Series(parsed, index=values.index, dtype=object)
+    else:
+        # e.g. CompactSignalData, whose bind processing validates the values itself
+        converted = values
+        invalid = pd.Series(False, index=values.index)
+
+    if not column.nullable and column.default is None and column.server_default is None:
+        invalid = invalid | ~present
+    return converted, invalid
+
+
+def validate_chunk(chunk: pd.DataFrame, table: Table) -> tuple:
+    """Converts all columns of a mapped chunk to the types of the table columns
+
+    Returns:
+        the converted chunk and a dictionary of column names with the positions of invalid values in the chunk
+    """
+    converted = {}
+    invalid_positions = {}
+    for name in chunk.columns:
+        converted[name], invalid = _coerce_column(chunk[name], table.c[name])
+        if invalid.any():
+            invalid_positions[name] = invalid.to_numpy().nonzero()[0].tolist()
+    return pd.DataFrame(converted, index=chunk.index), invalid_positions
+
+
+def load_file(engine: Engine, model, path: PathLike,
+              column_map: Optional[Dict[str, str]] = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE,
+              batch_size: int = DEFAULT_BATCH_SIZE,
+              skip_invalid_rows: bool = False,
+              ignore_unknown_columns: bool = False,
+              schema: Optional[str] = None) -> FileLoadReport:
+    """Streams a CSV or Parquet file into the table of an ORM model
+
+    Every chunk is committed on its own (in batches of batch_size rows, see bulk_insert()), a failed load can be resumed
+    by loading the remaining rows. On mssql+pyodbc the engine should be created with fast_executemany enabled.
+
+    Args:
+        engine: engine of the target database
+        model: ORM class of the target table, e.g. SignalMeta, DefectEvent or DefectRootCause
+        path: path of the CSV or Parquet file
+        column_map: optional dictionary of file column names with the table column names they are loaded into
+        chunk_size: number of rows read, validated and inserted at once
+        batch_size: number of rows per executemany call and transaction
+        skip_invalid_rows: if True rows with values of the wrong type are logged and skipped, otherwise the load stops
+            with a ValueError at the first chunk with invalid rows
+        ignore_unknown_columns: if True file columns which are not part of the table are dropped instead of raising
+        schema: schema of the table, None for the default schema
+
+    Returns:
+        a report with the number of loaded and skipped rows and the throughput
+    """
+    table = model.__table__
+    path = Path(path)
+    column_map = column_map or {}
+    if schema is not None:
+        engine = engine.execution_options(schema_translate_map={None: schema})
+    string_columns = [file_column for file_column in _file_columns(path, table, column_map)
+                      if isinstance(table.c[column_map.get(file_column, file_column)].type, String)]
+
+    report = FileLoadReport(table=table.name, path=str(path), rows=0, invalid_rows=0, chunks=0, seconds=0.0)
+    started = time.perf_counter()
+    for chunk in iter_file_chunks(path, chunk_size=chunk_size, string_columns=string_columns):
+        chunk, invalid_positions = validate_chunk(_map_columns(chunk, table, column_map, ignore_unknown_columns),
+                                                  table)
+        if invalid_positions:
+            first_row = report.rows + report.invalid_rows
+            details = {name: [first_row + position for position in positions[:5]]
+                       for name, positions in invalid_positions.items()}
+            if not skip_invalid_rows:
+                raise ValueError(f"Invalid values in {path.name} for {table.name}, first rows per column: {details}")
+            invalid = sorted({position for positions in invalid_positions.values() for position in positions})
+            logger.warning("Skipping {} rows of {} with invalid values, first rows per column: {}",
+                           len(invalid), path.name, details)
+            report.invalid_rows += len(invalid)
+            chunk = chunk.drop(index=chunk.index[invalid])
+
+        if len(chunk):
+            bulk_insert(engine, model, chunk, batch_size=batch_size)
+        report.rows += len(chunk)
+        report.chunks += 1
+        logger.debug("Loaded chunk {} of {} with {} rows into {}", report.chunks, path.name, len(chunk), table.name)
+
+    report.seconds = time.perf_counter() - started
+    logger.info("Loaded {} rows of {} into {} in {:.2f} s ({:.0f} rows/s), skipped {} invalid rows",
+                report.rows, path.name, report.table, report.seconds, report.rows_per_second, report.invalid_rows)
+    return report
+
+
+def _file_columns(path: Path, table: Table, column_map: Dict[str, str]) -> List[str]:
+    if _is_parquet(path):
+        return []  # Parquet files carry their column types
+    return [column for column in pd.read_csv(path, nrows=0).columns if column_map.get(column, column) in table.c]
+
+
+@contextmanager
+def suspended_indexes(engine: Engine, model, schema: Optional[str] = None) -> Iterator[List[str]]:
+    """Suspends the non-clustered indexes of a table for the duration of a very large load and rebuilds them after
+
+    Maintaining a dozen indexes per inserted row is what makes large loads slow, building each of them once afterwards
+    is much faster. On mssql the indexes are disabled and rebuilt (ALTER INDEX ... DISABLE / REBUILD), on other
+    dialects they are dropped and created again from their reflected definitions. The indexes are rebuilt even if the
+    load fails, the primary key and unique constraints are never touched.
+
+    Args:
+        engine: engine of the target database
+        model: ORM class of the table
+        schema: schema of the table, None for the default schema
+
+    Yields:
+        the names of the suspended indexes
+    """
+    table_name = model.__table__.name
+    if engine.dialect.name == "mssql":
+        preparer = engine.dialect.identifier_preparer
+        qualified_name = f"{schema}.{table_name}" if schema else table_name
+        quoted_table = preparer.quote(table_name)
+        if schema:
+            quoted_table = f"{preparer.quote_schema(schema)}.{quoted_table}"
+        with engine.begin() as connection:
+            index_names = connection.execute(
+                text("SELECT name FROM sys.indexes WHERE object_id = OBJECT_ID(:table_name) "
+                     "AND type_desc = 'NONCLUSTERED' AND is_primary_key = 0 AND is_unique_constraint = 0 "
+                     "AND is_disabled = 0"),
+                {"table_name": qualified_name}).scalars().all()
+            for index_name in index_names:
+                connection.exec_driver_sql(
+                    f"ALTER INDEX {preparer.quote(index_name)} ON {quoted_table} DISABLE")
+        logger.info("Disabled {} indexes of {}", len(index_names), table_name)
+        try:
+            yield index_names
+        finally:
+            started = time.perf_counter()
+            with engine.begin() as connection:
+                for index_name in index_names:
+                    connection.exec_driver_sql(
+                        f"ALTER INDEX {preparer.quote(index_name)} ON {quoted_table} REBUILD")
+            logger.info("Rebuilt {} indexes of {} in {:.2f} s", len(index_names), table_name,
+                        time.perf_counter() - started)
+    else:
+        reflected_table = Table(table_name, MetaData(), schema=schema, autoload_with=engine)
+        unique_constraints = {constraint["name"]
+                              for constraint in inspect(engine).get_unique_constraints(table_name, schema=schema)}
+        indexes = [index for index in reflected_table.indexes if index.name not in unique_constraints]
+        with engine.begin() as connection:
+            for index in indexes:
+                index.drop(connection)
+        logger.info("Dropped {} indexes of {}", len(indexes), table_name)
+        try:
+            yield [index.name for index in indexes]
+        finally:
+            started = time.perf_counter()
+            with engine.begin() as connection:
+                for index in indexes:
+                    index.create(connection)
+            logger.info("Created {} indexes of {} in {:.2f} s", len(indexes), table_name,
+                        time.perf_counter() - started)
+
+
+def load_defect_files(engine: Engine,
+                      signal_meta: Optional[PathLike] = None,
+                      defect_events: Optional[PathLike] = None,
+                      defect_root_causes: Optional[PathLike] = None,
+                      suspend_indexes: bool = False,
+                      schema: Optional[str] = None,
+                      **load_kwargs) -> List[FileLoadReport]:
+    """Loads files into signal_meta, defect_event and defect_root_cause in the order of their foreign keys
+
+    Args:
+        engine: engine of the target database
+        signal_meta: optional CSV or Parquet file of signal metadata
+        defect_events: optional CSV or Parquet file of defect events
+        defect_root_causes: optional CSV or Parquet file of defect root causes
+        suspend_indexes: if True the indexes of each table are suspended during its load, see suspended_indexes()
+        schema: schema of the tables, None for the default schema
+        load_kwargs: further keyword arguments of load_file(), e.g. chunk_size or skip_invalid_rows
+
+    Returns:
+        a report per loaded file
+    """
+    reports = []
+    for model, path in ((SignalMeta, signal_meta), (DefectEvent, defect_events), (DefectRootCause, defect_root_causes)):
+        if path is None:
+            continue
+        if suspend_indexes:
+            with suspended_indexes(engine, model, schema=schema):
+                reports.append(load_file(engine, model, path, schema=schema, **load_kwargs))
+        else:
+            reports.append(load_file(engine, model, path, schema=schema, **load_kwargs))
+    return reports
@@ -0,0 +1,316 @@
+"""
+Provides a micro-batched ingestion path for live defect events and their root causes.
+
+Producers (e.g. the detection models) submit event payloads with nested root causes to a bounded in-memory queue. When
+the queue is full, submit() blocks until the writer caught up (or fails after its timeout), so a burst slows the
+producers down instead of growing the memory without limit. A writer thread takes the payloads off the queue in
+micro-batches, which are flushed when max_batch_size payloads are collected or max_batch_latency seconds after the
+first payload of the batch was submitted, whichever comes first. Every batch is validated with the pydantic models of
+phillip.schemas and written with one executemany per table in one transaction. If the database rejects a batch with an
+integrity error (e.g. a duplicate event_id), the batch is bisected until the offending payloads are isolated, these are
+kept as dead letters and the others are written:
+
+    service = LiveIngestionService(engine)
+    with service:
+        service.submit({"event_id": 1, "event_type": "live", ..., "root_causes": [{"signal_id": ...}, ...]})
+    service.log_summary()
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Iterable, List, NamedTuple, Optional, Union
+
+from loguru import logger
+from pydantic import ValidationError
+from sqlalchemy import insert, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.db_models.signal_codec import compact_signal_data_enabled, encode_signal_data
+from phillip.query_metrics import LatencyHistogram
+from phillip.schemas import DefectEventPayload
+
+DEFAULT_QUEUE_SIZE = 10_000
+DEFAULT_MAX_BATCH_SIZE = 500
+DEFAULT_MAX_BATCH_LATENCY = 0.2  # seconds
+DEFAULT_MAX_DEAD_LETTERS = 1_000
+_POLL_SECONDS = 0.1
+
+Payload = Union[dict, DefectEventPayload]
+
+
+class _QueuedPayload(NamedTuple):
+    submitted: float  # time.perf_counter() of submit()
+    payload: Payload
+
+
+class _PayloadRows(NamedTuple):
+    queued: _QueuedPayload
+    event: dict
+    root_causes: List[dict]
+
+
+class DeadLetter(NamedTuple):
+    """A valid payload which the database rejected with an integrity error"""
+
+    payload: Payload
+    error: str
+
+
+@dataclass
+class IngestionStats:
+    """Snapshot of the counters of a LiveIngestionService"""
+
+    submitted: int
+    events: int  # committed events
+    root_causes: int  # committed root causes
+    rejected: int  # payloads which failed validation
+    failed: int  # valid payloads of batches whose transaction failed for other reasons than an integrity error
+    dead_lettered: int  # valid payloads rejected by the database with an integrity error
+    batches: int
+    queue_depth: int
+    seconds: float  # since the service was started
+    latency_p50_s: float  # from submit() to the commit of the batch
+    latency_p95_s: float
+    latency_p99_s: float
+    latency_max_s: float
+
+    @property
+    def events_per_second(self) -> float:
+        return self.events / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return (self.events + self.failed + self.dead_lettered) / self.batches if self.batches else 0.0
+
+
+class LiveIngestionService:
+    """Validates and writes defect event payloads in micro-batches from a background thread
+
+    Args:
+        engine: engine of the target database, on mssql+pyodbc created with fast_executemany (see make_engine())
+        queue_size: max. number of submitted payloads waiting to be written
+        max_batch_size: max. number of payloads written per transaction
+        max_batch_latency: max. seconds between the submit() of the first payload of a batch and its flush
+        compact_signal_data: if True, signal_data of the root causes is also written encoded to signal_data_compact,
+            None follows set_compact_signal_data() (off by default). start() fails if the column does not exist
+        max_dead_letters: max. number of the most recent dead letters kept, see dead_letters()
+    """
+
+    def __init__(self, engine: Engine,
+                 queue_size: int = DEFAULT_QUEUE_SIZE,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_batch_latency: float = DEFAULT_MAX_BATCH_LATENCY,
+                 compact_signal_data: Optional[bool] = None,
+                 max_dead_letters: int = DEFAULT_MAX_DEAD_LETTERS):
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be a positive number, got {max_batch_size=}")
+        if max_batch_latency < 0:
+            raise ValueError(f"max_batch_latency must not be negative, got {max_batch_latency=}")
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_batch_latency = max_batch_latency
+        self.compact_signal_data = compact_signal_data_enabled(compact_signal_data)
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._latency = LatencyHistogram()
+        self._dead_letters: deque = deque(maxlen=max_dead_letters)
+        self._started = 0.0
+        self._submitted = self._events = self._root_causes = self._rejected = self._failed = self._batches = 0
+        self._dead_lettered = 0
+
+    def start(self) -> LiveIngestionService:
+        """Starts the writer thread
+
+        Raises:
+            RuntimeError: if the service was already started, or compact_signal_data is enabled but the
+                defect_root_cause table has no signal_data_compact column (see add_signal_data_compact_column())
+        """
+        if self._thread is not None:
+            raise RuntimeError("The ingestion service was already started")
+        if self.compact_signal_data:
+            # Checked once here, otherwise every batch would fail on an unmigrated table and be counted as failed
+            table = DefectRootCause.__table__
+            schema = self.engine.get_execution_options().get("schema_translate_map", {}).get(table.schema, table.schema)
+            columns = {column["name"] for column in inspect(self.engine).get_columns(table.name, schema=schema)}
+            if table.c.signal_data_compact.name not in columns:
+                raise RuntimeError(f"compact_signal_data is enabled but {table.name} has no column "
+                                   f"{table.c.signal_data_compact.name}, add and backfill it first")
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="live-ingestion", daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, payload: Payload, timeout: Optional[float] = None):
+        """Queues an event payload with nested root causes, blocking while the queue is full
+
+        Args:
+            payload: dict in the layout of phillip.schemas.DefectEventPayload, or a DefectEventPayload
+            timeout: max. seconds to wait for free space in the queue, None waits as long as needed
+
+        Raises:
+            queue.Full: if the queue is still full after the timeout
+        """
+        if self._thread is None or self._stopping.is_set():
+            raise RuntimeError("The ingestion service is not running")
+        self._queue.put(_QueuedPayload(time.perf_counter(), payload), timeout=timeout)
+        with self._lock:
+            self._submitted += 1
+
+    def submit_many(self, payloads: Iterable[Payload], timeout: Optional[float] = None):
+        """Queues event payloads one after another, see submit()"""
+        for payload in payloads:
+            self.submit(payload, timeout=timeout)
+
+    def join(self):
+        """Blocks until every submitted payload was written or discarded"""
+        self._queue.join()
+
+    def close(self, timeout: Optional[float] = None):
+        """Stops accepting payloads, writes the queued ones and stops the writer thread"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("Live ingestion writer did not finish within {} s, {} payloads are pending",
+                           timeout, self._queue.qsize())
+
+    def __enter__(self) -> LiveIngestionService:
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            batch = [first]
+            deadline = first.submitted + self.max_batch_latency
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._flush(batch)
+            except Exception:  # the writer thread must survive any failure of a batch
+                logger.exception("Flushing a batch of {} live defect events failed", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _rows(self, payload: Payload) -> tuple:
+        if not isinstance(payload, DefectEventPayload):
+            payload = DefectEventPayload.parse_obj(payload)
+        event = payload.dict(exclude={"root_causes"})
+        root_causes = []
+        for root_cause in payload.root_causes:
+            row = root_cause.dict()
+            row["event_id"] = payload.event_id
+            if self.compact_signal_data:
+                row["signal_data_compact"] = encode_signal_data(row["signal_data"]) \
+                    if row["signal_data"] is not None else None
+            root_causes.append(row)
+        return event, root_causes
+
+    def _flush(self, batch: List[_QueuedPayload]):
+        rows = []
+        rejected = 0
+        for queued in batch:
+            try:
+                event, event_root_causes = self._rows(queued.payload)
+            except (ValidationError, ValueError, TypeError, KeyError) as error:
+                rejected += 1
+                logger.warning("Rejected live defect event payload: {}", error)
+                continue
+            rows.append(_PayloadRows(queued, event, event_root_causes))
+
+        committed, failed, dead_letters = [], [], []
+        if rows:
+            try:
+                self._write(rows, committed, dead_letters)
+            except Exception:
+                logger.exception("Writing a batch of {} live defect events failed, the batch was discarded",
+                                 len(rows))
+                committed_ids = {id(payload_rows) for payload_rows in committed}
+                failed = [payload_rows for payload_rows in rows if id(payload_rows) not in committed_ids]
+
+        flushed = time.perf_counter()
+        root_causes = sum(len(payload_rows.root_causes) for payload_rows in committed)
+        with self._lock:
+            self._batches += 1
+            self._rejected += rejected
+            self._events += len(committed)
+            self._root_causes += root_causes
+            for payload_rows in committed:
+                self._latency.add(flushed - payload_rows.queued.submitted)
+            self._failed += len(failed)
+            self._dead_lettered += len(dead_letters)
+            self._dead_letters.extend(dead_letters)
+        logger.debug("Flushed a batch of {} live defect events with {} root causes ({} rejected, {} dead letters)",
+                     len(committed), root_causes, rejected, len(dead_letters))
+
+    def _write(self, rows: List[_PayloadRows], committed: List[_PayloadRows], dead_letters: List[DeadLetter]):
+        # Writes the rows in one transaction. On an integrity error both halves are written separately, so a single
+        # offending payload costs about 2 * log2(len(rows)) transactions and ends up as dead letter. Other errors
+        # (e.g. a lost connection) are raised, the rows of the transactions committed before are in committed
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(insert(DefectEvent.__table__), [payload_rows.event for payload_rows in rows])
+                root_causes = [root_cause for payload_rows in rows for root_cause in payload_rows.root_causes]
+                if root_causes:
+                    connection.execute(insert(DefectRootCause.__table__), root_causes)
+        except IntegrityError as error:
+            if len(rows) == 1:
+                logger.warning("Dead-lettered live defect event {}: {}", rows[0].event.get("event_id"), error.orig)
+                dead_letters.append(DeadLetter(rows[0].queued.payload, str(error.orig)))
+                return
+            middle = len(rows) // 2
+            self._write(rows[:middle], committed, dead_letters)
+            self._write(rows[middle:], committed, dead_letters)
+            return
+        committed.extend(rows)
+
+    def dead_letters(self) -> List[DeadLetter]:
+        """Returns the most recent payloads rejected by the database with an integrity error, oldest first"""
+        with self._lock:
+            return list(self._dead_letters)
+
+    def stats(self) -> IngestionStats:
+        """Returns the current counters, throughput and end-to-end latency quantiles"""
+        with self._lock:
+            return IngestionStats(submitted=self._submitted, events=self._events, root_causes=self._root_causes,
+                                  rejected=self._rejected, failed=self._failed, dead_lettered=self._dead_lettered,
+                                  batches=self._batches,
+                                  queue_depth=self._queue.qsize(),
+                                  seconds=time.perf_counter() - self._started if self._started else 0.0,
+                                  latency_p50_s=self._latency.quantile(0.50),
+                                  latency_p95_s=self._latency.quantile(0.95),
+                                  latency_p99_s=self._latency.quantile(0.99),
+                                  latency_max_s=self._latency.max_seconds)
+
+    def log_summary(self):
+        """Logs the throughput and the end-to-end latency"""
+        stats = self.stats()
+        logger.info("Ingested {} of {} live defect events with {} root causes in {} batches ({:.0f} events/s, "
+                    "mean batch {:.1f}), latency p50 {:.4f} s, p95 {:.4f} s, p99 {:.4f} s, max {:.4f} s, "
+                    "{} rejected, {} failed, {} dead letters, {} queued",
+                    stats.events, stats.submitted, stats.root_causes, stats.batches, stats.events_per_second,
+                    stats.mean_batch_size, stats.latency_p50_s, stats.latency_p95_s, stats.latency_p99_s,
+                    stats.latency_max_s, stats.rejected, stats.failed, stats.dead_lettered, stats.queue_depth)
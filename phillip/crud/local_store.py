@@ -0,0 +1,206 @@
+"""
+Provides an incremental sync of the defect tables into a local SQLite file for fast repeated analyses.
+"""
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from loguru import logger
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session
+
+from phillip.crud.streaming import DEFAULT_CHUNK_ROWS
+from phillip.db_connection import get_engine, get_session
+from phillip.db_models.base import Base
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.db_models.signal_meta import SignalMeta
+
+DEFAULT_LOCAL_STORE_PATH = Path("local_store") / "defects.db"
+
+# Referenced tables first, so the foreign keys of a synced row always point to synced rows
+SYNCED_MODELS = (SignalMeta, DefectEvent, DefectRootCause)
+
+# The watermark table only exists in the local store and is therefore not part of Base.metadata
+watermark_metadata = MetaData()
+sync_watermark = Table(
+    "sync_watermark",
+    watermark_metadata,
+    Column("table_name", String(128), primary_key=True, comment="Name of the synced table"),
+    Column("watermark", DateTime, nullable=False, comment="Highest update_date of the synced rows"),
+    Column("synced_rows", Integer, nullable=False, default=0, comment="Number of rows synced in total"),
+    Column("sync_date", DateTime, nullable=False, default=datetime.utcnow, comment="Time of the last sync in UTC"),
+)
+
+
+@dataclass
+class SyncReport:
+    """Summary of the sync of a single table"""
+
+    table: str
+    rows: int
+    previous_watermark: Optional[datetime]
+    watermark: Optional[datetime]
+    seconds: float
+
+
+def get_local_store_engine(path=DEFAULT_LOCAL_STORE_PATH, timeout: int = 30) -> Engine:
+    """Returns the engine of a local store file and creates the file and its tables if they are missing
+
+    The tables are created from the phillip models without a schema. SQLite names its default schema "main", so the
+    schema-qualified models of ddl_scripts/creating_tables.py and the data_analysis queries work on the store as well.
+
+    Args:
+        path: path of the SQLite file
+        timeout: seconds to wait for a lock held by another connection
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    engine = get_engine(make_url(f"sqlite:///{path}"), timeout=timeout)
+    Base.metadata.create_all(engine, tables=[model.__table__ for model in SYNCED_MODELS])
+    watermark_metadata.create_all(engine)
+    return engine
+
+
+def get_local_store_session(path=DEFAULT_LOCAL_STORE_PATH) -> Session:
+    """Returns a new Session of a local store file, which can be passed to the analysis functions instead of a SQL
+    Server session"""
+    return get_session(get_local_store_engine(path))
+
+
+def read_watermark(local_engine: Engine, table_name: str) -> Optional[datetime]:
+    """Returns the watermark of a table, None if the table has never been synced"""
+    with local_engine.connect() as connection:
+        return connection.execute(
+            select(sync_watermark.c.watermark).where(sync_watermark.c.table_name == table_name)
+        ).scalar()
+
+
+def _upsert_statement(table: Table, columns: List[Column]):
+    statement = sqlite_insert(table)
+    primary_keys = [column.name for column in table.primary_key.columns]
+    return statement.on_conflict_do_update(
+        index_elements=primary_keys,
+        set_={column.name: statement.excluded[column.name] for column in columns if column.name not in primary_keys},
+    )
+
+
+def source_columns(source_engine: Engine, table: Table, source_schema: Optional[str] = "main") -> List[Column]:
+    """Returns the columns of a model table which exist on the source, in the order of the model
+
+    Columns added to the models later (e.g. signal_data_compact) are missing on sources which were not migrated yet
+    and are therefore left out of the sync instead of failing the select.
+    """
+    existing_columns = {column["name"] for column in inspect(source_engine).get_columns(table.name, schema=source_schema)}
+    missing_columns = [column.name for column in table.columns if column.name not in existing_columns]
+    if missing_columns:
+        logger.info("Columns {} of {} do not exist on the source and are not synced", missing_columns, table.name)
+    return [column for column in table.columns if column.name in existing_columns]
+
+
+def _watermark_statement():
+    statement = sqlite_insert(sync_watermark)
+    return statement.on_conflict_do_update(
+        index_elements=[sync_watermark.c.table_name],
+        set_={
+            "watermark": statement.excluded.watermark,
+            "synced_rows": sync_watermark.c.synced_rows + statement.excluded.synced_rows,
+            "sync_date": statement.excluded.sync_date,
+        },
+    )
+
+
+def sync_table(source_engine: Engine, local_engine: Engine, model, batch_size: int = DEFAULT_CHUNK_ROWS,
+               source_schema: Optional[str] = "main") -> SyncReport:
+    """Copies the rows of a table which were created or changed since the last sync into the local store
+
+    Rows are selected by update_date >= watermark in update_date order and upserted batch by batch. Every batch commits
+    together with the new watermark, so an interrupted sync resumes where it stopped. Rows with an update_date equal to
+    the watermark are fetched again, which is harmless since the upsert is idempotent, but makes sure rows committed on
+    the source with the same timestamp after the last sync are not skipped. Rows deleted on the source are not detected.
+    Only the columns of the model which exist on the source are selected, see source_columns().
+
+    Args:
+        source_engine: engine of the source database, e.g. get_sqlservertest_engine()
+        local_engine: engine of the local store, see get_local_store_engine()
+        model: ORM class of the table to sync, one of SYNCED_MODELS
+        batch_size: number of rows fetched and upserted per transaction
+        source_schema: schema of the tables on the source, None for the default schema
+
+    Returns:
+        a report with the number of synced rows and the watermarks before and after the sync
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be a positive number, got {batch_size=}")
+
+    table = model.__table__
+    previous_watermark = read_watermark(local_engine, table.name)
+    columns = source_columns(source_engine, table, source_schema)
+    query = select(*columns).order_by(table.c.update_date, *table.primary_key.columns)
+    if previous_watermark is not None:
+        query = query.where(table.c.update_date >= previous_watermark)
+
+    upsert = _upsert_statement(table, columns)
+    watermark_upsert = _watermark_statement()
+    watermark = previous_watermark
+    synced_rows = 0
+    started = time.perf_counter()
+    execution_options = {"stream_results": True}
+    if source_schema is not None:
+        execution_options["schema_translate_map"] = {None: source_schema}
+
+    with source_engine.connect() as source_connection:
+        result = source_connection.execution_options(**execution_options).execute(query)
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                batch = [dict(row._mapping) for row in rows]
+                watermark = batch[-1]["update_date"]
+                with local_engine.begin() as local_connection:
+                    local_connection.execute(upsert, batch)
+                    local_connection.execute(watermark_upsert, {"table_name": table.name, "watermark": watermark,
+                                                                "synced_rows": len(batch),
+                                                                "sync_date": datetime.utcnow()})
+                synced_rows += len(batch)
+                logger.debug("Synced {} rows of {} up to {}", synced_rows, table.name, watermark)
+        finally:
+            result.close()
+
+    report = SyncReport(table=table.name, rows=synced_rows, previous_watermark=previous_watermark,
+                        watermark=watermark, seconds=time.perf_counter() - started)
+    logger.info("Synced {} rows of {} in {:.2f} s, watermark {} -> {}",
+                report.rows, report.table, report.seconds, report.previous_watermark, report.watermark)
+    return report
+
+
+def sync_local_store(source_engine: Engine, local_engine: Engine, models: Iterable = SYNCED_MODELS,
+                     batch_size: int = DEFAULT_CHUNK_ROWS, source_schema: Optional[str] = "main") -> List[SyncReport]:
+    """Syncs the defect tables into the local store, see sync_table()
+
+    Args:
+        source_engine: engine of the source database
+        local_engine: engine of the local store, see get_local_store_engine()
+        models: ORM classes of the tables to sync, referenced tables have to come first
+        batch_size: number of rows fetched and upserted per transaction
+        source_schema: schema of the tables on the source, None for the default schema
+
+    Returns:
+        a report per table
+    """
+    return [sync_table(source_engine, local_engine, model, batch_size=batch_size, source_schema=source_schema)
+            for model in models]
+
+
+# For direct script execution, e.g. as a scheduled job:
+if __name__ == "__main__":
+    from db_engines.sql_server_engine import get_sqlservertest_engine
+
+    sync_local_store(source_engine=get_sqlservertest_engine(), local_engine=get_local_store_engine())
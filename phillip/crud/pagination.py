@@ -0,0 +1,232 @@
+"""
+Provides keyset pagination over defect events with resumable cursors.
+
+Instead of skipping rows with OFFSET, which makes the database read and discard all previous pages, every page starts
+right after the sort key of the last row of the previous page:
+
+    WHERE create_date >= :last_create_date
+        AND (create_date > :last_create_date OR (create_date = :last_create_date AND event_id > :last_event_id))
+    ORDER BY create_date, event_id
+
+With an index on the sort key every page is an index seek plus page_size rows, no matter how deep the scan is. The
+position after each page is available as an opaque cursor token, a scan interrupted by a failure continues from the
+token of its last processed page.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Iterator, List, Optional
+
+from sqlalchemy import and_, bindparam, or_, select
+from sqlalchemy.orm import Session
+from sqlalchemy.types import DateTime, String
+
+from phillip.crud.partitioning import partitioned_select, partitions_for_window
+from phillip.db_models.defect_event import BehaviourPattern, DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+DEFAULT_PAGE_SIZE = 5_000
+# Max. number of event ids per root cause query, SQL Server accepts at most 2100 bind parameters per statement
+ROOT_CAUSE_FETCH_BATCH = 1000
+ORDER_KEYS = ("event_id", "create_date")
+_CURSOR_VERSION = 1
+
+root_causes_of_events_statement = select(DefectRootCause.event_id,
+                                         DefectRootCause.signal_id,
+                                         DefectRootCause.importance
+                                         )\
+    .filter(DefectRootCause.event_id.in_(bindparam("event_ids", expanding=True)))\
+    .order_by(DefectRootCause.event_id, DefectRootCause.signal_id)
+
+
+@dataclass(frozen=True)
+class KeysetCursor:
+    """Position of a keyset scan, i.e. the sort key of the last row returned so far"""
+
+    order_by: str
+    last_event_id: int
+    last_create_date: Optional[datetime] = None
+    filters_hash: str = ""
+
+    def encode(self) -> str:
+        """Returns the cursor as URL-safe token, which can be stored and passed to iter_defect_event_pages() later"""
+        state = {"v": _CURSOR_VERSION, "order_by": self.order_by, "event_id": self.last_event_id,
+                 "create_date": self.last_create_date.isoformat() if self.last_create_date is not None else None,
+                 "filters": self.filters_hash}
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode()
+
+    @classmethod
+    def decode(cls, token: str) -> KeysetCursor:
+        """Creates a cursor from a token of encode()"""
+        try:
+            state = json.loads(base64.urlsafe_b64decode(token.encode()))
+        except ValueError as error:
+            raise ValueError(f"Invalid cursor token {token!r}") from error
+        if state.get("v") != _CURSOR_VERSION:
+            raise ValueError(f"Unsupported cursor token version {state.get('v')}")
+        create_date = state["create_date"]
+        return cls(order_by=state["order_by"], last_event_id=state["event_id"],
+                   last_create_date=datetime.fromisoformat(create_date) if create_date is not None else None,
+                   filters_hash=state["filters"])
+
+
+@dataclass
+class DefectEventPage:
+    """A page of defect events, optionally with the root causes of its events"""
+
+    events: pd.DataFrame
+    root_causes: Optional[pd.DataFrame]
+    cursor: Optional[KeysetCursor]
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        """Token of the position after this page, None if the page is empty"""
+        return self.cursor.encode() if self.cursor is not None else None
+
+
+def _filters_hash(order_by: str, filter_params: dict) -> str:
+    state = json.dumps([order_by, sorted(filter_params.items())], default=str)
+    return hashlib.sha1(state.encode()).hexdigest()[:16]
+
+
+@lru_cache(maxsize=None)
+def defect_event_page_statement(order_by: str = "event_id", after_cursor: bool = False, filter_names: tuple = ()):
+    """Returns the statement of a page of defect events, built once per combination of arguments
+
+    Args:
+        order_by: "event_id" or "create_date" (which sorts by create_date, event_id)
+        after_cursor: if True the statement starts after the bind parameters last_event_id (and last_create_date)
+        filter_names: names of the bind parameters of the filters to apply, out of defects, strand_ids, casters, start
+            and end
+    """
+    if order_by not in ORDER_KEYS:
+        raise ValueError(f"order_by must be one of {ORDER_KEYS}, got {order_by=}")
+
+    statement = select(*DefectEvent.__table__.columns)
+    if "defects" in filter_names:
+        statement = statement.filter(DefectEvent.behaviour_pattern_id.in_(bindparam("defects", expanding=True)))
+    if "strand_ids" in filter_names:
+        statement = statement.filter(DefectEvent.strand_id.in_(bindparam("strand_ids", expanding=True)))
+    if "casters" in filter_names:
+        statement = statement.filter(DefectEvent.caster_id.in_(bindparam("casters", expanding=True)))
+    if "start" in filter_names:
+        statement = statement.filter(DefectEvent.create_date >= bindparam("start"))
+    if "end" in filter_names:
+        statement = statement.filter(DefectEvent.create_date <= bindparam("end"))
+
+    if order_by == "event_id":
+        if after_cursor:
+            statement = statement.filter(DefectEvent.event_id > bindparam("last_event_id"))
+        return statement.order_by(DefectEvent.event_id)
+
+    if after_cursor:
+        # Spelled out instead of a row value comparison (create_date, event_id) > (...), which SQL Server does not know.
+        # The redundant create_date >= :last_create_date lets the planner seek the index instead of scanning it for
+        # the OR (see benchmarks/query_plans.py)
+        last_create_date = bindparam("last_create_date", type_=DefectEvent.create_date.type)
+        statement = statement.filter(DefectEvent.create_date >= last_create_date)
+        statement = statement.filter(or_(DefectEvent.create_date > last_create_date,
+                                         and_(DefectEvent.create_date == last_create_date,
+                                              DefectEvent.event_id > bindparam("last_event_id"))))
+    return statement.order_by(DefectEvent.create_date, DefectEvent.event_id)
+
+
+def _root_causes_of_events(session: Session, event_ids: List[int], partitions: List[str]) -> pd.DataFrame:
+    # Sorted ids keep the batches, and therefore the concatenated rows, in event_id order
+    event_ids = sorted(event_ids)
+    statement = partitioned_select(session.get_bind(), root_causes_of_events_statement, None, None,
+                                   order_by=("event_id", "signal_id"), partitions=partitions)
+    rows = []
+    for batch_start in range(0, len(event_ids), ROOT_CAUSE_FETCH_BATCH):
+        rows.extend(session.execute(statement,
+                                    {"event_ids": event_ids[batch_start:batch_start + ROOT_CAUSE_FETCH_BATCH]}))
+    return pd.DataFrame(data=rows, columns=root_causes_of_events_statement.columns.keys())
+
+
+def iter_defect_event_pages(session: Session,
+                            page_size: int = DEFAULT_PAGE_SIZE,
+                            order_by: str = "event_id",
+                            cursor: Optional[str] = None,
+                            defects: Optional[List[BehaviourPattern]] = None,
+                            strand_ids: Optional[List[String]] = None,
+                            casters: Optional[List[String]] = None,
+                            start: Optional[DateTime()] = None,
+                            end: Optional[DateTime()] = None,
+                            with_root_causes: bool = False) -> Iterator[DefectEventPage]:
+    """Walks the defect events page by page in keyset order, every page costs the same regardless of its depth
+
+    Events created or changed behind the current position during the scan are not returned, events ahead of it are.
+    To resume an interrupted scan, pass the next_cursor of the last processed page together with the same filters.
+
+    Args:
+        session: session to execute the queries with
+        page_size: max. number of events per page
+        order_by: "event_id" or "create_date" (which sorts by create_date, event_id)
+        cursor: optional token of DefectEventPage.next_cursor to continue a previous scan after its page
+        defects: optional behaviour patterns to filter
+        strand_ids: optional strand ids to filter
+        casters: optional caster ids to filter
+        start: optional start of the event creation time window (inclusive)
+        end: optional end of the event creation time window (inclusive)
+        with_root_causes: if True the root causes of the events of every page are loaded as well, so no event is split
+            across two pages. They are queried in batches of ROOT_CAUSE_FETCH_BATCH event ids
+
+    Returns:
+        an iterator of non-empty pages
+    """
+    if page_size < 1:
+        raise ValueError(f"page_size must be a positive number, got {page_size=}")
+    filter_params = {name: value for name, value in (("defects", defects), ("strand_ids", strand_ids),
+                                                     ("casters", casters), ("start", start), ("end", end))
+                     if value is not None}
+    filter_params = {name: list(value) if name in ("defects", "strand_ids", "casters") else value
+                     for name, value in filter_params.items()}
+    filters_hash = _filters_hash(order_by, filter_params)
+    filter_names = tuple(filter_params)
+
+    position = None
+    if cursor is not None:
+        position = KeysetCursor.decode(cursor)
+        if position.order_by != order_by or position.filters_hash != filters_hash:
+            raise ValueError("The cursor belongs to a scan with another order or other filters")
+
+    first_page_statement = defect_event_page_statement(order_by, False, filter_names)
+    next_page_statement = defect_event_page_statement(order_by, True, filter_names)
+    column_names = first_page_statement.columns.keys()
+    # Archived events are read from the partitions of the window, which are looked up once per scan
+    partitions = partitions_for_window(session.get_bind(), start, end)
+    sort_keys = ("event_id",) if order_by == "event_id" else ("create_date", "event_id")
+    while True:
+        if position is None:
+            statement, params = first_page_statement, filter_params
+        else:
+            statement = next_page_statement
+            params = dict(filter_params, last_event_id=position.last_event_id)
+            if order_by == "create_date":
+                params["last_create_date"] = position.last_create_date
+        statement = partitioned_select(session.get_bind(), statement, start, end, order_by=sort_keys, limit=page_size,
+                                       partitions=partitions)
+        rows = session.execute(statement, params).fetchall()
+        if not rows:
+            return
+
+        last_row = rows[-1]
+        position = KeysetCursor(order_by=order_by, last_event_id=last_row.event_id,
+                                last_create_date=last_row.create_date if order_by == "create_date" else None,
+                                filters_hash=filters_hash)
+        events = pd.DataFrame(data=rows, columns=column_names)
+        root_causes = None
+        if with_root_causes:
+            root_causes = _root_causes_of_events(session, events["event_id"].tolist(), partitions)
+        yield DefectEventPage(events=events, root_causes=root_causes, cursor=position)
+
+        if len(rows) < page_size:
+            return
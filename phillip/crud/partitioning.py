@@ -0,0 +1,400 @@
+"""
+Provides monthly partitioning of defect events and their root causes into hot and cold tables.
+
+Recent rows stay in the hot tables defect_event and defect_root_cause. archive_defect_events() moves the rows of older
+months in batches into one pair of cold tables per month of the event creation date, e.g. defect_event_202301 and
+defect_root_cause_202301 (the root causes follow the creation month of their event, so joins never cross
+partitions). The cold tables have the columns, primary keys and indexes of the hot tables but no foreign keys.
+
+Range queries read the hot tables plus only those cold tables whose month overlaps the requested time window, combined
+with UNION ALL. partitioned_select() extends any query written against the hot tables this way, the extractors of
+phillip.crud and data_analysis run their statements through it, so archived rows are not missing from their results.
+As long as no partition exists, the statements are executed unchanged. The partition keys are looked up in the catalog
+once per engine and kept for PARTITION_CACHE_SECONDS, archive_defect_events() refreshes them, so the extractors do not
+pay a catalog round trip per query. The table-per-period layout works the same on SQL Server and on a local SQLite
+stand-in.
+"""
+from __future__ import annotations
+
+import re
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+from sqlalchemy import Column, Index, MetaData, Table, bindparam, delete, inspect, select, union_all
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.sql.visitors import replacement_traverse
+from sqlalchemy.types import DateTime, String
+
+from phillip.db_models.defect_event import BehaviourPattern, DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.frame_dtypes import apply_model_dtypes
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+DEFAULT_HOT_MONTHS = 3
+# Rows are moved by event id lists, which stay below the limit of 2100 parameters per statement of SQL Server
+DEFAULT_ARCHIVE_BATCH_SIZE = 1_000
+# Partitions created by another process are found after at most this many seconds, see refresh_partitions()
+PARTITION_CACHE_SECONDS = 60.0
+
+_PARTITION_SUFFIX = re.compile(r"^(?P<table>defect_event|defect_root_cause)_(?P<month>\d{6})$")
+_HOT_TABLES = (DefectEvent.__tablename__, DefectRootCause.__tablename__)
+
+# The cold tables are not part of Base.metadata, so create_all() of the models does not create them
+partition_metadata = MetaData()
+_partition_lock = threading.Lock()
+# Connection pool of an engine -> {schema: (expiry of time.monotonic(), partition keys)}. The pool is shared by the
+# copies of an engine with other execution options (e.g. a schema_translate_map), which read the same database
+_known_partitions: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+@dataclass
+class ArchiveReport:
+    """Summary of an archival run"""
+
+    cutoff: datetime
+    events: int
+    root_causes: int
+    partitions: List[str]
+    seconds: float
+
+
+def month_start(moment: datetime) -> datetime:
+    """Returns the first moment of the month of a datetime"""
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    """Returns the first moment of the month which is a number of months after (or before) the month of a datetime"""
+    month_index = moment.year * 12 + moment.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_key(moment: datetime) -> str:
+    """Returns the partition suffix of the month of a datetime, e.g. "202301" """
+    return f"{moment.year:04d}{moment.month:02d}"
+
+
+def _copy_table(table: Table, name: str, schema: Optional[str] = None) -> Table:
+    columns = [Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable,
+                      comment=column.comment) for column in table.columns]
+    # Index names are unique per database (SQLite) or table (SQL Server), the table name is part of them
+    indexes = [Index(index.name.replace(table.name, name, 1) if table.name in index.name else f"{name}_{index.name}",
+                     *[column.name for column in index.columns], unique=index.unique, **index.dialect_kwargs)
+               for index in table.indexes]
+    return Table(name, partition_metadata, *columns, *indexes, schema=schema,
+                 comment=f"Archived rows of {table.name}")
+
+
+def partition_tables(key: str, schema: Optional[str] = None) -> Tuple[Table, Table]:
+    """Returns the cold defect event and root cause tables of a partition key of partition_key()
+
+    Args:
+        key: partition key, e.g. "202301"
+        schema: schema the tables are qualified with, None for tables without schema (e.g. for schema_translate_map)
+    """
+    event_name, root_cause_name = f"{DefectEvent.__tablename__}_{key}", f"{DefectRootCause.__tablename__}_{key}"
+    # MetaData.tables is keyed by the schema qualified names
+    prefix = f"{schema}." if schema is not None else ""
+    with _partition_lock:
+        if f"{prefix}{event_name}" not in partition_metadata.tables:
+            _copy_table(DefectEvent.__table__, event_name, schema)
+            _copy_table(DefectRootCause.__table__, root_cause_name, schema)
+        tables = partition_metadata.tables
+        return tables[f"{prefix}{event_name}"], tables[f"{prefix}{root_cause_name}"]
+
+
+def existing_partitions(engine: Engine | Connection, schema: Optional[str] = None, refresh: bool = False) -> List[str]:
+    """Returns the sorted partition keys of the cold tables which exist in a database
+
+    The keys are looked up in the catalog once per engine and schema and cached for PARTITION_CACHE_SECONDS.
+
+    Args:
+        engine: engine or connection of the database
+        schema: schema of the tables, None for the default schema
+        refresh: if True, the keys are looked up again instead of taken from the cache
+    """
+    owner = engine.engine.pool
+    now = time.monotonic()
+    with _partition_lock:
+        cached = _known_partitions.get(owner, {}).get(schema)
+    if cached is not None and not refresh and cached[0] > now:
+        return list(cached[1])
+    table_names = inspect(engine).get_table_names(schema)
+    keys = sorted({match.group("month") for match in map(_PARTITION_SUFFIX.match, table_names)
+                   if match is not None and match.group("table") == DefectEvent.__tablename__})
+    with _partition_lock:
+        _known_partitions.setdefault(owner, {})[schema] = (now + PARTITION_CACHE_SECONDS, keys)
+    return list(keys)
+
+
+def refresh_partitions(engine: Engine | Connection, schema: Optional[str] = None) -> List[str]:
+    """Forgets the cached partition keys of all schemas of a database and looks up the ones of a schema again
+
+    Called by archive_defect_events(), other processes creating partitions should call it as well, otherwise the
+    extractors of this process find the new partitions only after PARTITION_CACHE_SECONDS.
+    """
+    with _partition_lock:
+        _known_partitions.pop(engine.engine.pool, None)
+    return existing_partitions(engine, schema)
+
+
+def _existing_columns(connection: Connection, table: Table, schema: Optional[str]) -> List[str]:
+    # The columns of a model table which exist in the database, in the order of the model. Columns added to the models
+    # later (e.g. signal_data_compact) are missing on databases which were not migrated yet
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name, schema=schema)}
+    return [column.name for column in table.columns if column.name in existing]
+
+
+def partitions_for_window(engine: Engine | Connection, start: Optional[datetime], end: Optional[datetime],
+                          schema: Optional[str] = None) -> List[str]:
+    """Returns the keys of the existing cold partitions whose month overlaps the time window [start, end]
+
+    Args:
+        engine: engine or connection of the database
+        start: start of the window, None for no lower bound
+        end: end of the window, None for no upper bound
+        schema: schema of the tables, None for the default schema
+    """
+    first_key = partition_key(start) if start is not None else "000000"
+    last_key = partition_key(end) if end is not None else "999999"
+    return [key for key in existing_partitions(engine, schema) if first_key <= key <= last_key]
+
+
+def archive_defect_events(engine: Engine,
+                          hot_months: int = DEFAULT_HOT_MONTHS,
+                          now: Optional[datetime] = None,
+                          batch_size: int = DEFAULT_ARCHIVE_BATCH_SIZE,
+                          schema: Optional[str] = None) -> ArchiveReport:
+    """Moves the defect events older than the hot months and their root causes into the cold monthly tables
+
+    Whole months are archived, events created before the first day of the month hot_months months ago are moved. Every
+    batch of events is copied with INSERT ... SELECT and deleted from the hot tables in one transaction, so an
+    interrupted run leaves no row duplicated or lost and the next run continues with the remaining rows.
+
+    Args:
+        engine: engine of the database
+        hot_months: number of months (including the current one) which stay in the hot tables
+        now: current time, defaults to datetime.utcnow() as the rows carry UTC creation dates
+        batch_size: number of events moved per transaction
+        schema: schema of the tables, None for the default schema
+
+    Returns:
+        a report with the number of moved rows and the partitions they were moved to
+    """
+    if hot_months < 1:
+        raise ValueError(f"hot_months must be a positive number, got {hot_months=}")
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be a positive number, got {batch_size=}")
+    cutoff = add_months(now or datetime.utcnow(), 1 - hot_months)
+    if schema is not None:
+        engine = engine.execution_options(schema_translate_map={None: schema})
+
+    event_table, root_cause_table = DefectEvent.__table__, DefectRootCause.__table__
+    select_batch = select(event_table.c.event_id, event_table.c.create_date)\
+        .where(event_table.c.create_date < bindparam("cutoff"))\
+        .order_by(event_table.c.create_date, event_table.c.event_id)\
+        .limit(batch_size)
+    delete_root_causes = delete(root_cause_table)\
+        .where(root_cause_table.c.event_id.in_(bindparam("event_ids", expanding=True)))
+    delete_events = delete(event_table).where(event_table.c.event_id.in_(bindparam("event_ids", expanding=True)))
+
+    report = ArchiveReport(cutoff=cutoff, events=0, root_causes=0, partitions=[], seconds=0.0)
+    started = time.perf_counter()
+    created_partitions = set()
+    copied_columns = None
+    while True:
+        with engine.begin() as connection:
+            if copied_columns is None:
+                # Only the columns the hot tables have are copied, the cold tables get all columns of the models
+                copied_columns = _existing_columns(connection, event_table, schema), \
+                    _existing_columns(connection, root_cause_table, schema)
+                event_columns, root_cause_columns = copied_columns
+            rows = connection.execute(select_batch, {"cutoff": cutoff}).fetchall()
+            if not rows:
+                break
+            event_ids_per_key: Dict[str, List[int]] = {}
+            for event_id, create_date in rows:
+                event_ids_per_key.setdefault(partition_key(create_date), []).append(event_id)
+
+            for key, event_ids in event_ids_per_key.items():
+                cold_events, cold_root_causes = partition_tables(key)
+                if key not in created_partitions:
+                    cold_events.create(connection, checkfirst=True)
+                    cold_root_causes.create(connection, checkfirst=True)
+                    created_partitions.add(key)
+                params = {"event_ids": event_ids}
+                connection.execute(
+                    cold_events.insert().from_select(
+                        event_columns,
+                        select(*(event_table.c[name] for name in event_columns))
+                        .where(event_table.c.event_id.in_(bindparam("event_ids", expanding=True)))),
+                    params)
+                moved_root_causes = connection.execute(
+                    cold_root_causes.insert().from_select(
+                        root_cause_columns,
+                        select(*(root_cause_table.c[name] for name in root_cause_columns))
+                        .where(root_cause_table.c.event_id.in_(bindparam("event_ids", expanding=True)))),
+                    params).rowcount
+                connection.execute(delete_root_causes, params)
+                connection.execute(delete_events, params)
+                report.root_causes += max(moved_root_causes, 0)
+                if key not in report.partitions:
+                    report.partitions.append(key)
+        report.events += len(rows)
+        logger.debug("Archived {} events older than {}", report.events, cutoff)
+
+    if created_partitions:
+        refresh_partitions(engine, schema)
+    report.seconds = time.perf_counter() - started
+    logger.info("Archived {} events and {} root causes older than {} into {} partitions in {:.2f} s",
+                report.events, report.root_causes, cutoff, len(report.partitions), report.seconds)
+    return report
+
+
+def union_partitions(engine: Engine,
+                     build_select: Callable[[Table, Table], Select],
+                     start: Optional[datetime],
+                     end: Optional[datetime],
+                     schema: Optional[str] = None):
+    """Combines a query over the hot tables and all cold partitions overlapping a time window with UNION ALL
+
+    Args:
+        engine: engine of the database, used to look up the existing partitions
+        build_select: function creating the query from a defect event and a defect root cause table. The query has to
+            filter the creation time itself, pruning only leaves out partitions which can not contain matching rows
+        start: start of the time window, None for no lower bound
+        end: end of the time window, None for no upper bound
+        schema: schema of the tables, None for the default schema
+
+    Returns:
+        the combined statement, or the query of the hot tables if no partition overlaps the window
+    """
+    selects = [build_select(DefectEvent.__table__, DefectRootCause.__table__)]
+    for key in partitions_for_window(engine, start, end, schema=schema):
+        selects.append(build_select(*partition_tables(key)))
+    return selects[0] if len(selects) == 1 else union_all(*selects)
+
+
+def _statement_schema(statement: Select) -> Optional[str]:
+    # The schema of the hot tables of a statement, e.g. "main" for the models of ddl_scripts/creating_tables.py
+    return next((table.schema for table in find_tables(statement, include_joins=True)
+                 if isinstance(table, Table) and table.name in _HOT_TABLES and table.schema is not None), None)
+
+
+def _with_partition_tables(statement: Select, key: str) -> Select:
+    # A copy of the statement reading from the cold tables of a partition instead of the hot tables
+    def replace(element):
+        if isinstance(element, Table) and element.name in _HOT_TABLES:
+            return partition_tables(key, element.schema)[_HOT_TABLES.index(element.name)]
+        if isinstance(element, Column) and isinstance(element.table, Table) and element.table.name in _HOT_TABLES:
+            table = partition_tables(key, element.table.schema)[_HOT_TABLES.index(element.table.name)]
+            return table.c[element.name]
+        return None
+
+    return replacement_traverse(statement, {}, replace)
+
+
+def partitioned_select(bind: Engine | Connection,
+                       statement: Select,
+                       start: Optional[datetime],
+                       end: Optional[datetime],
+                       order_by: Sequence[str] = (),
+                       limit: Optional[int] = None,
+                       schema: Optional[str] = None,
+                       partitions: Optional[List[str]] = None):
+    """Extends a query over the hot tables to the cold partitions overlapping a time window
+
+    Without overlapping partitions the statement is returned as it is (with the limit applied), so its compiled form
+    stays cached. Otherwise one copy of the statement per partition, reading from the cold tables instead of the hot
+    tables, is combined with the statement by UNION ALL. The order and limit of the statement are applied to the
+    combined rows again, a limit is also kept per partition, so every partition only contributes its first rows.
+
+    Args:
+        bind: engine or connection of the database, used to look up the existing partitions
+        statement: query reading from defect_event and/or defect_root_cause. It has to filter the creation time
+            itself, pruning only leaves out partitions which can not contain matching rows
+        start: start of the time window of the event creation date, None for no lower bound
+        end: end of the time window of the event creation date, None for no upper bound
+        order_by: names of the selected columns the statement is ordered by, applied to the combined rows
+        limit: optional max. number of rows, applied per partition and to the combined rows
+        schema: schema of the hot tables if they are not qualified with one, e.g. with a schema_translate_map
+        partitions: keys of the partitions to read, looked up with partitions_for_window() if None
+
+    Returns:
+        the statement, or the combined statement over the hot tables and the partitions
+    """
+    if partitions is None:
+        start = pd.Timestamp(start).to_pydatetime() if start is not None else None
+        end = pd.Timestamp(end).to_pydatetime() if end is not None else None
+        partitions = partitions_for_window(bind, start, end, schema=_statement_schema(statement) or schema)
+    if not partitions:
+        return statement.limit(limit) if limit is not None else statement
+
+    members = [statement] + [_with_partition_tables(statement, key) for key in partitions]
+    if limit is not None:
+        # ORDER BY and LIMIT of a member of a UNION are only allowed in a subquery
+        members = [select(member.limit(limit).subquery()) for member in members]
+    else:
+        members = [member.order_by(None) for member in members]
+    combined = union_all(*members)
+    if order_by or limit is not None:
+        # SQL Server has no TOP for a UNION and SQLite only orders a UNION by aliased columns, so the combined rows are
+        # ordered and limited by an enclosing select
+        combined = select(combined.subquery())
+    if order_by:
+        combined = combined.order_by(*(combined.selected_columns[name] for name in order_by))
+    return combined.limit(limit) if limit is not None else combined
+
+
+def _behaviour_id_join_select(events: Table, root_causes: Table) -> Select:
+    return select(events.c.create_date,
+                  events.c.event_type,
+                  events.c.event_id,
+                  events.c.caster_id,
+                  events.c.strand_id,
+                  events.c.grade_id,
+                  events.c.behaviour_pattern_id,
+                  events.c.detection_probability,
+                  root_causes.c.signal_id,
+                  root_causes.c.importance,
+                  root_causes.c.signal_data
+                  ).join(events, root_causes.c.event_id == events.c.event_id)\
+        .filter(events.c.behaviour_pattern_id.in_(bindparam("defects", expanding=True)))\
+        .filter(events.c.strand_id.in_(bindparam("strand_ids", expanding=True)))\
+        .filter(events.c.create_date.between(bindparam("start"), bindparam("end")))
+
+
+def join_defect_event_root_cause_filter_behaviour_id_partitioned(session: Session,
+                                                                 defects: List[BehaviourPattern],
+                                                                 strand_ids: List[String],
+                                                                 start: DateTime(),
+                                                                 end: DateTime(),
+                                                                 schema: Optional[str] = None) -> pd.DataFrame:
+    """Partition pruning counterpart of join_defect_event_root_cause_filter_behaviour_id() in
+    phillip/crud/defect_event_root_cause.py, reads the hot tables and the cold partitions of the months of the window
+
+    Args:
+        session: session to execute the query with
+        defects: behaviour patterns to filter
+        strand_ids: strand ids to filter
+        start: start of the event creation time window
+        end: end of the event creation time window
+        schema: schema of the tables, None for the default schema
+    """
+    start, end = pd.Timestamp(start).to_pydatetime(), pd.Timestamp(end).to_pydatetime()
+    statement = union_partitions(session.get_bind(), _behaviour_id_join_select, start, end, schema=schema)
+    execution_options = {"schema_translate_map": {None: schema}} if schema is not None else {}
+    result = session.execute(statement,
+                             {"defects": list(defects), "strand_ids": list(strand_ids), "start": start, "end": end},
+                             execution_options=execution_options)
+    return apply_model_dtypes(pd.DataFrame(data=result.fetchall(), columns=list(result.keys())))
@@ -0,0 +1,231 @@
+"""
+Provides an in-memory cache of query results as DataFrames with per-query TTL and LRU eviction.
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, FrozenSet, Iterable, Optional, Union
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Dialect
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ClauseElement
+from sqlalchemy.sql.util import find_tables
+
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+DEFAULT_TTL_SECONDS = 300.0
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 ** 2
+
+Statement = Union[ClauseElement, str]
+
+@dataclass
+class _CacheEntry:
+    frame: pd.DataFrame
+    size_bytes: int
+    expires_at: Optional[float]
+    query_seconds: float
+    tables: FrozenSet[str] = field(default_factory=frozenset)
+
+
+def _copy_on_write_enabled() -> bool:
+    # the option exists since pandas 1.5
+    try:
+        return bool(pd.get_option("mode.copy_on_write"))
+    except KeyError:
+        return False
+
+
+def _frame_copy(frame: pd.DataFrame) -> pd.DataFrame:
+    # With copy-on-write a shallow copy already protects the cached frame, otherwise the columns are copied. The Python
+    # objects of object columns are shared, copying every signal_data payload on each get() would cost about as much
+    # as decoding it again
+    return frame.copy(deep=not _copy_on_write_enabled())
+
+
+class QueryResultCache:
+    """Caches query results as DataFrames, keyed by the compiled SQL statement and its bound parameters
+
+    Entries expire after a per-query TTL and the least recently used entries are evicted once the deep memory usage of
+    all cached frames exceeds max_bytes. Callers always receive a copy of the frame, so adding, replacing or assigning
+    columns and values of a returned frame does not change the cache. The Python objects in its cells are shared with
+    the cache though: mutable cell values like signal_data dicts must not be modified in place, copy them first.
+    Entries can be invalidated explicitly by key or by the tables a statement reads from, e.g. after a sync or a bulk
+    insert.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_CACHE_BYTES, default_ttl: Optional[float] = DEFAULT_TTL_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            max_bytes: memory limit of all cached frames
+            default_ttl: seconds until an entry expires if no TTL is given per query, None for no expiry
+            clock: monotonic time source in seconds
+        """
+        if max_bytes < 1:
+            raise ValueError(f"max_bytes must be a positive number, got {max_bytes=}")
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def make_key(statement: Statement, dialect: Dialect, params: Optional[dict] = None) -> str:
+        """Creates the cache key of a statement from its SQL compiled for a dialect and its bound parameter values
+
+        Args:
+            statement: a SQLAlchemy statement or a plain SQL string
+            dialect: dialect of the database the statement is executed on, e.g. session.bind.dialect
+            params: additional parameters passed to execute()
+        """
+        if isinstance(statement, str):
+            statement = text(statement)
+        compiled = statement.compile(dialect=dialect)
+        bound_params = {**compiled.params, **(params or {})}
+        key_source = "\n".join([dialect.name, compiled.string, repr(sorted(bound_params.items()))])
+        return hashlib.sha1(key_source.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def statement_tables(statement: Statement) -> FrozenSet[str]:
+        """Returns the names of the tables a statement reads from, empty for plain SQL strings and text()"""
+        if isinstance(statement, str):
+            return frozenset()
+        return frozenset(table.name for table in find_tables(statement, check_columns=True, include_joins=True))
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Returns a copy of the cached frame of a key or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at <= self._clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry.query_seconds
+        logger.debug("Query cache hit {}, saved {:.3f} s", key[:12], entry.query_seconds)
+        return _frame_copy(entry.frame)
+
+    def put(self, key: str, frame: pd.DataFrame, ttl: Optional[float] = None, query_seconds: float = 0.0,
+            tables: Iterable[str] = ()):
+        """Stores a copy of a frame
+
+        Args:
+            key: cache key, see make_key()
+            frame: the query result
+            ttl: seconds until the entry expires, defaults to default_ttl
+            query_seconds: time the query took, added to the saved time on every hit
+            tables: names of the tables the query reads from, see invalidate_tables()
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        size_bytes = int(frame.memory_usage(deep=True).sum())
+        if size_bytes > self.max_bytes:
+            logger.debug("Query result of {} bytes exceeds the cache size of {} bytes, not cached",
+                         size_bytes, self.max_bytes)
+            return
+        entry = _CacheEntry(frame=_frame_copy(frame), size_bytes=size_bytes,
+                            expires_at=self._clock() + ttl if ttl is not None else None,
+                            query_seconds=query_seconds, tables=frozenset(tables))
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += size_bytes
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key: str, compute: Callable[[], pd.DataFrame], ttl: Optional[float] = None,
+                       tables: Iterable[str] = ()) -> pd.DataFrame:
+        """Returns the cached frame of a key or computes, caches and returns it"""
+        frame = self.get(key)
+        if frame is not None:
+            return frame
+        started = time.perf_counter()
+        frame = compute()
+        self.put(key, frame, ttl=ttl, query_seconds=time.perf_counter() - started, tables=tables)
+        return frame
+
+    def read_frame(self, session: Session, statement: Statement, params: Optional[dict] = None,
+                   ttl: Optional[float] = None, tables: Iterable[str] = ()) -> pd.DataFrame:
+        """Executes a statement and returns its result as a DataFrame, served from the cache while it is valid
+
+        Args:
+            session: session to execute the statement with on a cache miss
+            statement: a SQLAlchemy statement or a plain SQL string
+            params: additional parameters passed to execute()
+            ttl: seconds until the cached result expires, defaults to default_ttl
+            tables: names of tables the statement reads from in addition to the ones found by statement_tables(). Plain
+                SQL strings and text() statements have to list their tables, otherwise invalidate_tables() does not
+                remove their results
+        """
+
+        def execute() -> pd.DataFrame:
+            result = session.execute(statement, params)
+            return pd.DataFrame(data=result.fetchall(), columns=list(result.keys()))
+
+        key = self.make_key(statement, session.get_bind().dialect, params)
+        return self.get_or_compute(key, execute, ttl=ttl, tables=self.statement_tables(statement) | set(tables))
+
+    def invalidate(self, key: str) -> bool:
+        """Removes the entry of a key, returns True if it was cached"""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def invalidate_tables(self, *table_names: str) -> int:
+        """Removes all entries of queries reading from any of the given tables, returns the number of removed entries"""
+        table_names = set(table_names)
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry.tables & table_names]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        """Removes all entries, the statistics are kept"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Returns hit and miss counters, the saved query time in seconds and the current size of the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def log_stats(self):
+        """Reports the statistics of stats() at info level"""
+        stats = self.stats()
+        logger.info("Query cache: {hits} hits, {misses} misses, hit rate {hit_rate:.1%}, saved {saved_seconds:.2f} s, "
+                    "{entries} entries with {bytes} bytes, {evictions} evictions", **stats)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size_bytes
@@ -0,0 +1,147 @@
+"""
+Provides the migration of DefectRootCause.signal_data to the compact binary column signal_data_compact.
+"""
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import Text, and_, bindparam, inspect, or_, select, type_coerce, update
+from sqlalchemy.engine import Engine
+
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.db_models.signal_codec import DEFAULT_COMPRESSION_LEVEL, encode_signal_data
+
+DEFAULT_BACKFILL_BATCH_SIZE = 500
+
+
+@dataclass
+class BackfillReport:
+    """Summary of a backfill run"""
+
+    rows: int
+    json_bytes: int
+    compact_bytes: int
+    seconds: float
+    skipped: int = 0  # rows whose signal_data could not be encoded, they keep signal_data_compact NULL
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.json_bytes / self.compact_bytes if self.compact_bytes else 0.0
+
+
+def add_signal_data_compact_column(engine: Engine, schema: Optional[str] = "main") -> bool:
+    """Adds the signal_data_compact column to an existing defect_root_cause table
+
+    Args:
+        engine: engine of the database
+        schema: schema of the table, None for the default schema
+
+    Returns:
+        True if the column was added, False if it already existed
+    """
+    table = DefectRootCause.__table__
+    column = table.c.signal_data_compact
+    existing_columns = {existing["name"] for existing in inspect(engine).get_columns(table.name, schema=schema)}
+    if column.name in existing_columns:
+        return False
+
+    preparer = engine.dialect.identifier_preparer
+    table_name = preparer.quote(table.name)
+    if schema is not None:
+        table_name = f"{preparer.quote_schema(schema)}.{table_name}"
+    column_type = column.type.compile(dialect=engine.dialect)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f"ALTER TABLE {table_name} ADD {preparer.quote(column.name)} {column_type} NULL")
+    logger.info("Added column {} to {}", column.name, table_name)
+    return True
+
+
+def backfill_signal_data_compact(engine: Engine,
+                                 batch_size: int = DEFAULT_BACKFILL_BATCH_SIZE,
+                                 value_dtype: str = "float64",
+                                 compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                                 schema: Optional[str] = "main") -> BackfillReport:
+    """Encodes the signal_data of all root causes without signal_data_compact and stores the blobs
+
+    The rows are walked in primary key order, every batch is encoded and written in its own transaction, so the backfill
+    can be interrupted and started again. The signal_data column is kept, readers can switch to the compact column once
+    the backfill is complete, see set_compact_signal_data(). Rows whose signal_data can not be encoded (malformed JSON,
+    non-numeric values) are logged and skipped instead of being stored with NaN values.
+
+    Args:
+        engine: engine of the database, the column has to exist, see add_signal_data_compact_column()
+        batch_size: number of rows read and updated per transaction
+        value_dtype: "float64" keeps the values exactly, "float32" halves their size at reduced precision
+        compression_level: zlib compression level from 0 (none) to 9 (smallest)
+        schema: schema of the table, None for the default schema
+
+    Returns:
+        a report with the number of converted and skipped rows and the sizes before and after
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be a positive number, got {batch_size=}")
+
+    table = DefectRootCause.__table__
+    pending = table.c.signal_data_compact.is_(None) & table.c.signal_data.isnot(None)
+    # Read as text and decoded per row, so one malformed payload does not fail the whole batch
+    select_batch = select(table.c.event_id, table.c.signal_id, type_coerce(table.c.signal_data, Text))\
+        .where(pending)\
+        .where(or_(table.c.event_id > bindparam("last_event_id"),
+                   and_(table.c.event_id == bindparam("last_event_id"),
+                        table.c.signal_id > bindparam("last_signal_id"))))\
+        .order_by(table.c.event_id, table.c.signal_id)\
+        .limit(batch_size)
+    update_batch = update(table)\
+        .where(table.c.event_id == bindparam("b_event_id"))\
+        .where(table.c.signal_id == bindparam("b_signal_id"))\
+        .values(signal_data_compact=bindparam("b_signal_data_compact"))
+    if schema is not None:
+        engine = engine.execution_options(schema_translate_map={None: schema})
+
+    report = BackfillReport(rows=0, json_bytes=0, compact_bytes=0, seconds=0.0)
+    started = time.perf_counter()
+    last_event_id, last_signal_id = -1, ""
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select_batch, {"last_event_id": last_event_id,
+                                                     "last_signal_id": last_signal_id}).fetchall()
+            if not rows:
+                break
+            parameters = []
+            for event_id, signal_id, signal_data in rows:
+                try:
+                    if isinstance(signal_data, (str, bytes)):
+                        signal_data = json.loads(signal_data)
+                    blob = encode_signal_data(signal_data, value_dtype=value_dtype,
+                                              compression_level=compression_level)
+                except (ValueError, TypeError, KeyError) as error:
+                    logger.warning("Skipped signal_data of event {} signal {}: {!r}", event_id, signal_id, error)
+                    report.skipped += 1
+                    continue
+                parameters.append({"b_event_id": event_id, "b_signal_id": signal_id, "b_signal_data_compact": blob})
+                report.json_bytes += len(json.dumps(signal_data))
+                report.compact_bytes += len(blob)
+            if parameters:
+                connection.execute(update_batch, parameters)
+        report.rows += len(parameters)
+        last_event_id, last_signal_id = rows[-1].event_id, rows[-1].signal_id
+        logger.debug("Backfilled {} rows up to event {}", report.rows, last_event_id)
+
+    report.seconds = time.perf_counter() - started
+    logger.info("Backfilled signal_data_compact of {} rows in {:.2f} s, {} JSON bytes -> {} bytes ({:.1f}x), "
+                "{} rows skipped", report.rows, report.seconds, report.json_bytes, report.compact_bytes,
+                report.compression_ratio, report.skipped)
+    return report
+
+
+# For direct script execution as a one-off migration:
+if __name__ == "__main__":
+    from db_engines.sql_server_engine import get_sqlservertest_engine
+
+    sqlserver_engine = get_sqlservertest_engine()
+    add_signal_data_compact_column(sqlserver_engine)
+    backfill_signal_data_compact(sqlserver_engine)
@@ -0,0 +1,76 @@
+"""
+Provides helpers for consuming large query results as a stream of DataFrame chunks.
+"""
+from __future__ import annotations
+
+from typing import Iterator, List, Optional
+
+from sqlalchemy.engine import Result
+
+from phillip.lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+DEFAULT_CHUNK_ROWS = 10_000
+# Rows of the first chunk of a stream with a memory budget, used to measure the bytes per row before sizing the chunks
+PROBE_CHUNK_ROWS = 256
+
+
+def stream_execution_options(chunk_rows: int = DEFAULT_CHUNK_ROWS) -> dict:
+    """Returns execution options which make the DBAPI fetch rows in batches instead of buffering the whole result.
+
+    "stream_results" asks the dialect for a server-side cursor where one is available, "yield_per" makes the ORM hand
+    out rows in partitions of the given size. See
+    https://docs.sqlalchemy.org/en/14/core/connections.html#using-server-side-cursors-a-k-a-stream-results
+
+    Args:
+        chunk_rows: number of rows fetched from the cursor per round trip
+    """
+    if chunk_rows < 1:
+        raise ValueError(f"chunk_rows must be a positive number, got {chunk_rows=}")
+    return {"stream_results": True, "yield_per": chunk_rows}
+
+
+def iter_result_frames(
+    result: Result,
+    column_names: List[str],
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    max_chunk_bytes: Optional[int] = None,
+) -> Iterator[pd.DataFrame]:
+    """Converts a streamed query result into DataFrame chunks.
+
+    A chunk never holds more than chunk_rows rows. When max_chunk_bytes is given, the number of rows of the next chunk
+    is additionally derived from the deep memory usage per row of the previous chunk, so chunks with large payloads
+    (e.g. signal_data JSON) stay under the memory budget. The first chunk then holds at most PROBE_CHUNK_ROWS rows, as
+    nothing is known about the size of the rows before it is fetched.
+
+    Args:
+        result: a result of Session.execute() / Connection.execute() created with stream_execution_options()
+        column_names: names of the columns of the DataFrame chunks
+        chunk_rows: maximum number of rows per chunk
+        max_chunk_bytes: optional memory budget of a single chunk in bytes
+
+    Returns:
+        an iterator of DataFrames, the result is closed when the iterator is exhausted or closed
+    """
+    if chunk_rows < 1:
+        raise ValueError(f"chunk_rows must be a positive number, got {chunk_rows=}")
+    if max_chunk_bytes is not None and max_chunk_bytes < 1:
+        raise ValueError(f"max_chunk_bytes must be a positive number, got {max_chunk_bytes=}")
+
+    rows_to_fetch = chunk_rows if max_chunk_bytes is None else min(chunk_rows, PROBE_CHUNK_ROWS)
+    try:
+        while True:
+            rows = result.fetchmany(rows_to_fetch)
+            if not rows:
+                return
+            chunk = pd.DataFrame(data=rows, columns=column_names)
+            del rows
+
+            if max_chunk_bytes is not None:
+                bytes_per_row = max(1, int(chunk.memory_usage(deep=True).sum() // len(chunk)))
+                rows_to_fetch = max(1, min(chunk_rows, max_chunk_bytes // bytes_per_row))
+
+            yield chunk
+    finally:
+        result.close()
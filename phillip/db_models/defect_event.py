@@ -7,6 +7,7 @@ from sqlalchemy import (
     DateTime,
     Enum,
     Float,
+    Index,
     Integer,
     String,
 )
@@ -47,7 +48,29 @@ class DefectEvent(Base, CreateUpdateTimeMixin):
     """
 
     __tablename__ = "defect_event"
-    __table_args__ = {"comment": "Contains defect event data"}
+    __table_args__ = (
+        # Behaviour id join: behaviour patterns and strands by equality, then the creation time range. On SQL Server the
+        # selected columns are included, so the query is answered from the index without key lookups
+        Index(
+            "ix_defect_event_behaviour_strand_create_date",
+            "behaviour_pattern_id",
+            "strand_id",
+            "create_date",
+            "event_id",
+            mssql_include=["event_type", "caster_id", "slab_id", "grade_id", "detection_probability"],
+        ),
+        # Root cause pairs: casters by equality, then the creation time range
+        Index(
+            "ix_defect_event_caster_create_date",
+            "caster_id",
+            "create_date",
+            "event_id",
+            mssql_include=["behaviour_pattern_id", "strand_id", "slab_id"],
+        ),
+        # Keyset pagination in (create_date, event_id) order, see phillip/crud/pagination.py
+        Index("ix_defect_event_create_date_event_id", "create_date", "event_id"),
+        {"comment": "Contains defect event data"},
+    )
 
     # message identifiers
     event_id = Column(BigInteger, primary_key=True, comment="unique event id")
@@ -2,9 +2,11 @@
 Defines defect root causes table.
 """
 
-from sqlalchemy import JSON, BigInteger, Column, DateTime, Float, ForeignKey, String
+from sqlalchemy import JSON, BigInteger, Column, DateTime, Float, ForeignKey, Index, String
+from sqlalchemy.orm import deferred
 
 from .base import Base, CreateUpdateTimeMixin
+from .signal_codec import CompactSignalData
 
 
 class DefectRootCause(Base, CreateUpdateTimeMixin):
@@ -13,7 +15,11 @@ class DefectRootCause(Base, CreateUpdateTimeMixin):
     """
 
     __tablename__ = "defect_root_cause"
-    __table_args__ = {"comment": "Defines root cause signals to defect events mapping"}
+    __table_args__ = (
+        # Root cause pairs: root causes by creation time range, grouped by event
+        Index("ix_defect_root_cause_create_date_event_id", "create_date", "event_id", "signal_id"),
+        {"comment": "Defines root cause signals to defect events mapping"},
+    )
 
     event_id = Column(
         BigInteger(),
@@ -41,4 +47,12 @@ class DefectRootCause(Base, CreateUpdateTimeMixin):
 
     data_end_time = Column(DateTime, nullable=True, comment="End time of data batch")
 
-    signal_data = Column(JSON, nullable=True, comment="Data for belonging signal id")
\ No newline at end of file
+    signal_data = Column(JSON, nullable=True, comment="Data for belonging signal id")
+
+    # Deferred, so loading DefectRootCause entities also works on databases which do not have the column yet (see
+    # phillip/crud/signal_data_backfill.py). It is only selected when it is named explicitly or undeferred.
+    signal_data_compact = deferred(Column(
+        CompactSignalData(),
+        nullable=True,
+        comment="signal_data as compressed binary arrays of epoch timestamps and values",
+    ))
\ No newline at end of file
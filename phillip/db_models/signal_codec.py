@@ -0,0 +1,176 @@
+"""
+Defines a compact binary encoding of root cause signal data and its SQLAlchemy column type.
+
+A blob consists of a fixed header, the utf-8 encoded signal id and a zlib-compressed body with the int64 epoch timestamps
+in nanoseconds (delta encoded, so regularly sampled signals compress well) followed by the float32 or float64 values:
+
+    b"SDC" | version (uint8) | flags (uint8) | points (uint32) | signal id length (uint16) | signal id | zlib(body)
+
+The blobs are stored in DefectRootCause.signal_data_compact next to the JSON column signal_data, which databases keep
+until the column was added and backfilled (see phillip/crud/signal_data_backfill.py). set_compact_signal_data() is the
+one switch of the readers and writers to the compact column, their compact_signal_data arguments default to it:
+
+    set_compact_signal_data(True)  # after the backfill
+    join_defect_event_root_cause_filter_behaviour_id(session, ...)  # signal_data holds CompactSignal tuples
+"""
+from __future__ import annotations
+
+import struct
+import zlib
+from typing import NamedTuple, Optional, Union
+
+from sqlalchemy import LargeBinary
+from sqlalchemy.dialects.mssql import VARBINARY
+from sqlalchemy.types import TypeDecorator
+
+from phillip.lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+MAGIC = b"SDC"
+VERSION = 1
+_HEADER = struct.Struct("<3sBBIH")
+
+FLAG_FLOAT32 = 0x01  # values are stored as float32 instead of float64
+FLAG_UTC = 0x02  # timestamps were timezone aware and are stored in UTC
+
+VALUE_DTYPES = ("float32", "float64")
+DEFAULT_COMPRESSION_LEVEL = 6
+
+_compact_signal_data = False
+
+
+class CompactSignal(NamedTuple):
+    """Decoded signal data of a root cause as NumPy arrays"""
+
+    signal_id: str
+    times: np.ndarray  # int64 nanoseconds since the epoch
+    values: np.ndarray  # float32 or float64
+    utc: bool = False
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def datetimes(self) -> np.ndarray:
+        """Returns the timestamps as datetime64[ns] array, in UTC if the signal had timezone aware timestamps"""
+        return self.times.view("datetime64[ns]")
+
+    def to_payload(self) -> dict:
+        """Returns the signal in the JSON layout of DefectRootCause.signal_data"""
+        times = pd.DatetimeIndex(self.datetimes(), tz="UTC" if self.utc else None)
+        values = [None if value != value else value for value in self.values.tolist()]  # NaN -> null
+        return {"signal_id": self.signal_id,
+                "data": [[time.isoformat(), value] for time, value in zip(times, values)]}
+
+
+def set_compact_signal_data(enabled: bool):
+    """Switches the readers and writers of root cause signal data between the JSON and the compact column
+
+    Applies to the calls which do not pass compact_signal_data themselves, e.g. the behaviour id joins of data_analysis
+    and LiveIngestionService. Only switch it on for databases whose signal_data_compact column exists and is filled.
+    """
+    global _compact_signal_data
+    _compact_signal_data = bool(enabled)
+
+
+def compact_signal_data_enabled(compact_signal_data: Optional[bool] = None) -> bool:
+    """Returns compact_signal_data, or the setting of set_compact_signal_data() if it is None"""
+    return _compact_signal_data if compact_signal_data is None else compact_signal_data
+
+
+def is_compact_blob(blob) -> bool:
+    """Returns True if the bytes start with the header of encode_signal_data()"""
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:len(MAGIC)]) == MAGIC
+
+
+def encode_signal_data(signal_data: Union[dict, CompactSignal], value_dtype: str = "float64",
+                       compression_level: int = DEFAULT_COMPRESSION_LEVEL) -> bytes:
+    """Encodes the signal data of a root cause into a compact blob
+
+    Args:
+        signal_data: a payload in the JSON layout {"signal_id": ..., "data": [[time, value], ...]} with ISO timestamp
+            strings, or a CompactSignal
+        value_dtype: "float64" keeps the values exactly, "float32" halves their size at reduced precision
+        compression_level: zlib compression level from 0 (none) to 9 (smallest)
+
+    Returns:
+        the encoded blob
+
+    Raises:
+        ValueError: if a value is not numeric or a timestamp can not be parsed, like the JSON path of
+            data_analysis.dataframes.decode_signal_data_batch() rejects them. Null values are stored as NaN
+    """
+    if value_dtype not in VALUE_DTYPES:
+        raise ValueError(f"value_dtype must be one of {VALUE_DTYPES}, got {value_dtype=}")
+
+    if isinstance(signal_data, CompactSignal):
+        signal_id, times, values, utc = signal_data
+        times = np.asarray(times, dtype=np.int64)
+    else:
+        signal_id = signal_data["signal_id"]
+        points = np.array(signal_data["data"], dtype=object).reshape(-1, 2)
+        datetimes = pd.to_datetime(points[:, 0])
+        utc = datetimes.tz is not None
+        if utc:
+            datetimes = datetimes.tz_convert("UTC").tz_localize(None)
+        times = datetimes.to_numpy(dtype="datetime64[ns]").view(np.int64)
+        values = pd.to_numeric(points[:, 1], errors="raise")
+
+    flags = (FLAG_FLOAT32 if value_dtype == "float32" else 0) | (FLAG_UTC if utc else 0)
+    signal_id_bytes = str(signal_id).encode("utf-8")
+    body = np.diff(times, prepend=np.int64(0)).astype("<i8").tobytes() \
+        + np.asarray(values, dtype="<f4" if value_dtype == "float32" else "<f8").tobytes()
+    header = _HEADER.pack(MAGIC, VERSION, flags, len(times), len(signal_id_bytes))
+    return header + signal_id_bytes + zlib.compress(body, compression_level)
+
+
+def decode_signal_data(blob: bytes) -> CompactSignal:
+    """Decodes a blob of encode_signal_data() straight into NumPy arrays without creating Python objects per point"""
+    blob = memoryview(blob)
+    magic, version, flags, points, signal_id_length = _HEADER.unpack_from(blob)
+    if magic != MAGIC:
+        raise ValueError("Not an encoded signal data blob")
+    if version != VERSION:
+        raise ValueError(f"Unsupported signal data encoding version {version}")
+
+    signal_id_end = _HEADER.size + signal_id_length
+    signal_id = bytes(blob[_HEADER.size:signal_id_end]).decode("utf-8")
+    body = zlib.decompress(blob[signal_id_end:])
+    value_dtype = np.dtype("<f4") if flags & FLAG_FLOAT32 else np.dtype("<f8")
+    times = np.cumsum(np.frombuffer(body, dtype="<i8", count=points)).astype(np.int64, copy=False)
+    values = np.frombuffer(body, dtype=value_dtype, count=points, offset=8 * points)
+    return CompactSignal(signal_id=signal_id, times=times, values=values, utc=bool(flags & FLAG_UTC))
+
+
+class CompactSignalData(TypeDecorator):
+    """Stores signal data as blob of encode_signal_data() and loads it as CompactSignal
+
+    Bound values may be JSON layout payloads, CompactSignal instances or already encoded blobs.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, value_dtype: str = "float64", compression_level: int = DEFAULT_COMPRESSION_LEVEL):
+        if value_dtype not in VALUE_DTYPES:
+            raise ValueError(f"value_dtype must be one of {VALUE_DTYPES}, got {value_dtype=}")
+        super().__init__()
+        self.value_dtype = value_dtype
+        self.compression_level = compression_level
+
+    def load_dialect_impl(self, dialect):
+        # LargeBinary renders as the deprecated IMAGE type on SQL Server
+        if dialect.name == "mssql":
+            return dialect.type_descriptor(VARBINARY("max"))
+        return dialect.type_descriptor(LargeBinary())
+
+    def process_bind_param(self, value, dialect) -> Optional[bytes]:
+        if value is None or is_compact_blob(value):
+            return value
+        return encode_signal_data(value, value_dtype=self.value_dtype, compression_level=self.compression_level)
+
+    def process_result_value(self, value, dialect) -> Optional[CompactSignal]:
+        if value is None:
+            return None
+        return decode_signal_data(value)
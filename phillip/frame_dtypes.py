@@ -0,0 +1,187 @@
+"""
+Provides compact pandas dtypes for DataFrames of query results, derived from the columns of the phillip.db_models tables.
+
+Without explicit dtypes pandas keeps every string column as object dtype (one Python str per cell) and every float
+column as float64. model_dtypes() maps the columns of the models by their SQLAlchemy type and metadata:
+
+- enumerated strings (event_type, model_type, behaviour_pattern_id) -> category with the values of their enumeration as
+  fixed categories
+- identifier strings with few distinct values (caster_id, strand_id, signal_id, ...) -> category
+- Integer / BigInteger -> nullable Int32 / Int64, so a NULL does not turn the column into float64 (BigInteger columns
+  without NULLs stay int64)
+- probability and importance floats -> float32, other floats stay float64
+- Boolean -> nullable boolean
+
+apply_model_dtypes() converts the columns of a frame accordingly. The dtypes only depend on the column definitions,
+not on the values of a frame. The categories of the identifier columns are the values of the frame, concat_frames()
+unions them, so chunks or shards concatenate without falling back to object dtype.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from loguru import logger
+from sqlalchemy import BigInteger, Boolean, Float, Integer, String
+
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.lazy_imports import lazy_import
+from phillip.schemas import ENUM_COLUMNS, enum_values
+
+pd = lazy_import("pandas")
+
+DEFAULT_MODELS = (DefectEvent, DefectRootCause)
+# String columns holding ids of a small, fixed set of plant entities, in addition to the enumerated columns
+LOW_CARDINALITY_COLUMNS = {"caster_id", "strand_id", "grade_id", "signal_id", "model_name"}
+# Float columns with values in [0, 1] which do not need the precision of float64
+FLOAT32_COLUMNS = {"importance", "detection_probability"}
+
+
+@dataclass
+class DtypeReport:
+    """Memory usage of the columns converted by apply_model_dtypes()"""
+
+    dtypes: Dict[str, Tuple[str, str]]  # column name -> (original dtype, compact dtype)
+    bytes_before: int
+    bytes_after: int
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_before - self.bytes_after
+
+    @property
+    def saved_ratio(self) -> float:
+        return self.bytes_saved / self.bytes_before if self.bytes_before else 0.0
+
+
+def column_dtype(column) -> Optional[Union[str, pd.CategoricalDtype]]:
+    """Returns the compact pandas dtype of a table column, None if the inferred dtype is kept"""
+    if isinstance(column.type, String):
+        if column.name in ENUM_COLUMNS:
+            return pd.CategoricalDtype(enum_values(ENUM_COLUMNS[column.name]))
+        return "category" if column.name in LOW_CARDINALITY_COLUMNS else None
+    if isinstance(column.type, Boolean):
+        return "boolean"
+    if isinstance(column.type, BigInteger):
+        return "Int64"
+    if isinstance(column.type, Integer):
+        return "Int32"
+    if isinstance(column.type, Float):
+        return "float32" if column.name in FLOAT32_COLUMNS else "float64"
+    return None
+
+
+@lru_cache(maxsize=None)
+def model_dtypes(models: Tuple = DEFAULT_MODELS) -> Dict[str, Union[str, pd.CategoricalDtype]]:
+    """Returns the compact dtypes of the columns of ORM models by column name
+
+    Args:
+        models: ORM classes, the first model wins if several models have a column of the same name
+    """
+    dtypes = {}
+    for model in models:
+        for column in model.__table__.columns:
+            dtype = column_dtype(column)
+            if dtype is not None:
+                dtypes.setdefault(column.name, dtype)
+    return dtypes
+
+
+def _has_dtype(values: pd.Series, dtype: Union[str, pd.CategoricalDtype]) -> bool:
+    if isinstance(dtype, str):
+        return str(values.dtype) == dtype
+    return values.dtype == dtype
+
+
+def dtype_report(original: pd.DataFrame, compacted: pd.DataFrame, columns: Iterable[str]) -> DtypeReport:
+    """Compares the deep memory usage of columns before and after apply_model_dtypes()"""
+    columns = list(columns)
+    return DtypeReport(dtypes={name: (str(original[name].dtype), str(compacted[name].dtype)) for name in columns},
+                       bytes_before=int(original[columns].memory_usage(index=False, deep=True).sum()),
+                       bytes_after=int(compacted[columns].memory_usage(index=False, deep=True).sum()))
+
+
+def _format_report(report: DtypeReport) -> str:
+    return (f"{len(report.dtypes)} columns from {report.bytes_before / 2**20:.2f} MiB to "
+            f"{report.bytes_after / 2**20:.2f} MiB (saved {report.saved_ratio:.0%}): "
+            + ", ".join(f"{name} {before} -> {after}" for name, (before, after) in report.dtypes.items()))
+
+
+def apply_model_dtypes(data: pd.DataFrame,
+                       models: Tuple = DEFAULT_MODELS,
+                       exclude: Iterable[str] = ()) -> pd.DataFrame:
+    """Converts the columns of a query result frame to the compact dtypes of model_dtypes()
+
+    Columns which are not part of the models, appear more than once or can not be converted keep their dtype. The
+    memory saved is logged on debug level.
+
+    Args:
+        data: frame with columns named like the columns of the models
+        models: ORM classes whose columns define the dtypes
+        exclude: names of columns to keep as they are
+
+    Returns:
+        a frame with converted columns, the passed frame is not modified
+    """
+    dtypes = model_dtypes(tuple(models))
+    exclude = set(exclude)
+    duplicated = set(data.columns[data.columns.duplicated()])
+    compacted = data.copy(deep=False)
+    converted = []
+    for name in data.columns:
+        dtype = dtypes.get(name)
+        if dtype is None or name in exclude or name in duplicated or _has_dtype(data[name], dtype):
+            continue
+        values = data[name]
+        if isinstance(dtype, str) and dtype == "Int64" and values.dtype == "int64":
+            # Without NULLs the numpy dtype is as compact and faster, the nullable dtype would only add a mask
+            continue
+        try:
+            converted_values = values.astype(dtype)
+        except (TypeError, ValueError) as error:
+            logger.debug("Column {} keeps dtype {}, it can not be converted to {}: {}", name, values.dtype, dtype,
+                         error)
+            continue
+        if isinstance(dtype, pd.CategoricalDtype) and dtype.categories is not None \
+                and converted_values.isna().sum() > values.isna().sum():
+            # Values outside of the enumeration would silently become NaN
+            logger.warning("Column {} keeps dtype {}, it has values outside of the categories {}", name, values.dtype,
+                           list(dtype.categories))
+            continue
+        compacted[name] = converted_values
+        converted.append(name)
+
+    if converted:
+        logger.opt(lazy=True).debug("Compacted dtypes of {}",
+                                    lambda: _format_report(dtype_report(data, compacted, converted)))
+    return compacted
+
+
+def concat_frames(frames: Iterable[pd.DataFrame], ignore_index: bool = True) -> pd.DataFrame:
+    """Concatenates frames of apply_model_dtypes(), e.g. chunks or shards of one query, keeping categorical columns
+
+    pd.concat() only keeps a categorical column if all frames have the same categories, otherwise it falls back to
+    object dtype. The categories of columns which are categorical in all frames are therefore unioned first.
+
+    Args:
+        frames: frames with the same columns
+        ignore_index: see pd.concat()
+
+    Returns:
+        the concatenated frame
+    """
+    frames = list(frames)
+    if len(frames) < 2 or any(frame.columns.duplicated().any() for frame in frames):
+        return pd.concat(frames, ignore_index=ignore_index)
+    for name in frames[0].columns:
+        if not all(name in frame.columns and isinstance(frame[name].dtype, pd.CategoricalDtype) for frame in frames):
+            continue
+        if all(frame[name].dtype == frames[0][name].dtype for frame in frames):
+            continue
+        categories = pd.Index(frames[0][name].cat.categories)
+        for frame in frames[1:]:
+            categories = categories.append(frame[name].cat.categories.difference(categories))
+        frames = [frame.assign(**{name: frame[name].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=ignore_index)
@@ -0,0 +1,32 @@
+"""
+Defers imports of heavy modules (pandas, numpy, matplotlib) until their first attribute access.
+"""
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Returns a module which is only executed when one of its attributes is accessed for the first time.
+
+    Modules using this should also use "from __future__ import annotations", otherwise annotations like pd.DataFrame
+    are evaluated at definition time and load the module right away. Only top-level packages should be imported lazily,
+    finding the spec of a submodule already imports its parent package.
+    See https://docs.python.org/3/library/importlib.html#implementing-lazy-imports
+
+    Args:
+        name: name of a top-level module, e.g. "pandas"
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,264 @@
+"""
+Provides per-statement latency metrics of SQLAlchemy engines, collected with engine events.
+
+Every statement sent to the DBAPI is timed between the before_cursor_execute and after_cursor_execute events and
+recorded under its fingerprint, i.e. its SQL text with literals and IN lists normalised, so all executions of the same
+query share one latency histogram regardless of their parameters. See
+https://docs.sqlalchemy.org/en/14/core/events.html#sqlalchemy.events.ConnectionEvents
+"""
+import math
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_SLOW_QUERY_SECONDS = 1.0
+
+# Log-scale histogram buckets from 10 us to ~1000 s, each 2**(1/8) (~9 %) wider than the previous one
+_MIN_SECONDS = 1e-5
+_BUCKET_GROWTH = 2 ** (1 / 8)
+_BUCKETS = int(math.ceil(math.log(1e8) / math.log(_BUCKET_GROWTH))) + 1
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+# qmark, format, pyformat and named placeholders of the DBAPI paramstyles
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+_PLACEHOLDER_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+_START_TIMES_KEY = "query_metrics_start_times"
+
+
+@lru_cache(maxsize=4096)
+def fingerprint_statement(statement: str) -> str:
+    """Normalises a SQL statement, so executions with different literals or IN list lengths get the same fingerprint
+
+    String and number literals become ?, lists of one or more placeholders like (?, ?, ?) or (%(id_1)s) become (?...)
+    and whitespace is collapsed.
+    """
+    fingerprint = _STRING_LITERAL.sub("?", statement)
+    fingerprint = _NUMBER_LITERAL.sub("?", fingerprint)
+    fingerprint = _WHITESPACE.sub(" ", fingerprint).strip()
+    return _PLACEHOLDER_LIST.sub("(?...)", fingerprint)
+
+
+class LatencyHistogram:
+    """Histogram of durations with log-scale buckets, quantiles are accurate to the bucket width of ~9 %"""
+
+    def __init__(self):
+        self.buckets = [0] * _BUCKETS
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def add(self, seconds: float):
+        if seconds <= _MIN_SECONDS:
+            bucket = 0
+        else:
+            bucket = min(int(math.ceil(math.log(seconds / _MIN_SECONDS) / math.log(_BUCKET_GROWTH))), _BUCKETS - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket containing the q-quantile, 0.0 if the histogram is empty"""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, int(math.ceil(q * self.count)))
+        cumulative = 0
+        for bucket, bucket_count in enumerate(self.buckets):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return min(_MIN_SECONDS * _BUCKET_GROWTH ** bucket, self.max_seconds)
+        return self.max_seconds
+
+
+class StatementStats:
+    """Latency histogram and row counts of all executions of one statement fingerprint"""
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.latency = LatencyHistogram()
+        self.rows = 0
+        self.errors = 0
+
+    def to_dict(self) -> dict:
+        latency = self.latency
+        return {
+            "fingerprint": self.fingerprint,
+            "count": latency.count,
+            "errors": self.errors,
+            "rows": self.rows,
+            "total_s": latency.total_seconds,
+            "mean_s": latency.total_seconds / latency.count if latency.count else 0.0,
+            "p50_s": latency.quantile(0.50),
+            "p95_s": latency.quantile(0.95),
+            "p99_s": latency.quantile(0.99),
+            "max_s": latency.max_seconds,
+        }
+
+
+class QueryMetrics:
+    """Thread-safe per-fingerprint statement metrics of one or more engines, see instrument_engine()
+
+    Args:
+        slow_query_seconds: statements taking longer are logged as warning, None disables the warning
+    """
+
+    def __init__(self, slow_query_seconds: Optional[float] = DEFAULT_SLOW_QUERY_SECONDS):
+        self.slow_query_seconds = slow_query_seconds
+        self._statements: Dict[str, StatementStats] = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, fingerprint: str) -> StatementStats:
+        stats = self._statements.get(fingerprint)
+        if stats is None:
+            stats = self._statements.setdefault(fingerprint, StatementStats(fingerprint))
+        return stats
+
+    def record(self, statement: str, seconds: float, rows: Optional[int] = None):
+        """Records one execution of a statement
+
+        Args:
+            statement: SQL text as sent to the DBAPI
+            seconds: wall time of the execution
+            rows: number of rows affected, None if unknown. Rows fetched later are added with add_rows()
+        """
+        fingerprint = fingerprint_statement(statement)
+        with self._lock:
+            stats = self._stats(fingerprint)
+            stats.latency.add(seconds)
+            if rows is not None and rows >= 0:
+                stats.rows += rows
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            logger.warning("Slow query took {:.3f} s (rows: {}): {}", seconds, rows, fingerprint[:500])
+
+    def add_rows(self, statement: str, rows: int):
+        """Adds rows fetched from the result of an execution of a statement"""
+        fingerprint = fingerprint_statement(statement)
+        with self._lock:
+            self._stats(fingerprint).rows += rows
+
+    def record_error(self, statement: str):
+        with self._lock:
+            self._stats(fingerprint_statement(statement)).errors += 1
+
+    def snapshot(self, top: Optional[int] = None) -> List[dict]:
+        """Returns the metrics per fingerprint, sorted by total time spent, as list of dicts with the keys fingerprint,
+        count, errors, rows, total_s, mean_s, p50_s, p95_s, p99_s and max_s
+
+        Args:
+            top: optional max. number of fingerprints to return
+        """
+        with self._lock:
+            snapshot = [stats.to_dict() for stats in self._statements.values()]
+        snapshot.sort(key=lambda stats: stats["total_s"], reverse=True)
+        return snapshot[:top] if top is not None else snapshot
+
+    def reset(self):
+        """Forgets all recorded metrics"""
+        with self._lock:
+            self._statements.clear()
+
+    def log_summary(self, top: int = 10):
+        """Logs the statements with the largest total time"""
+        for stats in self.snapshot(top=top):
+            logger.info("{count} x {total_s:.3f} s (p50 {p50_s:.4f} s, p95 {p95_s:.4f} s, p99 {p99_s:.4f} s, "
+                        "max {max_s:.4f} s, rows {rows}): {fingerprint:.200}", **stats)
+
+
+class _RowCountingCursor:
+    """Proxy of a DBAPI cursor which counts the rows fetched from it
+
+    The count is kept in the proxy and added to the metrics of its statement once, when the cursor is closed. SQLAlchemy
+    closes it as soon as the result is exhausted or closed.
+    """
+
+    def __init__(self, cursor, metrics: QueryMetrics, statement: str):
+        object.__setattr__(self, "_cursor", cursor)
+        object.__setattr__(self, "_metrics", metrics)
+        object.__setattr__(self, "_statement", statement)
+        object.__setattr__(self, "_rows", 0)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            object.__setattr__(self, "_rows", self._rows + 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        object.__setattr__(self, "_rows", self._rows + len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        object.__setattr__(self, "_rows", self._rows + len(rows))
+        return rows
+
+    def close(self):
+        if self._rows:
+            self._metrics.add_rows(self._statement, self._rows)
+            object.__setattr__(self, "_rows", 0)
+        self._cursor.close()
+
+
+# Metrics of all engines created by phillip.db_connection
+query_metrics = QueryMetrics()
+
+
+def instrument_engine(engine: Engine, metrics: QueryMetrics = query_metrics,
+                      count_fetched_rows: bool = False) -> Engine:
+    """Records the wall time and row count of every statement executed by an engine in metrics
+
+    For an AsyncEngine pass its sync_engine. Statements without a result count the DBAPI cursor.rowcount, i.e. the
+    rows affected by INSERT/UPDATE/DELETE. Most drivers report -1 for SELECT statements, their rows are only counted
+    with count_fetched_rows.
+
+    Args:
+        engine: engine to instrument
+        metrics: where to record the metrics, defaults to the module level query_metrics
+        count_fetched_rows: if True, the cursor of a statement returning rows is wrapped in a proxy which counts the
+            fetched rows. They are counted when the result is exhausted or closed, rows which are never fetched are not
+            counted. The proxy adds a little overhead to every fetch, so it is off by default
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault(_START_TIMES_KEY, []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - connection.info[_START_TIMES_KEY].pop()
+        if cursor.description is None or context is None:
+            metrics.record(statement, seconds, rows=getattr(cursor, "rowcount", None))
+        else:
+            metrics.record(statement, seconds)
+            if count_fetched_rows:
+                # The result of the execution is set up with context.cursor after this event
+                context.cursor = _RowCountingCursor(cursor, metrics, statement)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        start_times = exception_context.connection.info.get(_START_TIMES_KEY) \
+            if exception_context.connection is not None else None
+        if start_times and exception_context.statement is not None:
+            start_times.pop()
+            metrics.record_error(exception_context.statement)
+
+    return engine
@@ -0,0 +1,97 @@
+"""
+Provides pydantic models generated from the columns of the phillip.db_models tables.
+
+The models check the types, string lengths, nullability and the allowed values of the enumerated string columns of
+payloads before they reach the database, so a bad payload is rejected on its own instead of failing the transaction of
+a whole batch. Columns with Python side defaults (e.g. create_date, update_date) are optional and filled with the
+default during validation.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, Iterable, List, Literal, Optional, Type
+
+from pydantic import BaseModel, Extra, Field, constr, create_model
+from sqlalchemy import JSON, Column, String
+
+from phillip.db_models.defect_event import BehaviourPattern, DefectEvent, DefectEventType, ModelType
+from phillip.db_models.defect_root_cause import DefectRootCause
+
+# Allowed values of the string columns which hold the values of the enumerations of phillip.db_models
+ENUM_COLUMNS = {
+    "event_type": DefectEventType,
+    "model_type": ModelType,
+    "behaviour_pattern_id": BehaviourPattern,
+}
+
+
+class TableSchema(BaseModel):
+    """Base class of the generated models"""
+
+    class Config:
+        extra = Extra.forbid
+        anystr_strip_whitespace = True
+
+
+def enum_values(enumeration) -> tuple:
+    """Returns the values of one of the str enumerations of phillip.db_models"""
+    return tuple(value for name, value in vars(enumeration).items() if name.isupper() and isinstance(value, str))
+
+
+def _field_type(column: Column):
+    if column.name in ENUM_COLUMNS:
+        return Literal[enum_values(ENUM_COLUMNS[column.name])]
+    if isinstance(column.type, JSON):
+        return Any
+    if isinstance(column.type, String) and column.type.length:
+        return constr(max_length=column.type.length)
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return Any
+
+
+def _field_default(column: Column):
+    default = column.default
+    if default is None:
+        return ... if not column.nullable else None
+    if default.is_callable:
+        # Python side defaults are wrapped by SQLAlchemy into functions of the execution context
+        return Field(default_factory=lambda: default.arg(None))
+    return default.arg
+
+
+def schema_from_model(model, name: Optional[str] = None, exclude: Iterable[str] = (),
+                      base: Type[BaseModel] = TableSchema, **extra_fields) -> Type[BaseModel]:
+    """Creates a pydantic model with one field per column of an ORM model
+
+    Args:
+        model: ORM class, e.g. DefectEvent
+        name: name of the pydantic model, defaults to the ORM class name with the suffix "Schema"
+        exclude: names of columns without a field
+        base: base class of the pydantic model
+        extra_fields: additional fields as (type, default) tuples, see pydantic.create_model()
+
+    Returns:
+        the pydantic model, nullable columns are Optional and columns with defaults may be omitted
+    """
+    exclude = set(exclude)
+    fields: Dict[str, tuple] = {}
+    for column in model.__table__.columns:
+        if column.name in exclude:
+            continue
+        field_type = _field_type(column)
+        if column.nullable:
+            field_type = Optional[field_type]
+        fields[column.name] = (field_type, _field_default(column))
+    fields.update(extra_fields)
+    return create_model(name or f"{model.__name__}Schema", __base__=base, **fields)
+
+
+# The compact signal data is encoded from signal_data when the rows are written, payloads do not carry it
+DefectRootCauseSchema = schema_from_model(DefectRootCause, exclude=("signal_data_compact",))
+# Root causes nested in an event payload take the event id of their event
+NestedDefectRootCauseSchema = schema_from_model(DefectRootCause, name="NestedDefectRootCauseSchema",
+                                                exclude=("event_id", "signal_data_compact"))
+DefectEventSchema = schema_from_model(DefectEvent)
+DefectEventPayload = schema_from_model(DefectEvent, name="DefectEventPayload",
+                                       root_causes=(List[NestedDefectRootCauseSchema], []))
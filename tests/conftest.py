@@ -0,0 +1,52 @@
+"""
+Shared fixtures of the tests. All tests run against local SQLite databases, no SQL Server is needed.
+"""
+import shutil
+from datetime import timedelta
+
+import pytest
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from benchmarks.synthetic_data import START_DATE, SyntheticDataSpec, create_synthetic_database
+from phillip.db_models.base import Base
+from phillip.db_models.signal_meta import SignalMeta  # noqa: F401, referenced by the root causes
+
+# Small enough for a fast suite, long enough to span three monthly partitions
+SYNTHETIC_SPEC = SyntheticDataSpec(events=400, points_per_signal=10, days=60)
+SYNTHETIC_END = START_DATE + timedelta(days=SYNTHETIC_SPEC.days)
+DEFECTS = ["bulging", "clogging", "tundish_vortex"]
+STRAND_IDS = ["1_1", "1_2", "2c_1", "2c_2"]
+
+
+@pytest.fixture(scope="session")
+def synthetic_database(tmp_path_factory):
+    """Path of a SQLite file with the synthetic data of SYNTHETIC_SPEC, generated once per test session"""
+    path = tmp_path_factory.mktemp("synthetic") / "defects.db"
+    create_synthetic_database(path, SYNTHETIC_SPEC).dispose()
+    return path
+
+
+@pytest.fixture
+def synthetic_engine(synthetic_database, tmp_path):
+    """Engine of a private copy of the synthetic database, tests may modify it"""
+    path = tmp_path / "defects.db"
+    shutil.copyfile(synthetic_database, path)
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def empty_engine(tmp_path):
+    """Engine of a SQLite file with the empty tables of phillip.db_models"""
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'empty.db'}")
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def synthetic_session(synthetic_engine):
+    with Session(synthetic_engine) as session:
+        yield session
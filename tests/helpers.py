@@ -0,0 +1,35 @@
+"""
+Helpers shared by the tests
+"""
+from datetime import datetime
+from typing import Sequence
+
+import pandas as pd
+
+
+def sorted_rows(data: pd.DataFrame, keys: Sequence[str]) -> pd.DataFrame:
+    """Returns the rows of a frame sorted by keys with categorical columns as object dtype, so frames of different
+    extraction paths can be compared with pd.testing.assert_frame_equal()"""
+    categorical = [name for name, dtype in data.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    data = data.astype({name: object for name in categorical})
+    return data.sort_values(list(keys), kind="mergesort", ignore_index=True)
+
+
+def assert_same_rows(left: pd.DataFrame, right: pd.DataFrame, keys: Sequence[str]):
+    """Asserts that two frames hold the same rows and columns regardless of their order and dtypes"""
+    assert list(left.columns) == list(right.columns)
+    pd.testing.assert_frame_equal(sorted_rows(left, keys), sorted_rows(right, keys), check_dtype=False)
+
+
+def event_row(event_id: int, created_at: datetime = datetime(2024, 1, 1), **columns) -> dict:
+    """Returns the columns of a valid defect event, further columns override the defaults"""
+    return {"event_id": event_id, "event_type": "live", "created_at": created_at, "caster_id": "1",
+            "strand_id": "1_1", "slab_id": f"S{event_id:05d}", "model_name": "test", "model_number": 1,
+            "model_type": "ai", "behaviour_pattern_id": "clogging", **columns}
+
+
+def root_cause_row(event_id: int, signal_id: str, values: Sequence[float] = (1.0, 2.0), **columns) -> dict:
+    """Returns the columns of a root cause with one point per second from 2024-01-01 in signal_data"""
+    data = [[f"2024-01-01T00:00:{second:02d}", value] for second, value in enumerate(values)]
+    return {"event_id": event_id, "signal_id": signal_id, "importance": 0.5,
+            "signal_data": {"signal_id": signal_id, "data": data}, **columns}
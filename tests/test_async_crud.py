@@ -0,0 +1,82 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.synthetic_data import START_DATE
+from phillip.crud import defect_event_root_cause as crud
+from phillip.crud.async_lookups import gather_lookups
+from phillip.crud.defect_root_cause_pairs import extract_root_cause_pairs, gather_root_cause_pairs
+from tests.conftest import DEFECTS, STRAND_IDS, SYNTHETIC_END
+from tests.helpers import assert_same_rows
+
+SIGNALS_TO_FILTER = {"casting_length_1", "casting_length_C"}
+
+
+def _run_with_session_factory(engine, coroutine_function):
+    """Runs coroutine_function(session_factory) on an aiosqlite engine of the database of a sync engine"""
+
+    async def run():
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{engine.url.database}")
+        try:
+            return await coroutine_function(sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False))
+        finally:
+            await async_engine.dispose()
+
+    return asyncio.run(run())
+
+
+def test_async_join_returns_the_rows_of_the_sync_join(synthetic_engine, synthetic_session):
+    async def join(session_factory):
+        async with session_factory() as session:
+            return await crud.join_defect_event_root_cause_filter_behaviour_id_async(session, DEFECTS, STRAND_IDS,
+                                                                                     START_DATE, SYNTHETIC_END)
+
+    expected = crud.join_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS,
+                                                                     START_DATE, SYNTHETIC_END)
+    assert_same_rows(_run_with_session_factory(synthetic_engine, join), expected, ["event_id", "signal_id"])
+
+
+def test_gathered_event_lookups_keep_the_order_of_the_event_ids(synthetic_engine, synthetic_session, monkeypatch):
+    event_ids = [7, 3, 250, 3]
+    frames = _run_with_session_factory(synthetic_engine, lambda session_factory: crud.gather_defect_event_root_causes(
+        session_factory, event_ids, max_concurrency=2))
+
+    monkeypatch.setattr(crud, "session", synthetic_session, raising=False)
+    for event_id, frame in zip(event_ids, frames):
+        assert len(frame) > 0 and set(frame["event_id"]) == {event_id}
+        assert_same_rows(frame, crud.join_defect_event_root_cause_filter_event_id(event_id), ["signal_id"])
+
+
+def test_gathered_root_cause_pairs_match_the_sync_extraction(synthetic_engine, synthetic_session):
+    dates = ["2023-01-10", "2023-02-01"]
+    frames = _run_with_session_factory(synthetic_engine, lambda session_factory: gather_root_cause_pairs(
+        session_factory, dates, SIGNALS_TO_FILTER))
+
+    for date, frame in zip(dates, frames):
+        assert len(frame) > 0
+        expected = extract_root_cause_pairs(synthetic_session, date, SIGNALS_TO_FILTER)
+        assert_same_rows(frame, expected, ["event_id", "signal_pattern"])
+
+
+def test_lookups_never_exceed_max_concurrency():
+    running, peak = 0, 0
+
+    class FakeSession:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            return False
+
+    async def lookup(session, argument):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        return argument * 2
+
+    results = asyncio.run(gather_lookups(FakeSession, lookup, range(20), max_concurrency=3))
+    assert results == [argument * 2 for argument in range(20)]
+    assert peak == 3
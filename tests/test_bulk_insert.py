@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+from sqlalchemy import select
+
+from phillip.crud.bulk_insert import bulk_insert_defect_events, bulk_insert_defect_root_causes, iter_row_batches, \
+    split_by_keys
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from tests.helpers import event_row, root_cause_row
+
+
+def test_rows_are_inserted_in_batches(empty_engine):
+    report = bulk_insert_defect_events(empty_engine, (event_row(event_id) for event_id in range(1, 26)), batch_size=10)
+    root_causes = bulk_insert_defect_root_causes(empty_engine, [root_cause_row(1, "speed"), root_cause_row(1, "level")])
+
+    assert (report.rows, report.batches, root_causes.rows) == (25, 3, 2)
+    with empty_engine.connect() as connection:
+        assert connection.execute(select(DefectEvent.event_id)).scalars().all() == list(range(1, 26))
+        signal_data = connection.execute(select(DefectRootCause.signal_data)
+                                         .where(DefectRootCause.signal_id == "speed")).scalar_one()
+    assert signal_data == root_cause_row(1, "speed")["signal_data"]
+
+
+def test_missing_dataframe_values_become_nulls(empty_engine):
+    rows = pd.DataFrame([event_row(1, detection_probability=0.5), event_row(2, detection_probability=float("nan"))])
+    bulk_insert_defect_events(empty_engine, rows)
+
+    with empty_engine.connect() as connection:
+        probabilities = connection.execute(select(DefectEvent.detection_probability)
+                                           .order_by(DefectEvent.event_id)).scalars().all()
+    assert probabilities == [0.5, None]
+
+
+def test_rows_with_different_keys_keep_their_values(empty_engine):
+    rows = [event_row(1), event_row(2, grade_id="G100"), event_row(3)]
+    assert [len(run) for run in split_by_keys(rows)] == [1, 1, 1]
+    bulk_insert_defect_events(empty_engine, rows)
+
+    with empty_engine.connect() as connection:
+        grade_ids = connection.execute(select(DefectEvent.grade_id).order_by(DefectEvent.event_id)).scalars().all()
+        create_dates = connection.execute(select(DefectEvent.create_date)).scalars().all()
+    assert grade_ids == [None, "G100", None]
+    assert all(create_date is not None for create_date in create_dates)
+
+
+@pytest.mark.parametrize("rows", [[{"event_id": 1, "unknown": 1}], pd.DataFrame({"unknown": [1]})])
+def test_unknown_columns_are_rejected(rows):
+    with pytest.raises(ValueError):
+        next(iter_row_batches(rows, ["event_id"], batch_size=10))
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+from phillip.db_connection import create_session_from_url, dispose_engines, get_engine, get_scoped_session, \
+    get_session_factory, pool_capacity
+
+
+@pytest.fixture
+def sqlite_url(tmp_path):
+    yield make_url(f"sqlite:///{tmp_path / 'pooled.db'}")
+    dispose_engines()
+
+
+def test_engines_are_reused_per_url_and_arguments(sqlite_url):
+    engine = get_engine(sqlite_url, timeout=3)
+
+    assert get_engine(sqlite_url, timeout=3) is engine
+    assert get_engine(sqlite_url, timeout=3, pool_pre_ping=False) is not engine
+    assert get_session_factory(engine) is get_session_factory(engine)
+
+
+def test_sessions_from_the_same_url_share_the_engine(sqlite_url):
+    first = create_session_from_url(str(sqlite_url), odbc_driver=None)
+    second = create_session_from_url(str(sqlite_url), odbc_driver=None)
+
+    assert first is not second
+    assert first.get_bind() is second.get_bind()
+    assert first.execute(text("SELECT 1")).scalar() == 1
+
+
+def test_scoped_sessions_are_thread_local(sqlite_url):
+    registry = get_scoped_session(get_engine(sqlite_url, timeout=3))
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.append(registry()))
+    thread.start()
+    thread.join()
+
+    assert registry() is registry()
+    assert sessions[0] is not registry()
+
+
+def test_dispose_forgets_the_engines(sqlite_url):
+    engine = get_engine(sqlite_url, timeout=3)
+    dispose_engines()
+    assert get_engine(sqlite_url, timeout=3) is not engine
+
+
+def test_sqlite_pools_have_no_known_capacity(sqlite_url):
+    # SQLite engines use SingletonThreadPool / NullPool without pool_size and max_overflow
+    assert pool_capacity(get_engine(sqlite_url, timeout=3)) is None
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_analysis.downsampling import DOWNSAMPLING_METHODS, downsample_frame, downsample_series, minmax_indices
+
+
+def _signal(points: int = 10_000, seed: int = 0) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2024-01-01", periods=points, freq="100ms")
+    return pd.Series(np.cumsum(rng.normal(size=points)), index=index)
+
+
+def test_minmax_keeps_the_extremes_of_every_bucket():
+    signal = _signal()
+    x = signal.index.asi8.astype(np.float64)
+    positions = minmax_indices(x, signal.to_numpy(), 200)
+
+    n_buckets = 99
+    buckets = np.minimum(((x - x[0]) / (x[-1] - x[0]) * n_buckets).astype(np.int64), n_buckets - 1)
+    grouped = signal.groupby(buckets)
+    expected = {0, len(signal) - 1} | {signal.index.get_loc(label) for label in grouped.idxmin()} \
+        | {signal.index.get_loc(label) for label in grouped.idxmax()}
+    assert set(positions) == expected and len(positions) <= 200
+
+
+@pytest.mark.parametrize("method", DOWNSAMPLING_METHODS)
+def test_downsampled_signals_keep_their_ends_and_extremes(method):
+    signal = _signal()
+    downsampled = downsample_series(signal, target_points=500, method=method)
+
+    assert len(downsampled) <= 500 and downsampled.index.is_monotonic_increasing
+    assert downsampled.index[0] == signal.index[0] and downsampled.index[-1] == signal.index[-1]
+    assert downsampled.isin(signal).all()
+    if method == "minmax":
+        assert downsampled.min() == signal.min() and downsampled.max() == signal.max()
+    else:
+        assert len(downsampled) == 500
+
+
+@pytest.mark.parametrize("method", DOWNSAMPLING_METHODS)
+@pytest.mark.parametrize("points", [50, 5_000])
+def test_nan_values_are_dropped_and_points_sorted_whether_downsampled_or_not(method, points):
+    signal = _signal(points)
+    signal.iloc[::7] = np.nan
+    shuffled = signal.sample(frac=1.0, random_state=1)
+    downsampled = downsample_series(shuffled, target_points=100, method=method)
+
+    assert not downsampled.isna().any() and downsampled.index.is_monotonic_increasing
+    if points <= 100:
+        pd.testing.assert_series_equal(downsampled, signal.dropna())
+
+
+def test_signals_of_a_frame_are_downsampled_on_their_own():
+    data = pd.DataFrame({"speed": _signal(seed=1), "level": _signal(seed=2)})
+    data.loc[data.index[:9_000], "level"] = np.nan
+    downsampled = downsample_frame(data, target_points=400, cols=["speed", "level"])
+
+    assert len(downsampled["speed"]) <= 400 and len(downsampled["level"]) <= 400
+    assert downsampled["level"].index.min() == data.index[9_000]
+    assert (downsampled["level"] == data["level"].loc[downsampled["level"].index]).all()
+    assert downsample_series(data["speed"], target_points=None) is data["speed"]
+
+
+@pytest.mark.parametrize("target_points, method", [(2, "minmax"), (100, "median")])
+def test_invalid_arguments_are_rejected(target_points, method):
+    with pytest.raises(ValueError):
+        downsample_series(_signal(), target_points=target_points, method=method)
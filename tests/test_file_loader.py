@@ -0,0 +1,81 @@
+import json
+
+import pandas as pd
+import pytest
+from sqlalchemy import inspect, select
+
+from phillip.crud.file_loader import iter_file_chunks, load_defect_files, load_file, suspended_indexes
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.db_models.signal_meta import SignalMeta
+from tests.helpers import event_row
+
+
+def _rows(engine, model) -> list:
+    table = model.__table__
+    with engine.connect() as connection:
+        return connection.execute(select(table).order_by(*table.primary_key.columns)).fetchall()
+
+
+def _export_csv(engine, model, path, **columns):
+    """Writes the rows of a table to a CSV file with JSON columns serialized"""
+    data = pd.DataFrame([row._mapping for row in _rows(engine, model)])
+    if "signal_data" in data:
+        data["signal_data"] = data["signal_data"].map(json.dumps)
+    data.drop(columns=["signal_data_compact"], errors="ignore").assign(**columns).to_csv(path, index=False)
+    return path
+
+
+def test_exported_tables_load_back_into_the_same_rows(synthetic_engine, empty_engine, tmp_path):
+    paths = {model: _export_csv(synthetic_engine, model, tmp_path / f"{model.__tablename__}.csv.gz")
+             for model in (SignalMeta, DefectEvent, DefectRootCause)}
+    reports = load_defect_files(empty_engine, signal_meta=paths[SignalMeta], defect_events=paths[DefectEvent],
+                                defect_root_causes=paths[DefectRootCause], chunk_size=150, batch_size=40)
+
+    assert [report.table for report in reports] == ["signal_meta", "defect_event", "defect_root_cause"]
+    assert reports[1].chunks == 3 and all(report.invalid_rows == 0 for report in reports)
+    for model in (SignalMeta, DefectEvent, DefectRootCause):
+        assert _rows(empty_engine, model) == _rows(synthetic_engine, model)
+
+
+def test_the_chunks_of_a_file_have_at_most_chunk_size_rows(tmp_path):
+    path = tmp_path / "events.csv"
+    pd.DataFrame({"event_id": range(25), "slab_id": [f"0{index}" for index in range(25)]}).to_csv(path, index=False)
+    chunks = list(iter_file_chunks(path, chunk_size=10, string_columns=["slab_id"]))
+
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert chunks[0]["slab_id"].iloc[0] == "00"
+
+
+def test_invalid_rows_are_skipped_or_stop_the_load(empty_engine, tmp_path):
+    rows = [event_row(1), event_row(2, model_number="two"), event_row(3, created_at="yesterday"), event_row(4)]
+    path = tmp_path / "events.csv"
+    pd.DataFrame(rows).rename(columns={"slab_id": "slab"}).to_csv(path, index=False)
+
+    with pytest.raises(ValueError, match="Invalid values"):
+        load_file(empty_engine, DefectEvent, path, column_map={"slab": "slab_id"})
+    report = load_file(empty_engine, DefectEvent, path, column_map={"slab": "slab_id"}, skip_invalid_rows=True)
+
+    assert report.rows == 2 and report.invalid_rows == 2
+    assert [(row.event_id, row.slab_id) for row in _rows(empty_engine, DefectEvent)] == [(1, "S00001"), (4, "S00004")]
+
+
+def test_unknown_and_missing_columns_are_rejected(empty_engine, tmp_path):
+    path = tmp_path / "events.csv"
+    pd.DataFrame([event_row(1, comment="x")]).to_csv(path, index=False)
+    with pytest.raises(ValueError, match="not part of"):
+        load_file(empty_engine, DefectEvent, path)
+    assert load_file(empty_engine, DefectEvent, path, ignore_unknown_columns=True).rows == 1
+
+    pd.DataFrame([event_row(2)]).drop(columns=["model_name"]).to_csv(path, index=False)
+    with pytest.raises(ValueError, match="misses the required columns"):
+        load_file(empty_engine, DefectEvent, path)
+
+
+def test_suspended_indexes_are_created_again_after_a_failed_load(empty_engine):
+    indexes = {index["name"] for index in inspect(empty_engine).get_indexes("defect_event")}
+    with pytest.raises(RuntimeError):
+        with suspended_indexes(empty_engine, DefectEvent) as suspended:
+            assert set(suspended) == indexes and inspect(empty_engine).get_indexes("defect_event") == []
+            raise RuntimeError("load failed")
+    assert {index["name"] for index in inspect(empty_engine).get_indexes("defect_event")} == indexes
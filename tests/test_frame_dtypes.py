@@ -0,0 +1,82 @@
+import pandas as pd
+import pytest
+from loguru import logger
+
+from benchmarks.synthetic_data import START_DATE
+from phillip.crud import defect_event_root_cause as crud
+from phillip.db_models.defect_event import BehaviourPattern
+from phillip.frame_dtypes import apply_model_dtypes, concat_frames, model_dtypes
+from phillip.schemas import enum_values
+from tests.conftest import DEFECTS, STRAND_IDS, SYNTHETIC_END
+
+
+@pytest.fixture
+def warnings():
+    messages = []
+    sink_id = logger.add(lambda message: messages.append(message.record["message"]), level="WARNING")
+    yield messages
+    logger.remove(sink_id)
+
+
+def _events(**columns) -> pd.DataFrame:
+    return pd.DataFrame({"event_id": [1, 2, 3], "behaviour_pattern_id": ["clogging", "bulging", "clogging"],
+                         "caster_id": ["1", "2c", "1"], "detection_probability": [0.1, 0.5, 0.9], **columns})
+
+
+def test_enumerated_columns_have_the_values_of_their_enumeration_as_categories():
+    data = apply_model_dtypes(_events())
+
+    # The categories do not depend on the values of the frame
+    assert list(data["behaviour_pattern_id"].cat.categories) == list(enum_values(BehaviourPattern))
+    assert data["behaviour_pattern_id"].tolist() == ["clogging", "bulging", "clogging"]
+    assert list(data["caster_id"].cat.categories) == ["1", "2c"]
+    assert str(data["detection_probability"].dtype) == "float32"
+    # Without NULLs the BigInteger id keeps its numpy dtype
+    assert str(data["event_id"].dtype) == "int64"
+    assert str(apply_model_dtypes(_events(event_id=[1, None, 3]))["event_id"].dtype) == "Int64"
+
+
+def test_values_outside_of_the_enumeration_keep_the_original_dtype(warnings):
+    original = _events(behaviour_pattern_id=["clogging", "slag", None])
+    data = apply_model_dtypes(original)
+
+    assert data["behaviour_pattern_id"].dtype == object
+    assert data["behaviour_pattern_id"].tolist() == ["clogging", "slag", None]
+    assert len(warnings) == 1 and warnings[0].startswith("Column behaviour_pattern_id keeps dtype object")
+    # The other columns are converted and the passed frame is not modified
+    assert isinstance(data["caster_id"].dtype, pd.CategoricalDtype)
+    assert original["caster_id"].dtype == object
+
+
+def test_excluded_and_duplicated_columns_keep_their_dtype():
+    data = apply_model_dtypes(_events(), exclude=["caster_id"])
+    assert data["caster_id"].dtype == object
+
+    duplicated = pd.concat([_events()[["caster_id"]], _events()[["caster_id"]]], axis=1)
+    assert (apply_model_dtypes(duplicated).dtypes == object).all()
+
+
+def test_concatenated_chunks_keep_categorical_columns():
+    first = apply_model_dtypes(_events())
+    second = apply_model_dtypes(_events(caster_id=["3", "3", "2c"], event_id=[4, 5, 6]))
+    assert first["caster_id"].dtype != second["caster_id"].dtype
+
+    data = concat_frames([first, second])
+    assert isinstance(data["caster_id"].dtype, pd.CategoricalDtype)
+    assert list(data["caster_id"].cat.categories) == ["1", "2c", "3"]
+    assert data["caster_id"].tolist() == ["1", "2c", "1", "3", "3", "2c"]
+    assert data["behaviour_pattern_id"].dtype == first["behaviour_pattern_id"].dtype
+    assert data.index.tolist() == list(range(6))
+    # pd.concat() alone falls back to object dtype
+    assert pd.concat([first, second])["caster_id"].dtype == object
+
+
+def test_query_results_have_the_dtypes_of_the_models(synthetic_session):
+    data = crud.join_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS, START_DATE,
+                                                                 SYNTHETIC_END)
+    dtypes = model_dtypes()
+
+    assert not data.empty
+    for name in ["behaviour_pattern_id", "caster_id", "strand_id", "signal_id", "importance",
+                 "detection_probability"]:
+        assert str(data[name].dtype) == str(dtypes[name]), name
@@ -0,0 +1,56 @@
+from datetime import timedelta
+
+import pytest
+
+from benchmarks.synthetic_data import START_DATE
+from data_analysis import defect_event_root_cause as analysis
+from phillip.crud import defect_event_root_cause as crud
+from tests.conftest import DEFECTS, STRAND_IDS, SYNTHETIC_END
+from tests.helpers import assert_same_rows
+
+WINDOWS = [(START_DATE, SYNTHETIC_END), (START_DATE + timedelta(days=10), START_DATE + timedelta(days=20))]
+
+
+def test_the_join_statements_are_built_once():
+    assert analysis.get_behaviour_id_join_statement(True, False, False) \
+        is analysis.get_behaviour_id_join_statement(True, False, False)
+    assert analysis.get_behaviour_id_join_statement(False, True, False) \
+        is not analysis.get_behaviour_id_join_statement(True, True, False)
+    assert analysis.signal_data_fetch_statement(4) is analysis.signal_data_fetch_statement(4)
+
+
+@pytest.mark.parametrize("statement, params", [
+    (analysis.get_behaviour_id_join_statement(True, False, False), analysis.behaviour_id_join_params),
+    (crud.behaviour_id_join_statement, crud.behaviour_id_join_params),
+])
+def test_calls_with_other_values_reuse_the_compiled_statement(synthetic_engine, statement, params):
+    compiled_cache = {}
+    row_counts = set()
+    with synthetic_engine.connect() as connection:
+        connection = connection.execution_options(compiled_cache=compiled_cache)
+        for defects, strand_ids in [(DEFECTS, STRAND_IDS), (DEFECTS[:1], STRAND_IDS[:3])]:
+            for start, end in WINDOWS:
+                row_counts.add(len(connection.execute(statement, params(defects, strand_ids, start, end)).fetchall()))
+    assert len(row_counts) > 1
+    assert len(compiled_cache) == 1
+
+
+@pytest.mark.parametrize("start, end", WINDOWS)
+def test_the_bound_query_returns_the_rows_of_the_parameterised_statement(synthetic_session, start, end):
+    statement = analysis.get_behaviour_id_join_statement(False, False, False)
+    executed = synthetic_session.execute(statement,
+                                         analysis.behaviour_id_join_params(DEFECTS[1:], STRAND_IDS, start, end))
+    bound = synthetic_session.execute(analysis.behaviour_id_join_query(DEFECTS[1:], STRAND_IDS, start, end,
+                                                                       with_signal_data=False))
+    assert sorted(executed.fetchall()) == sorted(bound.fetchall())
+
+
+def test_the_crud_and_analysis_joins_return_the_same_root_causes(synthetic_session):
+    columns = ["event_id", "signal_id", "importance"]
+    crud_rows = crud.join_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS,
+                                                                      START_DATE, SYNTHETIC_END)
+    analysis_rows = analysis.join_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS,
+                                                                              START_DATE, SYNTHETIC_END,
+                                                                              compact_signal_data=False)
+    assert len(crud_rows) > 0
+    assert_same_rows(crud_rows[columns], analysis_rows[columns], ["event_id", "signal_id"])
@@ -0,0 +1,30 @@
+import inspect
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from db_engines.sql_server_engine import get_sqlservertest_engine
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+
+
+def _loaded_modules(*imports: str) -> dict:
+    # A fresh interpreter, the modules of this test session are already loaded
+    code = ("import importlib, json, sys\n"
+            f"for name in {list(imports)!r}: importlib.import_module(name)\n"
+            "print(json.dumps({'pandas_executed': 'pandas.core' in sys.modules,\n"
+            "                  'asyncio_extension': 'sqlalchemy.ext.asyncio' in sys.modules,\n"
+            "                  'pyodbc': 'pyodbc' in sys.modules}))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def test_importing_the_crud_layer_loads_no_heavy_modules():
+    loaded = _loaded_modules("phillip.db_connection", "phillip.crud.bulk_insert", "phillip.crud.streaming",
+                             "db_engines.sql_server_engine")
+    assert loaded == {"pandas_executed": False, "asyncio_extension": False, "pyodbc": False}
+
+
+def test_the_sql_server_test_engine_does_not_echo_by_default():
+    assert inspect.signature(get_sqlservertest_engine).parameters["verbose"].default is False
@@ -0,0 +1,76 @@
+import pytest
+from sqlalchemy import select
+
+from phillip.crud.live_ingestion import LiveIngestionService
+from phillip.db_models import signal_codec
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from tests.helpers import event_row, root_cause_row
+
+
+def _payload(event_id: int, signals=("speed", "level"), **columns) -> dict:
+    root_causes = [{key: value for key, value in root_cause_row(event_id, signal_id).items() if key != "event_id"}
+                   for signal_id in signals]
+    return {**event_row(event_id, **columns), "root_causes": root_causes}
+
+
+def _event_ids(engine) -> list:
+    with engine.connect() as connection:
+        return connection.execute(select(DefectEvent.event_id).order_by(DefectEvent.event_id)).scalars().all()
+
+
+def test_payloads_are_written_in_micro_batches(empty_engine):
+    with LiveIngestionService(empty_engine, max_batch_size=16, max_batch_latency=0.05) as service:
+        service.submit_many(_payload(event_id) for event_id in range(1, 101))
+        service.join()
+        stats = service.stats()
+
+    assert _event_ids(empty_engine) == list(range(1, 101))
+    assert stats.events == 100 and stats.root_causes == 200 and stats.submitted == 100
+    assert stats.batches >= 100 / 16 and stats.mean_batch_size <= 16
+    assert 0 < stats.latency_p50_s <= stats.latency_max_s
+
+
+def test_duplicates_are_bisected_into_dead_letters_and_invalid_payloads_rejected(empty_engine):
+    with LiveIngestionService(empty_engine, max_batch_size=64, max_batch_latency=1.0) as service:
+        service.submit(_payload(7))
+        service.join()
+        # A batch with a committed event, a duplicate of the batch, duplicate root causes and an invalid payload
+        payloads = [_payload(event_id) for event_id in range(10, 40)]
+        payloads[3], payloads[17], payloads[25] = _payload(7), _payload(11), _payload(50, signals=("a", "a"))
+        payloads[20] = {"event_id": "not a number"}
+        service.submit_many(payloads)
+        service.join()
+        stats = service.stats()
+        dead_letters = service.dead_letters()
+
+    assert stats.dead_lettered == 3 and stats.rejected == 1 and stats.failed == 0
+    assert [dead_letter.payload["event_id"] for dead_letter in dead_letters] == [7, 11, 50]
+    # The events of the replaced payloads 13, 27, 35 and 30 are missing, the events of the dead letters are not written
+    assert _event_ids(empty_engine) == [7] + [event_id for event_id in range(10, 40)
+                                              if event_id not in (13, 27, 30, 35)]
+
+
+def test_compact_signal_data_is_off_by_default_and_written_on_request(empty_engine, monkeypatch):
+    monkeypatch.setattr(signal_codec, "_compact_signal_data", False)
+    with LiveIngestionService(empty_engine, max_batch_latency=0.01) as service:
+        assert not service.compact_signal_data
+        service.submit(_payload(1))
+    with LiveIngestionService(empty_engine, max_batch_latency=0.01, compact_signal_data=True) as service:
+        service.submit(_payload(2))
+
+    with empty_engine.connect() as connection:
+        compact = dict(connection.execute(select(DefectRootCause.event_id, DefectRootCause.signal_data_compact)
+                                          .where(DefectRootCause.signal_id == "speed")).fetchall())
+    assert compact[1] is None
+    assert compact[2].to_payload() == root_cause_row(2, "speed")["signal_data"]
+
+
+def test_compact_signal_data_on_an_unmigrated_table_fails_at_start(empty_engine):
+    with empty_engine.begin() as connection:
+        connection.exec_driver_sql("ALTER TABLE defect_root_cause DROP COLUMN signal_data_compact")
+    service = LiveIngestionService(empty_engine, compact_signal_data=True)
+    with pytest.raises(RuntimeError, match="signal_data_compact"):
+        service.start()
+    with pytest.raises(RuntimeError, match="not running"):
+        service.submit(_payload(1))
@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import func, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from phillip.crud.local_store import SYNCED_MODELS, get_local_store_engine, read_watermark, sync_local_store, sync_table
+from phillip.db_models.defect_event import DefectEvent
+
+
+@pytest.fixture
+def local_engine(tmp_path):
+    engine = get_local_store_engine(tmp_path / "local_store" / "defects.db")
+    yield engine
+    engine.dispose()
+
+
+def _table_rows(engine, model) -> list:
+    table = model.__table__
+    with engine.connect() as connection:
+        return connection.execute(select(table).order_by(*table.primary_key.columns)).fetchall()
+
+
+def test_the_local_store_holds_the_rows_of_the_source(synthetic_engine, local_engine):
+    reports = sync_local_store(synthetic_engine, local_engine, batch_size=100)
+
+    for model, report in zip(SYNCED_MODELS, reports):
+        source_rows = _table_rows(synthetic_engine, model)
+        assert report.previous_watermark is None and report.rows == len(source_rows) > 0
+        assert _table_rows(local_engine, model) == source_rows
+        assert read_watermark(local_engine, model.__tablename__) == max(row.update_date for row in source_rows)
+
+
+def test_a_second_sync_only_fetches_rows_changed_since_the_watermark(synthetic_engine, local_engine):
+    sync_table(synthetic_engine, local_engine, DefectEvent)
+    watermark = read_watermark(local_engine, DefectEvent.__tablename__)
+    with synthetic_engine.connect() as connection:
+        at_watermark = connection.execute(select(func.count()).where(DefectEvent.update_date == watermark)).scalar()
+
+    assert sync_table(synthetic_engine, local_engine, DefectEvent).rows == at_watermark
+
+    with synthetic_engine.begin() as connection:
+        connection.execute(update(DefectEvent.__table__).where(DefectEvent.event_id == 5)
+                           .values(slab_id="changed", update_date=watermark + timedelta(seconds=1)))
+    report = sync_table(synthetic_engine, local_engine, DefectEvent)
+
+    # The rows at the previous watermark are fetched again, see sync_table()
+    assert report.rows == at_watermark + 1 and report.watermark == watermark + timedelta(seconds=1)
+    assert _table_rows(local_engine, DefectEvent) == _table_rows(synthetic_engine, DefectEvent)
+
+
+def test_an_interrupted_sync_resumes_at_the_last_committed_batch(synthetic_engine, local_engine):
+    rows = _table_rows(synthetic_engine, DefectEvent)
+    failing_event_id = sorted(rows, key=lambda row: (row.update_date, row.event_id))[250].event_id
+    with local_engine.begin() as connection:
+        connection.execute(text(f"CREATE TRIGGER fail_sync BEFORE INSERT ON defect_event "
+                                f"WHEN NEW.event_id = {failing_event_id} "
+                                f"BEGIN SELECT RAISE(ABORT, 'interrupted'); END"))
+
+    with pytest.raises(IntegrityError):
+        sync_table(synthetic_engine, local_engine, DefectEvent, batch_size=100)
+    watermark = read_watermark(local_engine, DefectEvent.__tablename__)
+    assert len(_table_rows(local_engine, DefectEvent)) == 200
+
+    with local_engine.begin() as connection:
+        connection.execute(text("DROP TRIGGER fail_sync"))
+    report = sync_table(synthetic_engine, local_engine, DefectEvent, batch_size=100)
+
+    assert report.previous_watermark == watermark
+    assert _table_rows(local_engine, DefectEvent) == rows
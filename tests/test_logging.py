@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+from loguru import logger
+
+from data_analysis import dataframes
+from data_analysis.dataframes import create_df_from_sqlrows, frame_info
+from loguru_logging.debug_formatter import SampledDebugFilter, debug_format
+
+
+def _record(level: str = "DEBUG", line: int = 1) -> dict:
+    return {"level": type("Level", (), {"name": level})(), "name": "module", "line": line}
+
+
+def test_only_every_nth_debug_record_of_a_call_site_passes():
+    sampled = SampledDebugFilter(sample_every=3)
+    passed = [sampled(_record()) for _ in range(7)]
+
+    assert passed == [True, False, False, True, False, False, True]
+    assert sampled(_record(line=2)) is True
+    assert sampled(_record("INFO")) is False
+    assert all(SampledDebugFilter()(_record()) for _ in range(3))
+    with pytest.raises(ValueError):
+        SampledDebugFilter(sample_every=0)
+
+
+def test_the_debug_sink_writes_the_sampled_records_to_a_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sink_id = debug_format(sample_every=2)
+    try:
+        for index in range(4):
+            logger.debug("loop record {}", index)
+        logger.info("not a debug record")
+        logger.complete()
+    finally:
+        logger.remove(sink_id)
+
+    [log_file] = (tmp_path / "_logs").glob("debug_*.log")
+    lines = log_file.read_text().splitlines()
+    assert [line.rsplit("| ", 1)[-1] for line in lines] == ["loop record 0", "loop record 2"]
+    assert lines[0].startswith("Custom log: DEBUG |")
+
+
+def test_frame_summaries_are_only_built_for_enabled_levels(monkeypatch, capsys):
+    calls = []
+    monkeypatch.setattr(dataframes, "frame_info", lambda data: calls.append(len(data)) or "")
+    records = []
+    sink_id = logger.add(records.append, level="INFO")
+    logger.disable("data_analysis")
+    try:
+        create_df_from_sqlrows([(1, "S1")], ["event_id", "slab_id"])
+    finally:
+        logger.enable("data_analysis")
+        logger.remove(sink_id)
+
+    assert calls == [] and records == []
+    assert capsys.readouterr().out == ""
+    assert "event_id" in frame_info(pd.DataFrame({"event_id": [1]}))
@@ -0,0 +1,67 @@
+from itertools import islice
+
+import pandas as pd
+import pytest
+from sqlalchemy import select, update
+
+from benchmarks.synthetic_data import START_DATE
+from phillip.crud.pagination import KeysetCursor, iter_defect_event_pages
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+from tests.conftest import DEFECTS, SYNTHETIC_END
+
+
+def _event_ids(pages) -> list:
+    return [event_id for page in pages for event_id in page.events["event_id"]]
+
+
+@pytest.fixture
+def tied_session(synthetic_engine, synthetic_session):
+    """The synthetic events with runs of equal create_dates, which the create_date order has to break by event_id"""
+    with synthetic_engine.begin() as connection:
+        connection.execute(update(DefectEvent.__table__).where(DefectEvent.event_id % 5 != 0)
+                           .values(create_date=START_DATE))
+    return synthetic_session
+
+
+@pytest.mark.parametrize("order_by, sort_keys", [("event_id", ["event_id"]),
+                                                 ("create_date", ["create_date", "event_id"])])
+def test_the_pages_hold_every_event_once_in_key_order(tied_session, order_by, sort_keys):
+    expected = pd.read_sql(select(DefectEvent.event_id, DefectEvent.create_date), tied_session.connection())\
+        .sort_values(sort_keys)["event_id"].tolist()
+    pages = list(iter_defect_event_pages(tied_session, page_size=37, order_by=order_by))
+
+    assert _event_ids(pages) == expected
+    assert all(len(page.events) == 37 for page in pages[:-1])
+
+
+@pytest.mark.parametrize("order_by", ["event_id", "create_date"])
+def test_a_scan_resumes_after_the_page_of_its_cursor(tied_session, order_by):
+    filters = {"defects": DEFECTS[:2], "start": START_DATE, "end": SYNTHETIC_END}
+    complete = list(iter_defect_event_pages(tied_session, page_size=25, order_by=order_by, **filters))
+    interrupted = list(islice(iter_defect_event_pages(tied_session, page_size=25, order_by=order_by, **filters), 3))
+    token = interrupted[-1].next_cursor
+
+    resumed = list(iter_defect_event_pages(tied_session, page_size=25, order_by=order_by, cursor=token, **filters))
+    assert _event_ids(interrupted) + _event_ids(resumed) == _event_ids(complete)
+    assert KeysetCursor.decode(token) == interrupted[-1].cursor
+
+
+def test_a_cursor_is_only_accepted_by_a_scan_with_the_same_order_and_filters(synthetic_session):
+    token = next(iter_defect_event_pages(synthetic_session, page_size=10, defects=DEFECTS[:1])).next_cursor
+    with pytest.raises(ValueError, match="another order or other filters"):
+        next(iter_defect_event_pages(synthetic_session, page_size=10, defects=DEFECTS[1:2], cursor=token))
+    with pytest.raises(ValueError, match="another order or other filters"):
+        next(iter_defect_event_pages(synthetic_session, page_size=10, order_by="create_date", defects=DEFECTS[:1],
+                                     cursor=token))
+    with pytest.raises(ValueError, match="Invalid cursor token"):
+        next(iter_defect_event_pages(synthetic_session, cursor="not a token"))
+
+
+def test_the_root_causes_of_a_page_belong_to_its_events(synthetic_session):
+    all_root_causes = pd.read_sql(select(DefectRootCause.event_id, DefectRootCause.signal_id),
+                                  synthetic_session.connection())
+    for page in iter_defect_event_pages(synthetic_session, page_size=150, with_root_causes=True):
+        expected = all_root_causes[all_root_causes["event_id"].isin(page.events["event_id"])]\
+            .sort_values(["event_id", "signal_id"], ignore_index=True)
+        pd.testing.assert_frame_equal(page.root_causes[["event_id", "signal_id"]], expected)
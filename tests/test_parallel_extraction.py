@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+from loguru import logger
+from sqlalchemy import update
+
+from benchmarks.synthetic_data import START_DATE
+from data_analysis import parallel_extraction
+from data_analysis.defect_event_root_cause import join_defect_event_root_cause_filter_behaviour_id
+from data_analysis.parallel_extraction import join_defect_event_root_cause_filter_behaviour_id_parallel, plan_shards
+from phillip.db_models.defect_event import DefectEvent
+from tests.conftest import DEFECTS, STRAND_IDS
+from tests.helpers import assert_same_rows
+
+START, END = START_DATE + timedelta(days=5), START_DATE + timedelta(days=25)
+KEYS = ["create_date", "event_id", "signal_id"]
+BOUNDARY_EVENT_IDS = range(1, 200, 20)
+
+
+def test_time_shards_cover_the_window_without_gaps():
+    shards = plan_shards(START, END, STRAND_IDS, shards=3)
+
+    assert [shard.index for shard in shards] == [0, 1, 2]
+    assert shards[0].start == START and shards[-1].end == END
+    assert all(previous.end == shard.start for previous, shard in zip(shards, shards[1:]))
+    assert len(plan_shards(START, START, STRAND_IDS, shards=4)) == 1
+
+
+def test_strand_and_caster_shards_split_the_filters():
+    assert [shard.strand_ids for shard in plan_shards(START, END, STRAND_IDS, shards=3, shard_by="strand")] == [
+        ["1_1", "2c_2"], ["1_2"], ["2c_1"]]
+    assert [shard.casters for shard in plan_shards(START, END, STRAND_IDS, shard_by="caster",
+                                                   casters=["1", "2c"])] == [["1"], ["2c"]]
+    with pytest.raises(ValueError):
+        plan_shards(START, END, STRAND_IDS, shard_by="caster")
+    with pytest.raises(ValueError):
+        plan_shards(START, END, STRAND_IDS, shard_by="grade")
+
+
+@pytest.fixture
+def boundary_session(synthetic_engine, synthetic_session):
+    """The synthetic events with events created exactly on the shard boundaries and the end of the window"""
+    boundaries = [shard.start for shard in plan_shards(START, END, STRAND_IDS, shards=4)] + [END]
+    with synthetic_engine.begin() as connection:
+        for event_id, create_date in zip(BOUNDARY_EVENT_IDS, boundaries * 2):
+            connection.execute(update(DefectEvent.__table__).where(DefectEvent.event_id == event_id)
+                               .values(create_date=create_date))
+    return synthetic_session
+
+
+@pytest.mark.parametrize("shard_by, casters", [("time", None), ("strand", None), ("caster", ["1", "2c"])])
+def test_the_shards_return_the_rows_of_the_serial_join(synthetic_engine, boundary_session, shard_by, casters):
+    expected = join_defect_event_root_cause_filter_behaviour_id(boundary_session, DEFECTS, STRAND_IDS, START, END,
+                                                                compact_signal_data=False)
+    data, report = join_defect_event_root_cause_filter_behaviour_id_parallel(
+        synthetic_engine, DEFECTS, STRAND_IDS, START, END, shards=4, shard_by=shard_by, casters=casters,
+        max_workers=2, compact_signal_data=False)
+
+    assert set(BOUNDARY_EVENT_IDS) <= set(expected["event_id"])
+    assert report.rows == len(data) == sum(shard.rows for shard in report.shards)
+    assert data[KEYS].equals(data[KEYS].sort_values(KEYS, ignore_index=True))
+    # The JSON payloads are dicts, which pandas can not sort or compare by value
+    assert_same_rows(data.assign(signal_data=data["signal_data"].map(str)),
+                     expected.assign(signal_data=expected["signal_data"].map(str)), KEYS)
+
+
+def test_no_strands_give_an_empty_frame_with_the_columns_of_a_query(synthetic_engine):
+    data, report = join_defect_event_root_cause_filter_behaviour_id_parallel(
+        synthetic_engine, DEFECTS, [], START, END, shard_by="strand", compact_signal_data=False)
+    assert data.empty and report.shards == [] and "signal_data" in data.columns
+
+
+def test_more_workers_than_pooled_connections_are_reported(synthetic_engine, monkeypatch):
+    monkeypatch.setattr(parallel_extraction, "pool_capacity", lambda engine: 2)
+    warnings = []
+    sink_id = logger.add(lambda message: warnings.append(message.record["message"]), level="WARNING")
+    try:
+        join_defect_event_root_cause_filter_behaviour_id_parallel(synthetic_engine, DEFECTS, STRAND_IDS, START,
+                                                                  datetime(2023, 1, 7), shards=3,
+                                                                  compact_signal_data=False)
+    finally:
+        logger.remove(sink_id)
+    assert warnings == ["3 shards run concurrently but the connection pool only allows 2 connections"]
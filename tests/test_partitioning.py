@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy
+from sqlalchemy import func, inspect, select
+
+from benchmarks.synthetic_data import START_DATE
+from data_analysis import defect_event_root_cause as analysis
+from data_analysis.root_cause_signal_sets import SignalIncidence
+from phillip.crud import defect_event_root_cause as crud
+from phillip.crud.pagination import iter_defect_event_pages
+from phillip.crud.partitioning import (add_months, archive_defect_events, existing_partitions,
+                                       join_defect_event_root_cause_filter_behaviour_id_partitioned,
+                                       partition_tables, partitions_for_window, refresh_partitions)
+from phillip.db_models.defect_event import DefectEvent
+from tests.conftest import DEFECTS, STRAND_IDS, SYNTHETIC_END
+from tests.helpers import assert_same_rows
+
+# The synthetic events span January to March 2023, the first two months are archived
+NOW = datetime(2023, 3, 15)
+ARCHIVED_EVENT_ID = 3
+
+
+def _extract(session) -> dict:
+    """Results of the extractors which read the partitions, the event lookup uses the module level session of crud"""
+    return {
+        "crud join": crud.join_defect_event_root_cause_filter_behaviour_id(session, DEFECTS, STRAND_IDS,
+                                                                           START_DATE, SYNTHETIC_END),
+        "analysis join": analysis.join_defect_event_root_cause_filter_behaviour_id(session, DEFECTS, STRAND_IDS,
+                                                                                   START_DATE, SYNTHETIC_END,
+                                                                                   compact_signal_data=False),
+        "partitioned join": join_defect_event_root_cause_filter_behaviour_id_partitioned(session, DEFECTS,
+                                                                                         STRAND_IDS, START_DATE,
+                                                                                         SYNTHETIC_END),
+        "event lookup": crud.join_defect_event_root_cause_filter_event_id(ARCHIVED_EVENT_ID),
+        "incidence": SignalIncidence.load(session, START_DATE).events,
+    }
+
+
+def _page_event_ids(session) -> list:
+    return [event_id for page in iter_defect_event_pages(session, page_size=64, order_by="create_date")
+            for event_id in page.events["event_id"]]
+
+
+def test_the_extractors_return_the_same_rows_after_archiving(synthetic_engine, synthetic_session, monkeypatch):
+    monkeypatch.setattr(crud, "session", synthetic_session, raising=False)
+    before, pages_before = _extract(synthetic_session), _page_event_ids(synthetic_session)
+
+    report = archive_defect_events(synthetic_engine, hot_months=1, now=NOW, batch_size=70)
+    assert report.cutoff == datetime(2023, 3, 1) and report.partitions == ["202301", "202302"]
+    with synthetic_engine.connect() as connection:
+        assert connection.execute(select(func.min(DefectEvent.create_date))).scalar() >= report.cutoff
+
+    synthetic_session.expire_all()
+    after, pages_after = _extract(synthetic_session), _page_event_ids(synthetic_session)
+    assert pages_after == pages_before
+    assert len(before["event lookup"]) > 0
+    for name, frame in before.items():
+        keys = ["event_id", "signal_id"] if "signal_id" in frame else ["event_id"]
+        assert_same_rows(after[name], frame, keys)
+
+
+def test_a_second_archive_run_moves_nothing(synthetic_engine):
+    first = archive_defect_events(synthetic_engine, hot_months=1, now=NOW)
+    second = archive_defect_events(synthetic_engine, hot_months=1, now=NOW)
+
+    assert first.events > 0 and first.root_causes > first.events
+    assert second.events == 0 and second.partitions == []
+    assert existing_partitions(synthetic_engine) == ["202301", "202302"]
+
+
+def test_partitions_are_pruned_by_the_window(synthetic_engine):
+    archive_defect_events(synthetic_engine, hot_months=1, now=NOW)
+
+    assert partitions_for_window(synthetic_engine, datetime(2023, 2, 3), None) == ["202302"]
+    assert partitions_for_window(synthetic_engine, None, datetime(2023, 1, 31)) == ["202301"]
+    assert partitions_for_window(synthetic_engine, datetime(2023, 3, 1), datetime(2023, 3, 2)) == []
+    assert add_months(datetime(2023, 1, 31), -1) == datetime(2022, 12, 1)
+
+
+def test_partitions_created_elsewhere_are_found_after_a_refresh(synthetic_engine):
+    assert existing_partitions(synthetic_engine) == []
+    other_engine = sqlalchemy.create_engine(synthetic_engine.url)
+    for table in partition_tables("202212"):
+        table.create(other_engine)
+    other_engine.dispose()
+
+    assert "defect_event_202212" in inspect(synthetic_engine).get_table_names()
+    assert existing_partitions(synthetic_engine) == []
+    assert refresh_partitions(synthetic_engine) == ["202212"]
+    assert existing_partitions(synthetic_engine.execution_options(schema_translate_map={None: None})) == ["202212"]
+
+
+@pytest.mark.parametrize("hot_months, batch_size", [(0, 10), (1, 0)])
+def test_invalid_arguments_are_rejected(synthetic_engine, hot_months, batch_size):
+    with pytest.raises(ValueError):
+        archive_defect_events(synthetic_engine, hot_months=hot_months, batch_size=batch_size,
+                              now=START_DATE + timedelta(days=90))
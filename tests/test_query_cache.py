@@ -0,0 +1,93 @@
+import pandas as pd
+import pytest
+from sqlalchemy import select
+
+from phillip.crud.query_cache import QueryResultCache
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _frame(rows: int = 10) -> pd.DataFrame:
+    return pd.DataFrame({"event_id": range(rows), "value": [float(row) for row in range(rows)]})
+
+
+def test_entries_expire_after_their_ttl():
+    clock = FakeClock()
+    cache = QueryResultCache(default_ttl=10.0, clock=clock)
+    cache.put("default", _frame())
+    cache.put("short", _frame(), ttl=1.0)
+    cache.put("forever", _frame(), ttl=None)
+
+    clock.now = 5.0
+    assert cache.get("short") is None
+    assert cache.get("default") is not None
+    clock.now = 10.0
+    assert cache.get("default") is None
+    assert cache.get("forever") is None  # ttl=None falls back to the default TTL
+    assert cache.stats()["entries"] == 0
+
+
+def test_the_least_recently_used_entries_are_evicted():
+    size = int(_frame().memory_usage(deep=True).sum())
+    cache = QueryResultCache(max_bytes=2 * size, default_ttl=None)
+    cache.put("first", _frame())
+    cache.put("second", _frame())
+    cache.get("first")
+    cache.put("third", _frame())
+
+    assert cache.get("second") is None
+    assert cache.get("first") is not None and cache.get("third") is not None
+    assert cache.stats()["evictions"] == 1 and cache.stats()["bytes"] == 2 * size
+
+
+def test_frames_larger_than_the_cache_are_not_cached():
+    cache = QueryResultCache(max_bytes=10)
+    cache.put("large", _frame())
+    assert cache.get("large") is None and cache.stats()["entries"] == 0
+
+
+def test_returned_frames_are_copies_sharing_their_cell_objects():
+    cache = QueryResultCache()
+    frame = pd.DataFrame({"event_id": [1], "signal_data": [{"data": [1.0]}]})
+    cache.put("key", frame)
+
+    returned = cache.get("key")
+    returned.loc[0, "event_id"] = 2
+    returned["extra"] = 1.0
+    cached = cache.get("key")
+    assert cached["event_id"].tolist() == [1] and "extra" not in cached
+    # Only the frame is copied, the documented contract of QueryResultCache
+    assert cached.loc[0, "signal_data"] is frame.loc[0, "signal_data"]
+
+
+def test_query_results_are_served_from_the_cache_until_their_tables_are_invalidated(synthetic_session):
+    cache = QueryResultCache()
+    statement = select(DefectEvent.event_id, DefectRootCause.signal_id)\
+        .join(DefectRootCause, DefectRootCause.event_id == DefectEvent.event_id)\
+        .where(DefectEvent.event_id < 20)
+
+    first = cache.read_frame(synthetic_session, statement)
+    second = cache.read_frame(synthetic_session, statement)
+    pd.testing.assert_frame_equal(first, second)
+    assert len(first) > 0 and cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    assert cache.invalidate_tables("signal_meta") == 0
+    assert cache.invalidate_tables("defect_root_cause") == 1
+    cache.read_frame(synthetic_session, statement)
+    assert cache.stats()["misses"] == 2
+
+
+@pytest.mark.parametrize("params", [None, {"offset": 3}])
+def test_the_key_depends_on_the_bound_parameters(synthetic_session, params):
+    dialect = synthetic_session.get_bind().dialect
+    key = QueryResultCache.make_key(select(DefectEvent).where(DefectEvent.event_id == 1), dialect, params)
+    assert key == QueryResultCache.make_key(select(DefectEvent).where(DefectEvent.event_id == 1), dialect, params)
+    assert key != QueryResultCache.make_key(select(DefectEvent).where(DefectEvent.event_id == 2), dialect, params)
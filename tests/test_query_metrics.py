@@ -0,0 +1,75 @@
+import pytest
+import sqlalchemy
+from sqlalchemy import bindparam, select
+from sqlalchemy.exc import OperationalError
+
+from phillip.db_models.defect_event import DefectEvent
+from phillip.query_metrics import LatencyHistogram, QueryMetrics, fingerprint_statement, instrument_engine
+from tests.conftest import SYNTHETIC_SPEC
+
+IN_LIST_STATEMENT = select(DefectEvent.event_id).where(DefectEvent.event_id.in_(bindparam("ids", expanding=True)))
+
+
+@pytest.fixture
+def instrumented_engine(synthetic_database, request):
+    """Engine of the synthetic database recording into its own metrics, count_fetched_rows is the fixture param"""
+    metrics = QueryMetrics(slow_query_seconds=None)
+    count_fetched_rows = getattr(request, "param", False)
+    engine = instrument_engine(sqlalchemy.create_engine(f"sqlite:///{synthetic_database}"), metrics=metrics,
+                               count_fetched_rows=count_fetched_rows)
+    yield engine, metrics, count_fetched_rows
+    engine.dispose()
+
+
+def _in_list_stats(metrics: QueryMetrics) -> dict:
+    return next(stats for stats in metrics.snapshot() if "IN (?...)" in stats["fingerprint"])
+
+
+def test_statements_with_other_literals_share_a_fingerprint():
+    assert fingerprint_statement("SELECT * FROM t WHERE a = 1 AND b = 'x'") \
+        == fingerprint_statement("SELECT *\n  FROM t WHERE a = -2.5 AND b = 'it''s'") \
+        == "SELECT * FROM t WHERE a = ? AND b = ?"
+    assert fingerprint_statement("SELECT * FROM t WHERE id IN (?, ?, ?)") \
+        == fingerprint_statement("SELECT * FROM t WHERE id IN (%(id_1)s)") \
+        == "SELECT * FROM t WHERE id IN (?...)"
+    assert fingerprint_statement("SELECT col_1 FROM t2") == "SELECT col_1 FROM t2"
+
+
+def test_histogram_quantiles_are_accurate_to_a_bucket():
+    histogram = LatencyHistogram()
+    for millisecond in range(1, 101):
+        histogram.add(millisecond / 1000)
+
+    assert histogram.count == 100 and histogram.max_seconds == 0.1
+    for q in (0.5, 0.95, 0.99):
+        assert q / 10 <= histogram.quantile(q) <= q / 10 * 2 ** (1 / 8)
+    assert histogram.quantile(1.0) == 0.1 and LatencyHistogram().quantile(0.5) == 0.0
+
+
+@pytest.mark.parametrize("instrumented_engine", [False, True], indirect=True)
+def test_executions_are_recorded_per_fingerprint(instrumented_engine):
+    engine, metrics, count_fetched_rows = instrumented_engine
+    with engine.connect() as connection:
+        for ids in ([1, 2], [3, 4, 5], [SYNTHETIC_SPEC.events + 1]):
+            connection.execute(IN_LIST_STATEMENT, {"ids": ids}).fetchall()
+        with pytest.raises(OperationalError):
+            connection.exec_driver_sql("SELECT missing_column FROM defect_event")
+
+    stats = _in_list_stats(metrics)
+    assert stats["count"] == 3 and stats["errors"] == 0
+    # SQLite reports no rowcount of SELECT statements, fetched rows are only counted on request
+    assert stats["rows"] == (5 if count_fetched_rows else 0)
+    assert 0 < stats["p50_s"] <= stats["max_s"] <= stats["total_s"]
+    errors = {stats["fingerprint"]: stats["errors"] for stats in metrics.snapshot()}
+    assert errors["SELECT missing_column FROM defect_event"] == 1
+
+
+@pytest.mark.parametrize("instrumented_engine", [True], indirect=True)
+def test_only_fetched_rows_are_counted_once_the_result_is_closed(instrumented_engine):
+    engine, metrics, _ = instrumented_engine
+    with engine.connect() as connection:
+        result = connection.execute(IN_LIST_STATEMENT, {"ids": [1, 2, 3, 4]})
+        result.fetchmany(3)
+        assert _in_list_stats(metrics)["rows"] == 0
+        result.close()
+    assert _in_list_stats(metrics)["rows"] == 3
@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import select
+
+from benchmarks.query_plans import canonical_queries, check_query_plans, explain_query_plan, main, plan_violations
+from phillip.db_models.defect_event import DefectEvent
+
+
+@pytest.fixture
+def analyzed_engine(synthetic_engine):
+    with synthetic_engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    return synthetic_engine
+
+
+@pytest.mark.parametrize("name", list(canonical_queries()))
+def test_the_hot_queries_search_indexes(analyzed_engine, name):
+    result = check_query_plans(analyzed_engine, only=[name])[name]
+    assert result["plan"] and result["violations"] == []
+
+
+def test_full_scans_and_sorts_are_reported(analyzed_engine):
+    with analyzed_engine.connect() as connection:
+        plan = explain_query_plan(connection, select(DefectEvent.event_id).order_by(DefectEvent.detection_probability),
+                                  {})
+    assert any(detail.startswith("SCAN defect_event") for detail in plan_violations(plan))
+    assert "USE TEMP B-TREE FOR ORDER BY" in plan_violations(plan, ordered_by_index=True)
+    assert plan_violations(["SCAN CONSTANT ROW", "SEARCH defect_event USING INDEX ix (event_id=?)"]) == []
+
+
+def test_the_command_line_check_passes(tmp_path, capsys):
+    assert main(["--events", "500", "--database", str(tmp_path / "defects.db"), "--only", "pagination"]) == 0
+    assert capsys.readouterr().out.startswith("ok")
@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_data import START_DATE
+from data_analysis.root_cause_signal_sets import SignalIncidence, brute_force_signal_sets, mine_signal_sets
+
+COLUMNS = ["size", "signal_pattern", "count", "support", "lift", "n_events"]
+
+
+def _comparable(signal_sets: pd.DataFrame) -> pd.DataFrame:
+    return signal_sets[COLUMNS].sort_values(["size", "signal_pattern"], ignore_index=True).astype({"count": int})
+
+
+@pytest.fixture
+def incidence(synthetic_session) -> SignalIncidence:
+    return SignalIncidence.load(synthetic_session, START_DATE, signals_to_exclude=("casting_length_1",))
+
+
+@pytest.mark.parametrize("exact_event_size", [False, True])
+@pytest.mark.parametrize("min_count", [1, 3])
+def test_mined_signal_sets_match_the_brute_force_enumeration(incidence, exact_event_size, min_count):
+    mined = mine_signal_sets(incidence, max_size=3, min_count=min_count, exact_event_size=exact_event_size)
+    reference = brute_force_signal_sets(incidence, max_size=3, min_count=min_count, exact_event_size=exact_event_size)
+    assert len(reference) > 0
+    pd.testing.assert_frame_equal(_comparable(mined), _comparable(reference), check_dtype=False)
+
+
+def test_the_incidence_matrix_holds_every_root_cause_once():
+    root_causes = pd.DataFrame({"event_id": [2, 1, 1, 2, 1],
+                                "signal_id": ["b", "c", "a", "b", "a"],
+                                "importance": [0.1, 0.2, 0.3, 0.4, 0.5],
+                                "caster_id": ["1", "1", "1", "1", "1"],
+                                "strand_id": ["1_2", "1_1", "1_1", "1_2", "1_1"],
+                                "behaviour_pattern_id": ["bulging"] * 5})
+    incidence = SignalIncidence.from_frame(root_causes)
+
+    assert list(incidence.events["event_id"]) == [1, 2]
+    assert list(incidence.signal_ids) == ["a", "b", "c"]
+    assert list(incidence.event_sizes) == [2, 1]
+    assert incidence.dense_rows(pd.RangeIndex(2).to_numpy()).tolist() == [[True, False, True], [False, True, False]]
+
+
+def test_signal_sets_are_mined_per_group(incidence):
+    grouped = mine_signal_sets(incidence, max_size=2, group_by=["caster_id"])
+    for caster_id, group in grouped.groupby("caster_id"):
+        rows = incidence.events.index[incidence.events["caster_id"] == caster_id]
+        caster_incidence = SignalIncidence.from_frame(_root_causes_of_rows(incidence, rows))
+        expected = brute_force_signal_sets(caster_incidence, max_size=2)
+        pd.testing.assert_frame_equal(_comparable(group), _comparable(expected), check_dtype=False)
+
+
+def test_unknown_group_attributes_are_rejected(incidence):
+    with pytest.raises(ValueError):
+        mine_signal_sets(incidence, group_by=["slab_id"])
+
+
+def _root_causes_of_rows(incidence: SignalIncidence, rows) -> pd.DataFrame:
+    records = []
+    for row in rows:
+        event = incidence.events.iloc[row]
+        for position in range(incidence.indptr[row], incidence.indptr[row + 1]):
+            records.append({**event.to_dict(), "signal_id": incidence.signal_ids[incidence.signal_codes[position]],
+                            "importance": incidence.importance[position]})
+    return pd.DataFrame(records)
@@ -0,0 +1,80 @@
+import os
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_data import START_DATE
+from data_analysis import scheduled_jobs
+from data_analysis.defect_root_cause_pairs import Casters
+from data_analysis.scheduled_jobs import (PrecomputeConfig, SingleInstanceLock, create_scheduler,
+                                          load_root_cause_pairs, load_slab_frame, precompute_slab_figures,
+                                          precompute_slab_frames, run_job, slab_figure_path, slab_frame_path)
+
+NOW = START_DATE + timedelta(days=3)
+
+
+@pytest.fixture
+def config(tmp_path) -> PrecomputeConfig:
+    return PrecomputeConfig(artifacts_dir=tmp_path / "artifacts", figure_workers=1, slab_frames_days=2)
+
+
+def _artifacts(config: PrecomputeConfig, kind: str, suffix: str) -> set:
+    return {path.relative_to(config.artifacts_dir / kind).as_posix()
+            for path in (config.artifacts_dir / kind).rglob(f"*.{suffix}")}
+
+
+def test_root_cause_pairs_are_extracted_and_stored_per_caster(config, monkeypatch):
+    calls = []
+
+    def extract_root_cause_pairs(session, date, casters_to_filter, signals_to_filter):
+        calls.append((date, casters_to_filter, signals_to_filter))
+        return pd.DataFrame({"signal_pattern": [f"a,{casters_to_filter.value}"], "count": [1]})
+
+    monkeypatch.setattr(scheduled_jobs, "extract_root_cause_pairs", extract_root_cause_pairs)
+    assert run_job("root_cause_pairs", engine=None, config=config) == len(Casters)
+
+    # One query per caster, not every query for all casters
+    assert [caster for _, caster, _ in calls] == list(Casters)
+    assert load_root_cause_pairs(Casters.CASTER_1, config)["signal_pattern"].tolist() == ["a,1"]
+    assert load_root_cause_pairs("2c", PrecomputeConfig(artifacts_dir=config.artifacts_dir / "missing")) is None
+
+
+def test_slab_frames_and_figures_are_written_and_pruned(synthetic_engine, config):
+    assert precompute_slab_frames(synthetic_engine, config, now=NOW) > 0
+    frames = _artifacts(config, "slab_frames", "pkl")
+    [slab_frame] = sorted(frames)[:1]
+    defect, slab = slab_frame[:-len(".pkl")].split("/")
+    assert isinstance(load_slab_frame(slab, defect, config), pd.DataFrame)
+
+    assert precompute_slab_figures(synthetic_engine, config) == len(frames)
+    assert _artifacts(config, "figures", "png") == {frame.replace(".pkl", ".png") for frame in frames}
+    assert precompute_slab_figures(synthetic_engine, config) == 0
+
+    # Frames of slabs which left the window are deleted after the retention, their figures with the next render
+    stale = slab_frame_path(slab, defect, config)
+    old = (NOW - timedelta(days=30)).timestamp()
+    os.utime(stale, (old, old))
+    precompute_slab_frames(synthetic_engine, config, now=NOW + timedelta(days=20))
+    assert not stale.exists()
+    precompute_slab_figures(synthetic_engine, config)
+    assert not slab_figure_path(slab, defect, config).exists()
+
+
+def test_a_job_is_skipped_while_another_process_holds_its_lock(config, monkeypatch):
+    monkeypatch.setitem(scheduled_jobs.JOBS, "slab_figures", lambda engine, job_config: 1)
+    lock_path = config.artifacts_dir / "locks" / "slab_figures.lock"
+    with SingleInstanceLock(lock_path) as acquired:
+        assert acquired
+        assert run_job("slab_figures", engine=None, config=config) is None
+    assert run_job("slab_figures", engine=None, config=config) == 1
+
+
+def test_every_configured_job_is_scheduled_once(config):
+    scheduler = create_scheduler(engine=None, config=config)
+    jobs = {job.id: job for job in scheduler.get_jobs()}
+    assert set(jobs) == set(config.cadences)
+    assert all(job.max_instances == 1 and job.coalesce for job in jobs.values())
+
+    with pytest.raises(ValueError, match="Unknown job"):
+        create_scheduler(engine=None, config=PrecomputeConfig(cadences={"vacuum": "0 * * * *"}))
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import func, select, update
+
+from benchmarks.synthetic_data import START_DATE
+from data_analysis.dataframes import decode_signal_data_batch
+from data_analysis.defect_event_root_cause import join_defect_event_root_cause_filter_behaviour_id
+from phillip.crud.signal_data_backfill import add_signal_data_compact_column, backfill_signal_data_compact
+from phillip.db_models import signal_codec
+from phillip.db_models.defect_root_cause import DefectRootCause
+from phillip.db_models.signal_codec import (CompactSignal, compact_signal_data_enabled, decode_signal_data,
+                                            encode_signal_data, set_compact_signal_data)
+from tests.conftest import DEFECTS, STRAND_IDS, SYNTHETIC_END
+
+PAYLOAD = {"signal_id": "mould_level", "data": [["2024-01-01T00:00:00", 1.5],
+                                                ["2024-01-01T00:00:01", None],
+                                                ["2024-01-01T00:00:03", -2.25]]}
+
+
+def test_payloads_round_trip_through_the_compact_encoding():
+    decoded = decode_signal_data(encode_signal_data(PAYLOAD))
+
+    assert decoded.signal_id == "mould_level" and len(decoded) == 3 and not decoded.utc
+    assert decoded.values.dtype == np.float64 and np.isnan(decoded.values[1])
+    assert decoded.to_payload() == PAYLOAD
+    encoded_again = decode_signal_data(encode_signal_data(decoded))
+    np.testing.assert_array_equal(encoded_again.times, decoded.times)
+    np.testing.assert_array_equal(encoded_again.values, decoded.values)
+
+
+def test_timezone_aware_timestamps_are_stored_in_utc():
+    payload = {"signal_id": "speed", "data": [["2024-01-01T01:00:00+01:00", 1.0], ["2024-01-01T02:00:00+01:00", 2.0]]}
+    decoded = decode_signal_data(encode_signal_data(payload))
+
+    assert decoded.utc
+    assert list(pd.DatetimeIndex(decoded.datetimes())) == [pd.Timestamp("2024-01-01T00:00:00"),
+                                                          pd.Timestamp("2024-01-01T01:00:00")]
+    assert decoded.to_payload()["data"][0][0] == "2024-01-01T00:00:00+00:00"
+
+
+def test_float32_values_are_stored_at_reduced_precision():
+    float64 = encode_signal_data(PAYLOAD, compression_level=0)
+    float32 = encode_signal_data(PAYLOAD, value_dtype="float32", compression_level=0)
+
+    assert len(float32) < len(float64)
+    assert decode_signal_data(float32).values.dtype == np.float32
+    np.testing.assert_array_equal(decode_signal_data(float32).values, decode_signal_data(float64).values)
+
+
+@pytest.mark.parametrize("data", [[["2024-01-01T00:00:00", "high"]], [["yesterday", 1.0]]])
+def test_payloads_which_can_not_be_encoded_raise(data):
+    with pytest.raises(ValueError):
+        encode_signal_data({"signal_id": "speed", "data": data})
+
+
+def test_blobs_of_other_encodings_are_rejected():
+    with pytest.raises(ValueError):
+        decode_signal_data(b"XYZ" + encode_signal_data(PAYLOAD)[3:])
+
+
+def test_the_compact_reads_are_switched_off_by_default(monkeypatch):
+    monkeypatch.setattr(signal_codec, "_compact_signal_data", False)
+    assert compact_signal_data_enabled() is False
+    assert compact_signal_data_enabled(True) is True
+
+    set_compact_signal_data(True)
+    assert compact_signal_data_enabled() is True
+    assert compact_signal_data_enabled(False) is False
+
+
+def test_the_backfill_fills_the_compact_column_and_skips_malformed_payloads(synthetic_engine):
+    table = DefectRootCause.__table__
+    with synthetic_engine.begin() as connection:
+        connection.execute(update(table).where(table.c.event_id == 1).values(signal_data={"signal_id": "x"}))
+        connection.exec_driver_sql("UPDATE defect_root_cause SET signal_data = '{not json' WHERE event_id = 2")
+        skipped_rows = connection.execute(select(func.count()).where(table.c.event_id.in_([1, 2]))).scalar()
+        total_rows = connection.execute(select(func.count()).select_from(table)).scalar()
+
+    assert add_signal_data_compact_column(synthetic_engine) is False
+    report = backfill_signal_data_compact(synthetic_engine, batch_size=64)
+    assert report.skipped == skipped_rows and report.rows == total_rows - skipped_rows
+    assert report.compression_ratio > 1
+
+    # Interrupted or repeated runs continue with the rows which are still missing
+    assert backfill_signal_data_compact(synthetic_engine).rows == 0
+    with synthetic_engine.connect() as connection:
+        missing = connection.execute(select(table.c.event_id).where(table.c.signal_data_compact.is_(None))).scalars()
+        assert set(missing) == {1, 2}
+
+
+def test_the_compact_column_decodes_to_the_signals_of_the_json_column(synthetic_engine, synthetic_session):
+    backfill_signal_data_compact(synthetic_engine)
+    frames = {compact: join_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS,
+                                                                        START_DATE, SYNTHETIC_END,
+                                                                        compact_signal_data=compact)
+              for compact in (False, True)}
+
+    assert len(frames[True]) > 0
+    assert all(isinstance(signal_data, CompactSignal) for signal_data in frames[True]["signal_data"])
+    pd.testing.assert_frame_equal(decode_signal_data_batch(frames[True]).sort_index(),
+                                  decode_signal_data_batch(frames[False]).sort_index())
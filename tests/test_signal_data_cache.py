@@ -0,0 +1,100 @@
+import json
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.synthetic_data import START_DATE
+from data_analysis.defect_event_root_cause import join_defect_event_root_cause_filter_behaviour_id, \
+    stream_defect_event_root_cause_filter_behaviour_id
+from data_analysis.signal_data_cache import SignalDataCache
+from tests.conftest import DEFECTS, STRAND_IDS, SYNTHETIC_END
+from tests.helpers import assert_same_rows
+
+UPDATE_DATE = datetime(2024, 1, 1)
+
+
+def test_memory_hits_and_misses():
+    cache = SignalDataCache()
+    key = cache.make_key(1, "speed", UPDATE_DATE)
+
+    assert cache.get(key) is None
+    assert cache.put(key, {"signal_id": "speed", "data": []}) == '{"signal_id": "speed", "data": []}'
+    assert cache.get(key) == '{"signal_id": "speed", "data": []}'
+    assert cache.stats()["memory_hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_the_least_recently_used_payloads_are_evicted():
+    cache = SignalDataCache(max_memory_bytes=30)
+    keys = [cache.make_key(event_id, "speed", UPDATE_DATE) for event_id in range(3)]
+    cache.put(keys[0], "a" * 10)
+    cache.put(keys[1], "b" * 10)
+    cache.get(keys[0])
+    cache.put(keys[2], "c" * 10 + "x")
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == "a" * 10
+    assert cache.stats()["memory_bytes"] <= 30
+
+
+def test_keys_without_update_date_are_not_cached(tmp_path):
+    cache = SignalDataCache(cache_dir=tmp_path)
+    key = cache.make_key(1, "speed", None)
+
+    assert cache.put(key, {"x": 1}) == '{"x": 1}'
+    assert cache.get(key) is None
+    assert cache.stats()["memory_entries"] == cache.stats()["disk_entries"] == 0
+
+
+def test_disk_tier_survives_a_restart_and_promotes_hits(tmp_path):
+    key = SignalDataCache.make_key(1, "speed", UPDATE_DATE)
+    SignalDataCache(cache_dir=tmp_path).put(key, "payload")
+
+    cache = SignalDataCache(cache_dir=tmp_path)
+    assert cache.get(key) == "payload"
+    assert cache.get(key) == "payload"
+    assert (cache.stats()["disk_hits"], cache.stats()["memory_hits"]) == (1, 1)
+
+
+def test_disk_tier_keeps_its_size_limit_and_index_under_concurrent_use(tmp_path):
+    cache = SignalDataCache(cache_dir=tmp_path, max_memory_bytes=500, max_disk_bytes=2000)
+
+    def work(offset):
+        for event_id in range(offset, offset + 200):
+            key = cache.make_key(event_id % 60, "speed", UPDATE_DATE)
+            payload = cache.get(key)
+            if payload is None:
+                cache.put(key, f"{event_id % 60:03d}" * 20)
+            else:
+                assert payload == f"{event_id % 60:03d}" * 20
+
+    threads = [threading.Thread(target=work, args=(offset,)) for offset in range(0, 80, 10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    files = list(tmp_path.glob("*.json"))
+    stats = cache.stats()
+    assert stats["disk_bytes"] <= 2000
+    assert len(files) == stats["disk_entries"]
+    assert sum(path.stat().st_size for path in files) == stats["disk_bytes"]
+    cache.clear()
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_cached_extraction_returns_the_rows_of_the_uncached_one(synthetic_session, tmp_path):
+    expected = join_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS, START_DATE,
+                                                                SYNTHETIC_END)
+    cache = SignalDataCache(cache_dir=tmp_path)
+    for _ in range(2):
+        cached = join_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS, START_DATE,
+                                                                  SYNTHETIC_END, signal_data_cache=cache)
+        cached["signal_data"] = cached["signal_data"].map(json.loads)
+        assert_same_rows(cached, expected, ["event_id", "signal_id"])
+    assert cache.stats()["memory_hits"] == len(expected)
+
+    chunks = stream_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS, START_DATE,
+                                                                SYNTHETIC_END, chunk_rows=50, signal_data_cache=cache)
+    streamed = pd.concat(list(chunks), ignore_index=True)
+    assert len(streamed) == len(expected) and streamed["signal_data"].notna().all()
@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_data import START_DATE
+from data_analysis.dataframes import decode_signal_data_batch, df_from_group, split_signal_df
+from data_analysis.defect_event_root_cause import join_defect_event_root_cause_filter_behaviour_id
+from phillip.db_models.signal_codec import encode_signal_data
+from tests.conftest import DEFECTS, STRAND_IDS, SYNTHETIC_END, SYNTHETIC_SPEC
+
+
+def _payload(signal_id, points):
+    return {"signal_id": signal_id, "data": [[time, value] for time, value in points]}
+
+
+def test_payloads_are_pivoted_per_key_in_root_cause_order():
+    root_causes = pd.DataFrame({
+        "slab_id": ["S1", "S1", "S2"],
+        "signal_data": [
+            _payload("speed", [("2024-01-01T00:00:00", 1.0), ("2024-01-01T00:00:01", 2.0)]),
+            json.dumps(_payload("level", [("2024-01-01T00:00:00", 5.0)])),  # serialized like some drivers return it
+            _payload("speed", [("2024-01-01T00:00:00", 3.0)]),
+        ],
+    })
+    wide = decode_signal_data_batch(root_causes)
+
+    assert list(wide.columns) == ["speed", "level"]
+    assert wide.index.names == ["slab_id", "time"]
+    assert wide.loc[("S1", pd.Timestamp("2024-01-01T00:00:01")), "speed"] == 2.0
+    assert np.isnan(wide.loc[("S2", pd.Timestamp("2024-01-01T00:00:00")), "level"])
+    assert set(split_signal_df(wide)) == {"S1", "S2"}
+    assert list(split_signal_df(wide)["S2"].columns) == ["speed"]
+
+
+def test_json_and_compact_payloads_share_a_naive_utc_time_column():
+    root_causes = pd.DataFrame({
+        "slab_id": ["S1", "S1", "S1"],
+        "signal_data": [
+            _payload("naive", [("2024-01-01T00:00:00", 1.0), ("2024-01-01T00:00:01.5", 2.0)]),
+            _payload("offset", [("2024-01-01T01:00:00+01:00", 3.0)]),
+            encode_signal_data(_payload("compact", [("2024-01-01T00:00:00+00:00", 4.0)])),
+        ],
+    })
+    wide = decode_signal_data_batch(root_causes)
+
+    times = wide.index.get_level_values("time")
+    assert times.dtype == np.dtype("datetime64[ns]")
+    assert wide.loc[("S1", pd.Timestamp("2024-01-01")), ["naive", "offset", "compact"]].tolist() == [1.0, 3.0, 4.0]
+
+
+def test_the_last_point_of_a_duplicated_timestamp_wins():
+    group = pd.DataFrame({"signal_data": [_payload("speed", [("2024-01-01T00:00:00", 1.0),
+                                                              ("2024-01-01T00:00:00", 2.0)])]})
+    assert df_from_group(group)["speed"].tolist() == [2.0]
+
+
+@pytest.mark.parametrize("points", [[("2024-01-01T00:00:00", "n/a")], [("01/02/2024", 1.0)]])
+def test_invalid_points_raise(points):
+    with pytest.raises(ValueError):
+        decode_signal_data_batch(pd.DataFrame({"slab_id": ["S1"], "signal_data": [_payload("speed", points)]}))
+
+
+def test_synthetic_payloads_decode_to_one_column_per_signal(synthetic_session):
+    joined = join_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS, START_DATE,
+                                                              SYNTHETIC_END)
+    wide = decode_signal_data_batch(joined)
+
+    assert set(wide.columns) == set(joined["signal_id"])
+    assert wide.notna().sum().sum() == len(joined) * SYNTHETIC_SPEC.points_per_signal
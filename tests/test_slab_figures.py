@@ -0,0 +1,36 @@
+import matplotlib
+import numpy as np
+import pandas as pd
+
+from data_analysis.plots import render_slab_figures, slab_file_name
+
+
+def _slab_frames(slabs: int) -> dict:
+    index = pd.date_range("2024-01-01", periods=50, freq="s")
+    return {f"S{slab}": pd.DataFrame({"speed": np.linspace(0, 100, 50) + slab, "level": np.cos(np.arange(50))},
+                                     index=index)
+            for slab in range(slabs)}
+
+
+def test_figures_are_written_per_slab_and_format(tmp_path):
+    backend = matplotlib.get_backend()
+    results = render_slab_figures(_slab_frames(3), defect="clogging", output_dir=tmp_path / "figures",
+                                  formats=("png", "svg"), max_workers=1)
+
+    assert set(results) == {"S0", "S1", "S2"}
+    for slab_id, result in results.items():
+        assert [path.name for path in result["paths"]] == [f"{slab_id}.png", f"{slab_id}.svg"]
+        assert all(path.stat().st_size > 0 for path in result["paths"])
+    # Rendering in the calling process does not switch the backend of pyplot
+    assert matplotlib.get_backend() == backend
+
+
+def test_worker_processes_render_the_same_files(tmp_path):
+    results = render_slab_figures(_slab_frames(2), defect="clogging", output_dir=tmp_path, max_workers=2)
+    assert sorted(path.name for result in results.values() for path in result["paths"]) == ["S0.png", "S1.png"]
+
+
+def test_slab_file_names_are_safe_and_distinct():
+    assert slab_file_name("S0001") == "S0001"
+    assert "/" not in slab_file_name("A/1")
+    assert slab_file_name("A/1") != slab_file_name("A_1")
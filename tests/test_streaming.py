@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic_data import START_DATE
+from data_analysis import defect_event_root_cause as analysis
+from phillip.crud import defect_event_root_cause as crud
+from phillip.crud.streaming import PROBE_CHUNK_ROWS, iter_result_frames, stream_execution_options
+from tests.conftest import DEFECTS, STRAND_IDS, SYNTHETIC_END
+from tests.helpers import assert_same_rows
+
+KEYS = ["event_id", "signal_id"]
+
+
+@pytest.mark.parametrize("module", [crud, analysis])
+def test_stream_yields_the_rows_of_the_join(synthetic_session, module):
+    joined = module.join_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS,
+                                                                     START_DATE, SYNTHETIC_END)
+    chunks = list(module.stream_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS,
+                                                                            START_DATE, SYNTHETIC_END, chunk_rows=100))
+
+    assert len(joined) > 100
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert_same_rows(pd.concat(chunks, ignore_index=True), joined, KEYS)
+
+
+def test_stream_orders_the_rows_by_slab(synthetic_session):
+    chunks = analysis.stream_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS,
+                                                                         START_DATE, SYNTHETIC_END, chunk_rows=64)
+    slab_ids = pd.concat(list(chunks), ignore_index=True)['slab_id']
+    assert slab_ids.is_monotonic_increasing
+
+
+def test_slab_groups_hold_complete_slabs(synthetic_session):
+    joined = analysis.join_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS,
+                                                                       START_DATE, SYNTHETIC_END)
+    # Small chunks split most slabs between two chunks
+    chunks = analysis.stream_defect_event_root_cause_filter_behaviour_id(synthetic_session, DEFECTS, STRAND_IDS,
+                                                                         START_DATE, SYNTHETIC_END, chunk_rows=3)
+    groups = list(analysis.iter_slab_groups(chunks))
+
+    slab_ids = [slab_id for slab_id, _ in groups]
+    assert len(slab_ids) == len(set(slab_ids)) == joined['slab_id'].nunique()
+    sizes = joined.groupby('slab_id', observed=True).size()
+    assert all(len(group) == sizes[slab_id] for slab_id, group in groups)
+
+
+def test_memory_budget_probes_the_row_size_first(synthetic_engine):
+    with synthetic_engine.connect() as connection:
+        result = connection.execute(crud.behaviour_id_join_statement_ordered,
+                                    crud.behaviour_id_join_params(DEFECTS, STRAND_IDS, START_DATE, SYNTHETIC_END))
+        column_names = list(result.keys())
+        rows = result.fetchall()
+    with synthetic_engine.connect() as connection:
+        result = connection.execute(crud.behaviour_id_join_statement_ordered,
+                                    crud.behaviour_id_join_params(DEFECTS, STRAND_IDS, START_DATE, SYNTHETIC_END),
+                                    execution_options=stream_execution_options(1000))
+        chunks = list(iter_result_frames(result, column_names, chunk_rows=1000, max_chunk_bytes=64 * 1024))
+
+    assert len(chunks[0]) == min(PROBE_CHUNK_ROWS, len(rows))
+    assert sum(len(chunk) for chunk in chunks) == len(rows)
+    # The later chunks are sized by the bytes per row of the previous chunk
+    assert all(len(chunk) < 1000 for chunk in chunks[1:])
+
+
+def test_invalid_chunk_sizes_are_rejected():
+    with pytest.raises(ValueError):
+        stream_execution_options(0)
+    with pytest.raises(ValueError):
+        next(iter_result_frames(None, [], chunk_rows=10, max_chunk_bytes=0))
@@ -0,0 +1,60 @@
+import sqlalchemy
+from sqlalchemy import select
+
+from benchmarks.synthetic_data import (SIGNALS, START_DATE, SyntheticDataSpec, create_synthetic_database,
+                                       generate_synthetic_data, slab_ids)
+from phillip.db_models.defect_event import DefectEvent
+from phillip.db_models.defect_root_cause import DefectRootCause
+
+SPEC = SyntheticDataSpec(events=60, points_per_signal=5, days=3)
+
+
+def _rows(engine, model) -> list:
+    table = model.__table__
+    with engine.connect() as connection:
+        return connection.execute(select(table).order_by(*table.primary_key.columns)).fetchall()
+
+
+def test_the_same_spec_generates_the_same_rows_for_any_batch_size(tmp_path):
+    engines = [sqlalchemy.create_engine(f"sqlite:///{tmp_path / f'{batch_size}.db'}") for batch_size in (7, 5_000)]
+    counts = [generate_synthetic_data(engine, SPEC, batch_size=batch_size)
+              for engine, batch_size in zip(engines, (7, 5_000))]
+
+    assert counts[0] == counts[1] and counts[0]["defect_event"] == SPEC.events
+    for model in (DefectEvent, DefectRootCause):
+        assert _rows(engines[0], model) == _rows(engines[1], model)
+    events = _rows(engines[0], DefectEvent)
+    assert events[0].create_date == START_DATE and {event.slab_id for event in events[:SPEC.events_per_slab]} == {
+        "S00000000"}
+    assert len(slab_ids(engines[0])) == SPEC.events // SPEC.events_per_slab and slab_ids(engines[0], limit=2) == [
+        "S00000000", "S00000001"]
+    for engine in engines:
+        engine.dispose()
+
+
+def test_root_causes_hold_known_signals_within_the_limits_of_the_spec(tmp_path):
+    engine = create_synthetic_database(tmp_path / "defects.db", SyntheticDataSpec(events=40, points_per_signal=5,
+                                                                                  with_compact_signal_data=True))
+    root_causes = _rows(engine, DefectRootCause)
+    engine.dispose()
+
+    per_event = {}
+    for root_cause in root_causes:
+        per_event[root_cause.event_id] = per_event.get(root_cause.event_id, 0) + 1
+        assert root_cause.signal_id in SIGNALS and len(root_cause.signal_data["data"]) == 5
+        assert root_cause.signal_data_compact.to_payload()["data"] == [
+            [time, value] for time, value in root_cause.signal_data["data"]]
+    assert len(per_event) == 40 and max(per_event.values()) <= SyntheticDataSpec.max_root_causes_per_event
+
+
+def test_an_existing_database_is_reused_for_the_same_spec_only(tmp_path):
+    path = tmp_path / "defects.db"
+    create_synthetic_database(path, SPEC).dispose()
+    modified = path.stat().st_mtime_ns
+
+    create_synthetic_database(path, SPEC).dispose()
+    assert path.stat().st_mtime_ns == modified
+
+    engine = create_synthetic_database(path, SyntheticDataSpec(events=20, points_per_signal=5, days=3))
+    assert len(_rows(engine, DefectEvent)) == 20
+    engine.dispose()